@@ -1,10 +1,10 @@
+import numpy as np
 import pandas as pd
-import psycopg2
-from .config import DB_CONFIG
+from .db_pool import session
+from .features import get_match_features, get_statistic_keys
 
 def get_matches():
     """Recupera i match dal database inclusi i risultati parziali."""
-    conn = psycopg2.connect(**DB_CONFIG)
     query = """
     SELECT 
         id, home_team, away_team, 
@@ -13,70 +13,68 @@ def get_matches():
         tournament, start_timestamp 
     FROM matches
     """
-    df = pd.read_sql(query, conn)
-    conn.close()
+    with session() as conn:
+        df = pd.read_sql(query, conn)
     return df
 
-def get_stats_by_period(stats_list=['Expected goals', 'Ball possession'], period='1ST'):
-    """Recupera statistiche specifiche per un determinato periodo dalla tabella match_statistics_column."""
-    conn = psycopg2.connect(**DB_CONFIG)
-    placeholders = ', '.join(['%s'] * len(stats_list))
-    query = f"""
-    SELECT match_id, name, homeValue, awayValue
-    FROM match_statistics_column
-    WHERE period = %s AND name IN ({placeholders})
+def _wide_stats(names, period, conn):
+    """
+    Statistiche ``names`` (nomi di match_statistics_column) lette dalla tabella
+    wide match_features_wide: una riga per match con almeno un valore, colonne
+    (homevalue|awayvalue, nome) con i nomi in ordine alfabetico.
     """
-    params = [period] + stats_list
-    df_s = pd.read_sql(query, conn, params=params)
-    conn.close()
+    keys = get_statistic_keys(names, period=period, conn=conn)
+    if not keys:
+        return pd.DataFrame()
+    df = get_match_features(keys=sorted(set(keys.values())), period=period, conn=conn).set_index('match_id')
+    # Nomi la cui chiave non ha ancora colonne nella tabella wide: nessun valore
+    keys = {name: key for name, key in keys.items() if f"home_{key}" in df.columns}
+    columns = {
+        (f"{side}value", name): df[f"{side}_{keys[name]}"]
+        for side in ('home', 'away') for name in sorted(keys)
+    }
+    if not columns:
+        return pd.DataFrame()
+    return pd.DataFrame(columns, index=df.index).dropna(how='all')
+
+def get_stats_by_period(stats_list=['Expected goals', 'Ball possession'], period='1ST'):
+    """Recupera statistiche specifiche per un determinato periodo (dalla tabella wide, già una riga per match)."""
+    with session() as conn:
+        df_wide = _wide_stats(stats_list, period, conn)
     
-    if df_s.empty: return pd.DataFrame()
+    if df_wide.empty: return pd.DataFrame()
 
-    # Rimuoviamo eventuali duplicati per lo stesso match/statistica (data integrity)
-    df_s = df_s.drop_duplicates(subset=['match_id', 'name'], keep='last')
-
-    # Riorganizziamo il dataframe per avere le statistiche come colonne
-    df_pivot = df_s.pivot(index='match_id', columns='name', values=['homevalue', 'awayvalue'])
-    df_pivot.columns = [f"{col[1].lower().replace(' ', '_')}_{col[0]}" for col in df_pivot.columns]
-    return df_pivot.reset_index()
+    # Stessi nomi di colonna del vecchio pivot: <nome_statistica>_<homevalue|awayvalue>
+    df_wide.columns = [f"{name.lower().replace(' ', '_')}_{value}" for value, name in df_wide.columns]
+    return df_wide.reset_index()
 
 def get_stats_dataset(stats_list, period='ALL'):
     """
     Recupera un dataset pronto per la regressione lineare o LSTM.
     Restituisce un dataframe dove ogni riga è la performance di UNA squadra in UN match.
     """
-    conn = psycopg2.connect(**DB_CONFIG)
     # Rimuoviamo eventuali colonne di metadata dalla lista delle statistiche per evitare duplicati
     clean_stats = [s for s in stats_list if s not in ['match_id', 'team', 'opponent', 'is_home', 'date', 'start_timestamp']]
     
-    placeholders = ', '.join(['%s'] * len(clean_stats))
-    query = f"""
-    SELECT m.id as match_id, m.home_team, m.away_team, m.start_timestamp, msc.name, msc.homevalue, msc.awayvalue
-    FROM matches m
-    JOIN match_statistics_column msc ON m.id = msc.match_id
-    WHERE msc.period = %s AND msc.name IN ({placeholders})
-    """
-    params = [period] + clean_stats
-    df = pd.read_sql(query, conn, params=params)
-    conn.close()
+    # Statistiche già una riga per match dalla tabella wide (niente pivot in pandas)
+    with session() as conn:
+        df_wide = _wide_stats(clean_stats, period, conn)
+        if df_wide.empty: return pd.DataFrame()
+        df_matches = pd.read_sql(
+            "SELECT id AS match_id, home_team, away_team, start_timestamp FROM matches WHERE id = ANY(%s)",
+            conn, params=[df_wide.index.tolist()]
+        ).set_index('match_id')
     
-    if df.empty: return pd.DataFrame()
-    
-    # Pulizia valori (rimozione testi tra parentesi come "5(2)")
-    df['homevalue'] = df['homevalue'].astype(str).str.split('(').str[0].str.strip().apply(pd.to_numeric, errors='coerce')
-    df['awayvalue'] = df['awayvalue'].astype(str).str.split('(').str[0].str.strip().apply(pd.to_numeric, errors='coerce')
-    
-    # Pivot per avere le statistiche come colonne
-    pivoted = df.pivot_table(index=['match_id', 'home_team', 'away_team', 'start_timestamp'], columns='name', values=['homevalue', 'awayvalue'])
+    # homevalue/awayvalue sono già FLOAT: il valore tra parentesi di "5(2)" è in homesecondary/awaysecondary
     
     # Creazione dataset "Flat" (due righe per match: una per home, una per away)
-    home_data = pivoted.xs('homevalue', axis=1, level=0).reset_index()
+    home_data = df_matches.join(df_wide['homevalue'], how='inner').reset_index()
     home_data['team'] = home_data['home_team']
     home_data['opponent'] = home_data['away_team']
     home_data['date'] = pd.to_datetime(home_data['start_timestamp'], unit='s')
     home_data['is_home'] = 1
     
-    away_data = pivoted.xs('awayvalue', axis=1, level=0).reset_index()
+    away_data = df_matches.join(df_wide['awayvalue'], how='inner').reset_index()
     away_data['team'] = away_data['away_team']
     away_data['opponent'] = away_data['home_team']
     away_data['date'] = pd.to_datetime(away_data['start_timestamp'], unit='s')
@@ -85,19 +83,23 @@ def get_stats_dataset(stats_list, period='ALL'):
     # Uniamo i due set di dati
     cols_to_keep = clean_stats + ['match_id', 'team', 'opponent', 'is_home', 'date']
     final_df = pd.concat([
-        home_data[cols_to_keep],
-        away_data[cols_to_keep]
+        home_data.reindex(columns=cols_to_keep),
+        away_data.reindex(columns=cols_to_keep)
     ], ignore_index=True)
     
     return final_df
 
-def get_matches_by_partial_score(target_h, target_a, minute):
+def get_matches_by_partial_score(target_h, target_a, minute, source='timeline'):
     """
     Trova i match che avevano un determinato punteggio (target_h - target_a) al minuto indicato.
+
+    Con source='timeline' usa la tabella match_score_timeline (ricerca per
+    intervallo su indice); con source='incidents' ricalcola il punteggio
+    dagli incidenti come in origine.
     """
-    conn = psycopg2.connect(**DB_CONFIG)
-    
-    if target_h == 0 and target_a == 0:
+    if source == 'timeline':
+        df_res = _get_matches_by_partial_score_timeline(target_h, target_a, minute)
+    elif target_h == 0 and target_a == 0:
         # Caso 0-0: Match dove non ci sono goal segnati entro quel minuto
         query = """
         SELECT m.id, m.home_team, m.away_team, 0 as score_h, 0 as score_a, m.home_score as final_h, m.away_score as final_a
@@ -109,7 +111,8 @@ def get_matches_by_partial_score(target_h, target_a, minute):
               AND mic.time <= %s
         )
         """
-        df_res = pd.read_sql(query, conn, params=[minute])
+        with session() as conn:
+            df_res = pd.read_sql(query, conn, params=[minute])
     else:
         # Caso con goal: Cerchiamo l'ultimo goal avvenuto entro il minuto
         query = """
@@ -129,42 +132,157 @@ def get_matches_by_partial_score(target_h, target_a, minute):
         JOIN LastGoal lg ON m.id = lg.match_id
         WHERE lg.rn = 1 AND lg.home_score = %s AND lg.away_score = %s
         """
-        df_res = pd.read_sql(query, conn, params=[minute, target_h, target_a])
-        
-    conn.close()
+        with session() as conn:
+            df_res = pd.read_sql(query, conn, params=[minute, target_h, target_a])
     
-    # Assicuriamoci che i punteggi siano numerici
-    for col in ['score_h', 'score_a', 'final_h', 'final_a']:
-        if col in df_res.columns:
-            df_res[col] = pd.to_numeric(df_res[col], errors='coerce')
-            
     return df_res
 
+def _get_matches_by_partial_score_timeline(target_h, target_a, minute):
+    """Punteggio al minuto indicato letto da match_score_timeline."""
+    if target_h == 0 and target_a == 0:
+        # I match senza incidenti non hanno timeline: come in origine contano come 0-0
+        query = """
+        SELECT m.id, m.home_team, m.away_team, 0 as score_h, 0 as score_a, m.home_score as final_h, m.away_score as final_a
+        FROM matches m
+        LEFT JOIN match_score_timeline t
+          ON t.match_id = m.id AND t.from_minute <= %s AND (t.to_minute IS NULL OR t.to_minute > %s)
+        WHERE t.match_id IS NULL OR (t.home_score = 0 AND t.away_score = 0)
+        """
+        params = [minute, minute]
+    else:
+        query = """
+        SELECT m.id, m.home_team, m.away_team, t.home_score as score_h, t.away_score as score_a, m.home_score as final_h, m.away_score as final_a
+        FROM match_score_timeline t
+        JOIN matches m ON m.id = t.match_id
+        WHERE t.home_score = %s AND t.away_score = %s
+          AND t.from_minute <= %s AND (t.to_minute IS NULL OR t.to_minute > %s)
+        """
+        params = [target_h, target_a, minute, minute]
+    with session() as conn:
+        return pd.read_sql(query, conn, params=params)
+
+def get_score_counts_by_minute(first_minute=1, last_minute=90):
+    """
+    Numero di match per punteggio ad ogni minuto, in un'unica query su match_score_timeline.
+    Restituisce un dataframe con colonne minute, home_score, away_score, n_matches.
+    I match senza incidenti (senza timeline) non sono conteggiati.
+    """
+    query = """
+    SELECT g.minute, t.home_score, t.away_score, COUNT(*) AS n_matches
+    FROM generate_series(%s, %s) AS g(minute)
+    JOIN match_score_timeline t
+      ON t.from_minute <= g.minute AND (t.to_minute IS NULL OR t.to_minute > g.minute)
+    GROUP BY g.minute, t.home_score, t.away_score
+    ORDER BY g.minute, t.home_score, t.away_score
+    """
+    with session() as conn:
+        return pd.read_sql(query, conn, params=[first_minute, last_minute])
+
+SCORE_CODE_BASE = 1000  # punteggio (h, a) codificato come h * SCORE_CODE_BASE + a
+
+def _score_frequency_table(minutes, states, finals):
+    """Conteggi e distribuzione dei risultati finali per (minuto, punteggio) da matrici di codici."""
+    n_matches, n_minutes = states.shape
+    flat = pd.DataFrame({
+        'minute': np.tile(minutes, n_matches),
+        'state': states.ravel(),
+        'final': np.repeat(finals, n_minutes),
+    })
+    counts = flat.groupby(['minute', 'state', 'final']).size().rename('count').reset_index()
+    counts['n_matches'] = counts.groupby(['minute', 'state'])['count'].transform('sum')
+    counts['share'] = counts['count'] / counts['n_matches']
+
+    counts['score_h'], counts['score_a'] = np.divmod(counts['state'].to_numpy(), SCORE_CODE_BASE)
+    counts['final_h'], counts['final_a'] = np.divmod(counts['final'].to_numpy(), SCORE_CODE_BASE)
+    return counts[['minute', 'score_h', 'score_a', 'final_h', 'final_a', 'count', 'n_matches', 'share']]
+
+def get_score_transition_matrix(first_minute=1, last_minute=90):
+    """
+    Matrice di transizione punteggio parziale → risultato finale per ogni minuto.
+
+    Per ogni minuto M in [first_minute, last_minute] e per ogni punteggio
+    (score_h, score_a) in essere al minuto M (gol con time <= M, come in
+    get_matches_by_partial_score) restituisce il numero di match per ciascun
+    risultato finale (count), il totale dei match con quel punteggio
+    (n_matches) e la quota (share = count / n_matches).
+
+    Gli incidenti vengono letti una sola volta e lo stato di ogni match ad
+    ogni minuto è calcolato con operazioni vettoriali (pivot + ffill), invece
+    di una query per ogni combinazione (punteggio, minuto).
+    """
+    matches_query = "SELECT id AS match_id, home_score, away_score FROM matches"
+    goals_query = """
+    SELECT match_id, time, added_time, home_score, away_score
+    FROM match_incidents_column
+    WHERE incident_type ILIKE '%%goal%%'
+      AND time IS NOT NULL AND time <= %s
+      AND home_score IS NOT NULL AND away_score IS NOT NULL
+    """
+    with session() as conn:
+        df_matches = pd.read_sql(matches_query, conn)
+        df_goals = pd.read_sql(goals_query, conn, params=[last_minute])
+
+    # Solo match con risultato finale (i punteggi mancanti sono NULL)
+    final_h = df_matches['home_score']
+    final_a = df_matches['away_score']
+    valid = final_h.notna() & final_a.notna()
+    match_ids = df_matches.loc[valid, 'match_id'].to_numpy()
+    finals = (final_h[valid] * SCORE_CODE_BASE + final_a[valid]).astype(np.int64).to_numpy()
+
+    minutes = np.arange(first_minute, last_minute + 1)
+    states = np.zeros((len(match_ids), len(minutes)), dtype=np.int64)  # nessun gol = 0-0
+
+    if not df_goals.empty and len(match_ids):
+        # I gol prima di first_minute determinano lo stato al primo minuto
+        df_goals['minute'] = df_goals['time'].clip(lower=first_minute)
+        df_goals['state'] = df_goals['home_score'].astype(np.int64) * SCORE_CODE_BASE + df_goals['away_score'].astype(np.int64)
+        # Con più gol nello stesso minuto vale l'ultimo (added_time NULL = più recente, come in SQL DESC)
+        df_goals = df_goals.sort_values(['match_id', 'minute', 'time', 'added_time'], na_position='last')
+        last_goals = df_goals.drop_duplicates(['match_id', 'minute'], keep='last')
+
+        grid = last_goals.pivot(index='match_id', columns='minute', values='state')
+        grid = grid.reindex(index=match_ids, columns=minutes).ffill(axis=1).fillna(0)
+        states = grid.to_numpy(dtype=np.int64)
+
+    return _score_frequency_table(minutes, states, finals)
+
+def get_ht_transition_matrix():
+    """
+    Distribuzione dei risultati finali per ogni punteggio del primo tempo
+    (home_score_ht, away_score_ht), calcolata in un'unica query + group-by.
+    """
+    query = """
+    SELECT home_score_ht AS score_h, away_score_ht AS score_a, home_score AS final_h, away_score AS final_a
+    FROM matches
+    WHERE home_score_ht IS NOT NULL AND away_score_ht IS NOT NULL
+    """
+    with session() as conn:
+        df = pd.read_sql(query, conn)
+    df = df.dropna()
+
+    counts = df.groupby(['score_h', 'score_a', 'final_h', 'final_a']).size().rename('count').reset_index()
+    counts['n_matches'] = counts.groupby(['score_h', 'score_a'])['count'].transform('sum')
+    counts['share'] = counts['count'] / counts['n_matches']
+    return counts.astype({'score_h': int, 'score_a': int, 'final_h': int, 'final_a': int})
+
 def get_matches_by_ht_score(target_h, target_a):
     """
     Trova i match che hanno un determinato punteggio al primo tempo usando le colonne home_score_ht e away_score_ht.
     """
-    conn = psycopg2.connect(**DB_CONFIG)
     query = """
     SELECT id, home_team, away_team, home_score_ht, away_score_ht, home_score as final_h, away_score as final_a
     FROM matches
     WHERE home_score_ht = %s AND away_score_ht = %s
     """
-    df_res = pd.read_sql(query, conn, params=[target_h, target_a])
-    conn.close()
+    with session() as conn:
+        df_res = pd.read_sql(query, conn, params=[target_h, target_a])
     
-    # Assicuriamoci che i punteggi siano numerici per evitare errori nei calcoli
-    for col in ['home_score_ht', 'away_score_ht', 'final_h', 'final_a']:
-        if col in df_res.columns:
-            df_res[col] = pd.to_numeric(df_res[col], errors='coerce')
-            
     return df_res
 
 def get_matches_by_date(date_str):
     """
     Recupera i match di una determinata data (YYYY-MM-DD).
     """
-    conn = psycopg2.connect(**DB_CONFIG)
     # Convertiamo la stringa data in range di timestamp
     start_ts = int(pd.to_datetime(date_str).timestamp())
     end_ts = start_ts + 86400  # + 24 ore
@@ -175,15 +293,14 @@ def get_matches_by_date(date_str):
     FROM matches
     WHERE start_timestamp >= %s AND start_timestamp < %s
     """
-    df_res = pd.read_sql(query, conn, params=[start_ts, end_ts])
-    conn.close()
+    with session() as conn:
+        df_res = pd.read_sql(query, conn, params=[start_ts, end_ts])
     return df_res
 
 def get_first_match_with_xg():
     """
     Ritorna il primo match (il più vecchio) che ha dati xG disponibili.
     """
-    conn = psycopg2.connect(**DB_CONFIG)
     query = """
     SELECT m.*
     FROM matches m
@@ -192,8 +309,8 @@ def get_first_match_with_xg():
     ORDER BY m.start_timestamp ASC
     LIMIT 1
     """
-    df_res = pd.read_sql(query, conn)
-    conn.close()
+    with session() as conn:
+        df_res = pd.read_sql(query, conn)
     
     if not df_res.empty:
         df_res['date_readable'] = pd.to_datetime(df_res['start_timestamp'], unit='s').dt.strftime('%Y-%m-%d %H:%M')
@@ -202,25 +319,22 @@ def get_first_match_with_xg():
 
 def get_match_incidents(match_id):
     """Recupera tutti gli incidenti per un determinato match."""
-    conn = psycopg2.connect(**DB_CONFIG)
     query = "SELECT * FROM match_incidents_column WHERE match_id = %s ORDER BY time ASC, added_time ASC"
-    df = pd.read_sql(query, conn, params=[int(match_id)])
-    conn.close()
+    with session() as conn:
+        df = pd.read_sql(query, conn, params=[int(match_id)])
     return df
 
 def get_match_statistics(match_id):
     """Recupera tutte le statistiche per un determinato match."""
-    conn = psycopg2.connect(**DB_CONFIG)
     query = "SELECT * FROM match_statistics_column WHERE match_id = %s"
-    df = pd.read_sql(query, conn, params=[int(match_id)])
-    conn.close()
+    with session() as conn:
+        df = pd.read_sql(query, conn, params=[int(match_id)])
     return df
 
 def get_match_by_team_and_date(team_name, date_str):
     """
     Trova un match basato sul nome della squadra (anche parziale) e la data (YYYY-MM-DD).
     """
-    conn = psycopg2.connect(**DB_CONFIG)
     start_ts = int(pd.to_datetime(date_str).timestamp())
     end_ts = start_ts + 86400
     
@@ -230,8 +344,8 @@ def get_match_by_team_and_date(team_name, date_str):
       AND start_timestamp >= %s AND start_timestamp < %s
     """
     search_term = f"%{team_name}%"
-    df = pd.read_sql(query, conn, params=[search_term, search_term, start_ts, end_ts])
-    conn.close()
+    with session() as conn:
+        df = pd.read_sql(query, conn, params=[search_term, search_term, start_ts, end_ts])
     
     if not df.empty:
         df['date_readable'] = pd.to_datetime(df['start_timestamp'], unit='s').dt.strftime('%Y-%m-%d %H:%M')
@@ -239,11 +353,65 @@ def get_match_by_team_and_date(team_name, date_str):
     return df
 
 def get_len_table(table_name):
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
     query = f"SELECT COUNT(*) FROM {table_name}"
-    cursor.execute(query)
-    count = cursor.fetchone()[0]
-    cursor.close()
-    conn.close()
+    with session() as conn, conn.cursor() as cursor:
+        cursor.execute(query)
+        count = cursor.fetchone()[0]
     return int(count)
+
+def load_snapshot(table, columns=None, filters=None, start_date=None, end_date=None):
+    """
+    Legge una tabella ('matches', 'statistics', 'incidents', 'graphics') dallo
+    snapshot Parquet locale invece che da PostgreSQL (vedi modules/snapshot.py).
+    Solo le colonne richieste e le partizioni/righe che soddisfano i filtri vengono lette.
+    """
+    from .snapshot import read_snapshot
+    return read_snapshot(table, columns=columns, filters=filters, start_date=start_date, end_date=end_date)
+
+def load_stats_by_period_snapshot(stats_list=['Expected goals', 'Ball possession'], period='1ST', start_date=None, end_date=None):
+    """Come get_stats_by_period, ma letto dallo snapshot Parquet."""
+    df_s = load_snapshot(
+        'statistics',
+        columns=['match_id', 'name', 'home_value', 'away_value'],
+        filters=[('period', '=', period), ('name', 'in', list(stats_list))],
+        start_date=start_date, end_date=end_date,
+    )
+    if df_s.empty: return pd.DataFrame()
+
+    df_s = df_s.rename(columns={'home_value': 'homevalue', 'away_value': 'awayvalue'})
+    df_s = df_s.drop_duplicates(subset=['match_id', 'name'], keep='last')
+    df_pivot = df_s.pivot(index='match_id', columns='name', values=['homevalue', 'awayvalue'])
+    df_pivot.columns = [f"{col[1].lower().replace(' ', '_')}_{col[0]}" for col in df_pivot.columns]
+    return df_pivot.reset_index()
+
+def get_cluster_models():
+    """Versioni dei modelli di clustering registrate (la più recente per prima)."""
+    query = """
+    SELECT version, n_clusters, feature_hash, created_at,
+           (SELECT COUNT(*) FROM match_clusters c WHERE c.model_version = m.version) AS n_matches
+    FROM cluster_models m
+    ORDER BY created_at DESC
+    """
+    with session() as conn:
+        return pd.read_sql(query, conn)
+
+def get_match_clusters(model_version=None, with_matches=False):
+    """
+    Assegnazioni dei match ai cluster (match_id, model_version, cluster, distance)
+    salvate da match_clustering.py, senza rifare il fit. Senza ``model_version``
+    usa il modello registrato più di recente; con ``with_matches`` aggiunge
+    squadre e risultato da matches.
+    """
+    columns = "c.match_id, c.model_version, c.cluster, c.distance"
+    joins = ""
+    if with_matches:
+        columns += ", m.home_team, m.away_team, m.home_score, m.away_score, m.start_timestamp"
+        joins = "JOIN matches m ON m.id = c.match_id"
+    query = f"""
+    SELECT {columns}
+    FROM match_clusters c
+    {joins}
+    WHERE c.model_version = COALESCE(%s, (SELECT version FROM cluster_models ORDER BY created_at DESC LIMIT 1))
+    """
+    with session() as conn:
+        return pd.read_sql(query, conn, params=[model_version])
@@ -0,0 +1,432 @@
+"""
+Modello di clustering dei match persistente e aggiornabile in modo incrementale.
+
+Il refit completo (StandardScaler + KMeans su tutti i match) resta il modo
+per costruire il modello; il ``ClusterModel`` risultante viene salvato su
+disco (joblib) con scaler, centroidi, colonne delle feature e match già
+assegnati. Le esecuzioni successive possono allora:
+
+- assegnare i soli match nuovi al centroide più vicino (``assign``),
+  senza rileggere né riscalare l'intero database;
+- aggiornare i centroidi in stile MiniBatchKMeans: i match assegnati si
+  accumulano (somma e conteggio per cluster) e ogni ``update_every`` match
+  ogni centroide si sposta verso la media dei nuovi punti con peso
+  proporzionale al loro numero rispetto a quelli già visti.
+
+Lo scaler resta quello del refit completo: cambiarlo sposterebbe lo spazio
+in cui sono espressi i centroidi. Con la crescita del database conviene
+comunque un refit completo periodico.
+
+Per scegliere il numero di cluster, ``sweep_k`` costruisce e scala la
+matrice delle feature una volta sola, la condivide con un pool di processi
+come file .npy in memory map e adatta un KMeans per ogni k in parallelo,
+riportando inerzia, silhouette (su un campione) e tempi e salvando ogni
+modello.
+
+Ogni refit produce una nuova versione (``<data>-<ora>-k<n>``): l'artefatto
+versionato (``models/versions/``) è accompagnato da un manifest JSON con lo
+schema delle feature (colonne e hash), la versione è registrata in
+``cluster_models`` e le assegnazioni finiscono in ``match_clusters``
+(match_id, model_version, cluster, distance), scritte in blocco con COPY.
+Ogni aggiornamento incrementale dei centroidi crea una nuova versione
+(con ``parent_version`` nel manifest), così le righe di ``match_clusters``
+di una versione sono sempre state calcolate con gli stessi centroidi. Il
+modello ricorda anche lo schema delle feature: se le colonne cambiano
+(nuove chiavi di statistica) ``check_schema`` rifiuta l'assegnazione e
+serve un refit completo.
+
+Come ``db_pool``, il modulo si può importare sia dal package ``modules``
+sia direttamente dagli script in ``core/``.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+from psycopg2 import extras
+from threadpoolctl import threadpool_limits
+
+try:
+    from .db_pool import session
+    from . import features
+    from . import momentum
+except ImportError:
+    from db_pool import session
+    import features
+    import momentum
+
+MODEL_DIR = os.environ.get(
+    'PYSOFA_MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+)
+MODEL_FILE = 'match_clusters.joblib'
+DEFAULT_CLUSTERS = 4
+UPDATE_EVERY = 1000  # match assegnati prima di un aggiornamento dei centroidi
+SWEEP_DIR = 'sweep'
+VERSIONS_DIR = 'versions'
+SILHOUETTE_SAMPLE = 10000  # match usati per la silhouette (O(n²) sul campione)
+
+
+def build_features(df_stats, points):
+    """Matrice delle feature per match: statistiche wide (periodo ALL) e riassunto del momentum.
+
+    ``points`` sono i punti del momentum di ``momentum.load_momentum_points``:
+    il riassunto usa tutti i graphPoints, come il calcolo originale.
+    """
+    # Le statistiche arrivano già pivotate da match_features_wide (colonne home_<key>/away_<key>)
+    df_features = df_stats.set_index('match_id')
+
+    # Statistiche del momentum calcolate in blocco su tutti i punti
+    # (colonne presenti anche se vuote, così lo schema delle feature non cambia)
+    df_features = df_features.join(momentum.momentum_summary(points), how='left')
+
+    # Pulizia: riempiamo i valori mancanti con 0
+    return df_features.fillna(0)
+
+
+def load_features(match_ids=None, conn=None):
+    """Legge dal database e costruisce la matrice delle feature (di tutti i match o di ``match_ids``)."""
+    with session(conn) as conn:
+        df_stats = features.get_match_features(period='ALL', match_ids=match_ids, conn=conn)
+        points = momentum.load_momentum_points(match_ids=match_ids, conn=conn)
+    return build_features(df_stats, points)
+
+
+def candidate_match_ids(conn=None):
+    """Match con feature disponibili (periodo ALL)."""
+    with session(conn) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT match_id FROM match_features_wide WHERE period = 'ALL';")
+        return np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+
+
+def model_path(name=MODEL_FILE, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, name)
+
+
+def sweep_model_path(n_clusters, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, SWEEP_DIR, f"match_clusters_k{n_clusters}.joblib")
+
+
+def version_path(version, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, VERSIONS_DIR, f"match_clusters_{version}.joblib")
+
+
+def feature_hash(columns):
+    """Hash dello schema delle feature (nomi e ordine delle colonne)."""
+    return hashlib.sha1('\n'.join(columns).encode('utf-8')).hexdigest()[:16]
+
+
+def new_version(n_clusters, created_at=None):
+    """Identificativo di versione ``<data>-<ora>.<ms>-k<n>`` (UTC)."""
+    created_at = time.time() if created_at is None else created_at
+    millis = int((created_at % 1) * 1000)
+    return time.strftime('%Y%m%d-%H%M%S', time.gmtime(created_at)) + f".{millis:03d}-k{n_clusters}"
+
+
+class FeatureSchemaError(ValueError):
+    """Le feature disponibili non corrispondono allo schema con cui è stato adattato il modello."""
+
+
+class ClusterModel:
+    """Scaler e centroidi di un clustering KMeans, con aggiornamento incrementale dei centroidi."""
+
+    def __init__(self, scaler, centers, columns, counts, assigned=None, update_every=UPDATE_EVERY, version=None):
+        self.created_at = time.time()
+        self.version = version or new_version(len(centers), self.created_at)
+        self.parent_version = None
+        self.scaler = scaler
+        self.centers = np.asarray(centers, dtype=np.float64)
+        self.columns = list(columns)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.assigned = np.asarray([] if assigned is None else assigned, dtype=np.int64)
+        self.update_every = update_every
+        self.pending_sums = np.zeros_like(self.centers)
+        self.pending_counts = np.zeros(len(self.centers), dtype=np.int64)
+
+    @property
+    def n_clusters(self):
+        return len(self.centers)
+
+    @property
+    def feature_hash(self):
+        return feature_hash(self.columns)
+
+    def manifest(self):
+        """Metadati dell'artefatto: versione, numero di cluster e schema delle feature."""
+        return {
+            'version': self.version,
+            'parent_version': self.parent_version,
+            'n_clusters': self.n_clusters,
+            'created_at': self.created_at,
+            'n_matches': int(len(self.assigned)),
+            'feature_hash': self.feature_hash,
+            'features': self.columns,
+        }
+
+    @classmethod
+    def fit(cls, df_features, n_clusters=DEFAULT_CLUSTERS, random_state=42, n_init=10):
+        """Refit completo: StandardScaler + KMeans su tutte le righe di ``df_features``.
+
+        Ritorna il modello e le etichette (array allineato alle righe).
+        """
+        logging.info(f"Esecuzione KMeans con {n_clusters} cluster su {len(df_features)} match...")
+        # Scaling dei dati (fondamentale per KMeans)
+        scaler = StandardScaler()
+        scaled = scaler.fit_transform(df_features.to_numpy(dtype=np.float64))
+
+        kmeans = KMeans(n_clusters=n_clusters, random_state=random_state, n_init=n_init)
+        labels = kmeans.fit_predict(scaled)
+        return cls.from_kmeans(scaler, kmeans, labels, df_features.columns, df_features.index), labels
+
+    @classmethod
+    def from_kmeans(cls, scaler, kmeans, labels, columns, match_ids):
+        counts = np.bincount(labels, minlength=kmeans.n_clusters)
+        return cls(scaler, kmeans.cluster_centers_, columns, counts, assigned=np.asarray(match_ids))
+
+    def check_schema(self, columns):
+        """Solleva FeatureSchemaError se ``columns`` non ha lo schema delle feature del modello."""
+        if feature_hash(list(columns)) != self.feature_hash:
+            added = sorted(set(columns) - set(self.columns))
+            missing = sorted(set(self.columns) - set(columns))
+            raise FeatureSchemaError(
+                f"Schema delle feature cambiato rispetto al modello {self.version} "
+                f"(nuove: {added[:5]}, mancanti: {missing[:5]}): serve un refit completo."
+            )
+
+    def transform(self, df_features):
+        """Feature scalate con lo scaler del modello; le colonne nuove vengono ignorate, quelle mancanti valgono 0."""
+        aligned = df_features.reindex(columns=self.columns, fill_value=0)
+        return self.scaler.transform(aligned.to_numpy(dtype=np.float64))
+
+    def predict(self, df_features):
+        """Cluster più vicino e distanza dal suo centroide per ogni riga di ``df_features``."""
+        scaled = self.transform(df_features)
+        # |x - c|² = |x|² - 2x·c + |c|², senza materializzare n × k × d
+        sq_dist = ((scaled ** 2).sum(axis=1)[:, None] - 2 * scaled @ self.centers.T
+                   + (self.centers ** 2).sum(axis=1)[None, :])
+        labels = sq_dist.argmin(axis=1)
+        distances = np.sqrt(np.maximum(sq_dist[np.arange(len(labels)), labels], 0))
+        return labels, distances
+
+    def assign(self, df_features):
+        """Assegna i match nuovi ai cluster esistenti e li accumula per l'aggiornamento dei centroidi.
+
+        I centroidi vengono aggiornati (con una nuova versione) quando i match
+        accumulati raggiungono ``update_every``. Ritorna (etichette, distanze)
+        calcolate con i centroidi di ``self.version`` al termine della chiamata.
+        """
+        if df_features.empty:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        self.check_schema(df_features.columns)
+        labels, distances = self.predict(df_features)
+        scaled = self.transform(df_features)
+        np.add.at(self.pending_sums, labels, scaled)
+        self.pending_counts += np.bincount(labels, minlength=self.n_clusters)
+        self.assigned = np.union1d(self.assigned, df_features.index.to_numpy(dtype=np.int64))
+        if self.pending_counts.sum() >= self.update_every:
+            self.update_centers()
+            # Le righe scritte devono corrispondere ai centroidi della nuova versione
+            labels, distances = self.predict(df_features)
+        return labels, distances
+
+    def update_centers(self):
+        """Sposta i centroidi verso la media dei match accumulati (media mobile pesata sui conteggi)."""
+        moved = self.pending_counts > 0
+        if not moved.any():
+            return
+        total = self.counts + self.pending_counts
+        pending_means = self.pending_sums[moved] / self.pending_counts[moved, None]
+        weight = (self.pending_counts[moved] / total[moved])[:, None]
+        self.centers[moved] += weight * (pending_means - self.centers[moved])
+        self.counts = total
+        # Centroidi diversi = modello diverso: nuova versione derivata da quella corrente
+        self.parent_version = self.version
+        self.created_at = time.time()
+        self.version = new_version(self.n_clusters, self.created_at)
+        logging.info(f"Centroidi aggiornati con {int(self.pending_counts.sum())} nuovi match: "
+                     f"versione {self.parent_version} → {self.version}.")
+        self.pending_sums[:] = 0
+        self.pending_counts[:] = 0
+
+    def new_match_ids(self, match_ids):
+        """Match di ``match_ids`` non ancora assegnati dal modello."""
+        return np.setdiff1d(np.asarray(match_ids, dtype=np.int64), self.assigned)
+
+    def save(self, path=None):
+        path = path or model_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        joblib.dump(self, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return path
+
+    def save_version(self, model_dir=MODEL_DIR):
+        """Salva l'artefatto versionato e il suo manifest JSON. Ritorna il percorso dell'artefatto."""
+        path = self.save(version_path(self.version, model_dir))
+        with open(path[:-len('.joblib')] + '.json', 'w', encoding='utf-8') as f:
+            json.dump(self.manifest(), f, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, path=None, feature_columns=None):
+        """Carica un modello salvato; None se il file non esiste.
+
+        Con ``feature_columns`` verifica che lo schema delle feature sia quello
+        del modello (FeatureSchemaError altrimenti).
+        """
+        path = path or model_path()
+        if not os.path.exists(path):
+            return None
+        model = joblib.load(path)
+        if feature_columns is not None:
+            model.check_schema(feature_columns)
+        return model
+
+    @classmethod
+    def load_version(cls, version, model_dir=MODEL_DIR):
+        return cls.load(version_path(version, model_dir))
+
+    def register(self, conn):
+        """Registra la versione del modello in cluster_models (idempotente)."""
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO cluster_models (version, n_clusters, feature_hash, features, created_at)
+                VALUES (%s, %s, %s, %s, to_timestamp(%s))
+                ON CONFLICT (version) DO NOTHING;
+            """, (self.version, self.n_clusters, self.feature_hash, extras.Json(self.columns), self.created_at))
+
+
+def _fit_k(matrix_path, n_clusters, scaler, columns, match_ids, random_state, n_init, silhouette_sample, model_dir):
+    """Worker dello sweep: adatta KMeans per un k sulla matrice condivisa e salva il modello."""
+    scaled = np.load(matrix_path, mmap_mode='r')
+    # Un thread per processo: il parallelismo è già tra i valori di k
+    with threadpool_limits(limits=1):
+        start = time.perf_counter()
+        kmeans = KMeans(n_clusters=n_clusters, random_state=random_state, n_init=n_init)
+        labels = kmeans.fit_predict(scaled)
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        silhouette = silhouette_score(scaled, labels, sample_size=min(silhouette_sample, len(labels)),
+                                      random_state=random_state)
+        silhouette_seconds = time.perf_counter() - start
+
+    path = ClusterModel.from_kmeans(scaler, kmeans, labels, columns, match_ids).save(
+        sweep_model_path(n_clusters, model_dir))
+    return {
+        'n_clusters': n_clusters,
+        'inertia': kmeans.inertia_,
+        'silhouette': silhouette,
+        'n_iter': kmeans.n_iter_,
+        'fit_seconds': fit_seconds,
+        'silhouette_seconds': silhouette_seconds,
+        'model_file': path,
+    }
+
+
+def sweep_k(df_features, k_values, workers=None, random_state=42, n_init=10,
+            silhouette_sample=SILHOUETTE_SAMPLE, model_dir=MODEL_DIR):
+    """Adatta KMeans per ogni k di ``k_values`` in parallelo su un pool di processi.
+
+    La matrice delle feature viene scalata una volta sola e passata ai worker
+    come file .npy in memory map (nessuna copia per processo). Ogni modello
+    viene salvato in ``<model_dir>/sweep/match_clusters_k<k>.joblib``.
+    Ritorna un DataFrame con una riga per k: inerzia, silhouette, iterazioni e tempi.
+    """
+    k_values = sorted(set(k_values))
+    scaler = StandardScaler()
+    scaled = scaler.fit_transform(df_features.to_numpy(dtype=np.float64))
+    columns, match_ids = list(df_features.columns), df_features.index.to_numpy()
+
+    tmp_dir = tempfile.mkdtemp(prefix='cluster_sweep_')
+    try:
+        matrix_path = os.path.join(tmp_dir, 'features.npy')
+        np.save(matrix_path, scaled)
+        del scaled
+        logging.info(f"Sweep di k={k_values} su {len(match_ids)} match e {len(columns)} feature...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_fit_k, matrix_path, k, scaler, columns, match_ids,
+                                random_state, n_init, silhouette_sample, model_dir)
+                for k in k_values
+            ]
+            results = []
+            for future in futures:
+                result = future.result()
+                logging.info(f"k={result['n_clusters']}: inerzia {result['inertia']:.1f}, "
+                             f"silhouette {result['silhouette']:.3f} ({result['fit_seconds']:.1f}s)")
+                results.append(result)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return pd.DataFrame(results).set_index('n_clusters')
+
+
+def write_assignments(model, df_assigned, conn=None):
+    """Scrive in blocco le assegnazioni (indice match_id, colonne cluster/distance) in match_clusters.
+
+    COPY in una tabella temporanea e un'unica INSERT ... ON CONFLICT; registra
+    anche la versione del modello. Ritorna il numero di righe scritte.
+    """
+    with session(conn) as conn:
+        try:
+            model.register(conn)
+            buffer = io.StringIO()
+            pd.DataFrame({
+                'match_id': df_assigned.index.to_numpy(dtype=np.int64),
+                'cluster': df_assigned['cluster'].to_numpy(dtype=np.int64),
+                'distance': df_assigned['distance'].to_numpy(dtype=np.float64),
+            }).to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS tmp_match_clusters
+                    (match_id BIGINT, cluster SMALLINT, distance REAL) ON COMMIT DROP;
+                """)
+                cursor.copy_expert("COPY tmp_match_clusters (match_id, cluster, distance) FROM STDIN WITH (FORMAT csv)", buffer)
+                cursor.execute("""
+                    INSERT INTO match_clusters (match_id, model_version, cluster, distance)
+                    SELECT match_id, %s, cluster, distance FROM tmp_match_clusters
+                    ON CONFLICT (match_id, model_version) DO UPDATE
+                    SET cluster = EXCLUDED.cluster, distance = EXCLUDED.distance, assigned_at = now();
+                """, (model.version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(df_assigned)
+
+
+def update_model(model, conn=None):
+    """Assegna al modello i match con feature non ancora visti. Ritorna un DataFrame match_id → cluster, distance.
+
+    Solleva FeatureSchemaError se le feature non hanno più lo schema del modello.
+    """
+    with session(conn) as conn:
+        new_ids = model.new_match_ids(candidate_match_ids(conn))
+        if len(new_ids) == 0:
+            return pd.DataFrame({'cluster': [], 'distance': []}, index=pd.Index([], name='match_id'))
+        df_features = load_features(match_ids=new_ids, conn=conn)
+    labels, distances = model.assign(df_features)
+    return pd.DataFrame({'cluster': labels, 'distance': distances}, index=df_features.index)
+
+
+def reassign_all(model, conn=None):
+    """Ricalcola cluster e distanze di tutti i match del modello (``model.assigned``) con i centroidi correnti.
+
+    Serve dopo un aggiornamento dei centroidi: la nuova versione deve avere in
+    match_clusters l'intero corpus, non solo il blocco che l'ha generata.
+    """
+    df_features = load_features(match_ids=model.assigned, conn=conn)
+    labels, distances = model.predict(df_features)
+    return pd.DataFrame({'cluster': labels, 'distance': distances}, index=df_features.index)
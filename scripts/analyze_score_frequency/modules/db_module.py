@@ -1,4 +1,5 @@
 from .config import DB_CONFIG
+import re
 import psycopg2
 from psycopg2 import sql, extras
 
@@ -18,8 +19,8 @@ def create_table(conn):
         season TEXT,
         home_team TEXT,
         away_team TEXT,
-        home_score TEXT,
-        away_score TEXT,
+        home_score INT,
+        away_score INT,
         status TEXT,
         start_timestamp BIGINT,
         home_country TEXT,
@@ -51,8 +52,8 @@ def insert_matches(conn, events):
                     event['season']['name'],
                     event['homeTeam']['name'],
                     event['awayTeam']['name'],
-                    str(event.get('homeScore', {}).get('current', 'N/A')),
-                    str(event.get('awayScore', {}).get('current', 'N/A')),
+                    event.get('homeScore', {}).get('current'),
+                    event.get('awayScore', {}).get('current'),
                     event['status']['description'],
                     event.get('startTimestamp'),
                     event['homeTeam'].get('country', {}).get('name', 'N/A'),
@@ -178,13 +179,22 @@ def create_statistics_table(conn):
         homeValue FLOAT,
         awayValue FLOAT,
         renderType INT,
-        key TEXT
+        key TEXT,
+        homeSecondary FLOAT,
+        awaySecondary FLOAT
     );
     """
+    # Colonne aggiunte dopo: le tabelle già esistenti vanno allineate
+    add_secondary_query = """
+    ALTER TABLE match_statistics_column
+        ADD COLUMN IF NOT EXISTS homeSecondary FLOAT,
+        ADD COLUMN IF NOT EXISTS awaySecondary FLOAT;
+    """
     try:
         with conn.cursor() as cursor:
             cursor.execute(create_json_query)
             cursor.execute(create_column_query)
+            cursor.execute(add_secondary_query)
         conn.commit()
         # print("Tabelle 'match_statistics_json' e 'match_statistics_column' create o già esistenti.")
     except Exception as e:
@@ -220,30 +230,23 @@ def save_statistics_to_db(match_id, statistics, conn=None):
     else:
         print("Impossibile connettersi al database per le statistiche.")
 
+_SECONDARY_VALUE = re.compile(r'\(\s*(-?\d+(?:\.\d+)?)')
+
+def _secondary_value(text):
+    """Valore tra parentesi di una statistica testuale ("5 (2)" → 2.0)."""
+    if not isinstance(text, str):
+        return None
+    match = _SECONDARY_VALUE.search(text)
+    return float(match.group(1)) if match else None
+
 def populate_statistics_column(conn):
-    # Drop and recreate the column table
-    drop_column_query = "DROP TABLE IF EXISTS match_statistics_column;"
-    create_column_query = """
-    CREATE TABLE match_statistics_column (
-        match_id BIGINT,
-        period TEXT,
-        groupName TEXT,
-        name TEXT,
-        home TEXT,
-        away TEXT,
-        compareCode INT,
-        statisticsType TEXT,
-        valueType TEXT,
-        homeValue FLOAT,
-        awayValue FLOAT,
-        renderType INT,
-        key TEXT
-    );
-    """
+    # Svuota la tabella senza ricrearla: chiave primaria e indici
+    # (gestiti da fetch_data/modules/schema.py) restano al loro posto
+    create_statistics_table(conn)
+    truncate_column_query = "TRUNCATE match_statistics_column;"
     try:
         with conn.cursor() as cursor:
-            cursor.execute(drop_column_query)
-            cursor.execute(create_column_query)
+            cursor.execute(truncate_column_query)
             
             # Select all JSON statistics
             select_all_json_query = "SELECT match_id, statistics FROM match_statistics_json;"
@@ -253,20 +256,22 @@ def populate_statistics_column(conn):
             # Insert into columns for each match
             insert_column_query = """
             INSERT INTO match_statistics_column (
-                match_id, period, groupName, name, home, away, compareCode, statisticsType, valueType, homeValue, awayValue, renderType, key
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+                match_id, period, groupName, name, home, away, compareCode, statisticsType, valueType, homeValue, awayValue, renderType, key,
+                homeSecondary, awaySecondary
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT DO NOTHING;
             """
             
             for match_id, stored_statistics in rows:
                 statistics_list = stored_statistics.get('statistics', [])
                 for period_data in statistics_list:
-                    period = period_data.get('period')
+                    period = period_data.get('period') or ''
                     groups = period_data.get('groups', [])
                     for group in groups:
-                        groupName = group.get('groupName')
+                        groupName = group.get('groupName') or ''
                         statisticsItems = group.get('statisticsItems', [])
                         for stat in statisticsItems:
-                            name = stat.get('name')
+                            name = stat.get('name') or ''
                             home = stat.get('home')
                             away = stat.get('away')
                             compareCode = stat.get('compareCode')
@@ -277,7 +282,8 @@ def populate_statistics_column(conn):
                             renderType = stat.get('renderType')
                             key = stat.get('key')
                             cursor.execute(insert_column_query, (
-                                match_id, period, groupName, name, home, away, compareCode, statisticsType, valueType, homeValue, awayValue, renderType, key
+                                match_id, period, groupName, name, home, away, compareCode, statisticsType, valueType, homeValue, awayValue, renderType, key,
+                                _secondary_value(home), _secondary_value(away)
                             ))
         conn.commit()
         print("Tabella match_statistics_column popolata con successo.")
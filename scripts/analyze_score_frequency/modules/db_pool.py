@@ -0,0 +1,98 @@
+"""
+Pool di connessioni PostgreSQL condiviso dalle funzioni di analisi.
+
+Aprire una connessione costa più di molte query brevi: le funzioni di
+``analysis.py`` e gli script di clustering prendono in prestito una
+connessione dal pool invece di crearne una nuova ogni volta.
+
+Per eseguire più query sulla stessa connessione basta aprire una sessione;
+le funzioni chiamate al suo interno (nello stesso thread) la riutilizzano:
+
+    with session():
+        for match_id in match_ids:
+            get_match_incidents(match_id)
+
+Il modulo funziona sia come parte del package ``modules`` sia importato
+direttamente dagli script in ``core/``.
+"""
+
+import contextlib
+import threading
+
+from psycopg2 import pool as pg_pool
+
+try:
+    from .config import DB_CONFIG
+except ImportError:
+    from config import DB_CONFIG
+
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure_pool(minconn=MIN_CONNECTIONS, maxconn=MAX_CONNECTIONS, config=None):
+    """(Ri)crea il pool condiviso con la dimensione indicata. Ritorna il pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **(config or DB_CONFIG))
+        return _pool
+
+
+def get_pool():
+    """Pool condiviso del processo (creato al primo uso con la dimensione di default)."""
+    with _pool_lock:
+        current = _pool
+    if current is None or current.closed:
+        return configure_pool()
+    return current
+
+
+def close_pool():
+    """Chiude tutte le connessioni del pool (es. a fine notebook)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+
+
+@contextlib.contextmanager
+def session(conn=None):
+    """Context manager che fornisce una connessione del pool.
+
+    Se ``conn`` è indicata viene usata così com'è; se il thread ha già una
+    sessione aperta viene riutilizzata quella. Altrimenti una connessione
+    viene presa dal pool e restituita all'uscita, chiudendo la transazione
+    (le funzioni di analisi sono in sola lettura).
+    """
+    if conn is not None:
+        yield conn
+        return
+    current = getattr(_local, 'conn', None)
+    if current is not None:
+        yield current
+        return
+
+    connection_pool = get_pool()
+    conn = connection_pool.getconn()
+    _local.conn = conn
+    broken = False
+    try:
+        yield conn
+    except Exception:
+        broken = bool(conn.closed)
+        raise
+    finally:
+        _local.conn = None
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        connection_pool.putconn(conn, close=broken or bool(conn.closed))
@@ -0,0 +1,76 @@
+"""
+Lettura della tabella wide delle feature (match_features_wide).
+
+La tabella ha una riga per match e periodo e, per ogni chiave di statistica
+(colonna ``key`` di match_statistics_column), le colonne
+``home_<suffisso>``/``away_<suffisso>``; la corrispondenza chiave → suffisso
+è in ``match_features_columns``. Viene aggiornata dall'ingest insieme alla
+normalizzazione delle statistiche, quindi non serve più pivotare le righe
+lunghe in pandas.
+
+Come ``db_pool``, il modulo si può importare sia dal package ``modules``
+sia direttamente dagli script in ``core/``.
+"""
+
+import pandas as pd
+from psycopg2 import sql
+
+try:
+    from .db_pool import session
+except ImportError:
+    from db_pool import session
+
+SIDES = ('home', 'away')
+
+
+def get_feature_keys(conn=None):
+    """Dizionario chiave di statistica → suffisso di colonna delle feature disponibili."""
+    with session(conn) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT key, column_suffix FROM match_features_columns ORDER BY key;")
+        return dict(cursor.fetchall())
+
+
+def get_statistic_keys(names, period='ALL', conn=None):
+    """
+    Chiave di statistica (colonna ``key``) di ciascun nome in ``names``
+    (es. 'Expected goals' → 'expectedGoals'); i nomi senza chiave vengono omessi.
+
+    Una sola lettura per nome sull'indice (period, name) di
+    match_statistics_column, senza scorrere le righe dei match.
+    """
+    query = """
+    SELECT n.name,
+           (SELECT s.key FROM match_statistics_column s
+            WHERE s.period = %s AND s.name = n.name AND s.key IS NOT NULL LIMIT 1)
+    FROM unnest(%s::text[]) AS n(name)
+    """
+    with session(conn) as conn, conn.cursor() as cursor:
+        cursor.execute(query, (period, list(names)))
+        return {name: key for name, key in cursor.fetchall() if key is not None}
+
+
+def get_match_features(keys=None, period='ALL', sides=SIDES, match_ids=None, conn=None):
+    """
+    Feature wide per match: una riga per match_id, colonne ``home_<key>``/``away_<key>``.
+
+    ``keys`` seleziona le chiavi di statistica da leggere (tutte se None);
+    le chiavi sconosciute vengono ignorate; ``match_ids`` limita la lettura
+    a quei match. I nomi delle colonne restituite
+    usano la chiave originale, come ``pivot(...).add_prefix('home_')``.
+    """
+    with session(conn) as conn:
+        available = get_feature_keys(conn)
+        selected = list(available) if keys is None else [k for k in keys if k in available]
+
+        columns = [sql.Identifier('match_id')]
+        for key in selected:
+            for side in sides:
+                columns.append(sql.SQL("{} AS {}").format(
+                    sql.Identifier(f"{side}_{available[key]}"), sql.Identifier(f"{side}_{key}")
+                ))
+        query = sql.SQL("SELECT {} FROM match_features_wide WHERE period = %s").format(sql.SQL(', ').join(columns))
+        params = [period]
+        if match_ids is not None:
+            query += sql.SQL(" AND match_id = ANY(%s)")
+            params.append(list(match_ids))
+        return pd.read_sql(query.as_string(conn), conn, params=params)
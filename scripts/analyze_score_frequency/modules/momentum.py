@@ -0,0 +1,294 @@
+"""
+Curve del momentum (graphPoints di SofaScore) come matrici NumPy.
+
+``load_momentum_curves`` restituisce le curve di tutti i match in un'unica
+matrice contigua (match × minuti) con una maschera dei minuti presenti,
+leggendo:
+
+- ``source='json'``: match_graphics_json, appiattito direttamente in SQL
+  (jsonb_array_elements) invece di fare json.loads riga per riga;
+- ``source='column'``: la tabella già appiattita match_graphics_column
+  (solo minuti 1-90, niente recupero; l'ingest la scrive solo con
+  GRAPHICS_CURVE_TABLE disattivato);
+- ``source='curve'``: match_graphics_curve, con la curva completa già in
+  array REAL[] (minuti e valori), letta una riga per match e trasformata
+  in NumPy senza decodificare colonne o JSON.
+
+``load_momentum_points`` restituisce invece tutti i punti di ogni match,
+senza raggrupparli per minuto (mezzi minuti e recupero compresi), in un
+layout compatto: valori concatenati e offset di inizio per match.
+
+``momentum_summary`` calcola le statistiche riassuntive per match, senza
+cicli Python. Sui punti (``MomentumPoints``) usa tutti i graphPoints come il
+vecchio calcolo di ``process_features``; sulla matrice (``MomentumCurves``)
+usa un valore per minuto (l'ultimo punto del minuto) nei minuti inclusi.
+Le feature del clustering usano i punti.
+
+``load_momentum_candles`` e ``load_momentum_lines`` leggono in blocco le
+candele OHLC e le linee LTTB precalcolate all'ingest (match_graphics_candles,
+match_graphics_lttb), ad esempio per disegnare una griglia di match.
+
+Come ``db_pool``, il modulo si può importare sia dal package ``modules``
+sia direttamente dagli script in ``core/``.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .db_pool import session
+except ImportError:
+    from db_pool import session
+
+REGULAR_MINUTES = 90
+SOURCES = ('json', 'column', 'curve')
+SUMMARY_COLUMNS = ['momentum_avg', 'momentum_abs_avg', 'momentum_std', 'momentum_max', 'momentum_min']
+CANDLE_BUCKETS = (1, 5, 15)  # come candles.CANDLE_BUCKETS in fetch_data
+
+MomentumCurves = namedtuple('MomentumCurves', ['match_ids', 'minutes', 'values', 'mask'])
+# I punti del match i sono minutes/values[offsets[i]:offsets[i + 1]]
+MomentumPoints = namedtuple('MomentumPoints', ['match_ids', 'offsets', 'minutes', 'values'])
+
+# Come il vecchio calcolo in Python (p.get('minute', 0), p.get('value', 0)):
+# un valore mancante vale 0, un minuto mancante esclude il punto (minuto 0)
+_JSON_POINTS_QUERY = """
+SELECT g.match_id, p.ord, COALESCE((p.point->>'minute')::FLOAT, 0) AS minute,
+       COALESCE((p.point->>'value')::FLOAT, 0) AS value
+FROM match_graphics_json g
+CROSS JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(g.graphics->'graphPoints') = 'array'
+         THEN g.graphics->'graphPoints' ELSE '[]'::jsonb END
+) WITH ORDINALITY AS p(point, ord)
+"""
+
+
+def _curves_from_points(df_points, max_minute, stoppage):
+    """Matrice (match × minuti) dai punti lunghi match_id/minute/value; a parità di minuto vale l'ultimo punto."""
+    # Il punto del minuto 45.5 finisce nella colonna del 45 (come int(float(minute)))
+    columns = np.floor(df_points['minute'].to_numpy()).astype(np.int64)
+    last_minute = max_minute
+    if stoppage and len(columns):
+        last_minute = max(max_minute, int(columns.max()))
+    minutes = np.arange(1, last_minute + 1)
+
+    keep = (columns >= 1) & (columns <= last_minute)
+    df_points = df_points.loc[keep].assign(column=columns[keep] - 1)
+    df_points = df_points.drop_duplicates(['match_id', 'column'], keep='last')
+
+    match_ids, rows = np.unique(df_points['match_id'].to_numpy(), return_inverse=True)
+    values = np.zeros((len(match_ids), len(minutes)), dtype=np.float32)
+    mask = np.zeros(values.shape, dtype=bool)
+    cols = df_points['column'].to_numpy()
+    values[rows, cols] = df_points['value'].to_numpy(dtype=np.float32)
+    mask[rows, cols] = True
+    return MomentumCurves(match_ids, minutes, values, mask)
+
+
+def _load_json_curves(conn, match_ids, max_minute, stoppage):
+    query = _JSON_POINTS_QUERY
+    params = None
+    if match_ids is not None:
+        query += " WHERE g.match_id = ANY(%s)"
+        params = [list(match_ids)]
+    query += " ORDER BY g.match_id, p.ord"
+    df_points = pd.read_sql(query, conn, params=params)
+    return _curves_from_points(df_points, max_minute, stoppage)
+
+
+def _load_column_curves(conn, match_ids, max_minute):
+    max_minute = min(max_minute, REGULAR_MINUTES)
+    columns = ", ".join(f"possession_{i}" for i in range(1, max_minute + 1))
+    query = f"SELECT match_id, {columns} FROM match_graphics_column"
+    params = None
+    if match_ids is not None:
+        query += " WHERE match_id = ANY(%s)"
+        params = [list(match_ids)]
+    query += " ORDER BY match_id"
+    df = pd.read_sql(query, conn, params=params)
+
+    raw = df.drop(columns='match_id').to_numpy(dtype=np.float32)
+    mask = ~np.isnan(raw)
+    values = np.ascontiguousarray(np.where(mask, raw, 0), dtype=np.float32)
+    return MomentumCurves(df['match_id'].to_numpy(), np.arange(1, max_minute + 1), values, mask)
+
+
+def _fetch_curve_arrays(conn, match_ids):
+    """
+    Curve di match_graphics_curve, una riga per match con gli array così come
+    sono: ritorna match_ids, numero di punti per match e minuti/valori
+    concatenati (np.concatenate), senza srotolare gli array in SQL.
+    """
+    query = "SELECT match_id, minutes, momentum FROM match_graphics_curve WHERE cardinality(minutes) > 0"
+    params = None
+    if match_ids is not None:
+        query += " AND match_id = ANY(%s)"
+        params = [list(match_ids)]
+    query += " ORDER BY match_id"
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.float64)
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), empty, empty
+    ids, minutes, values = zip(*rows)
+    return (
+        np.asarray(ids, dtype=np.int64),
+        np.fromiter((len(m) for m in minutes), dtype=np.int64, count=len(minutes)),
+        np.concatenate([np.asarray(m, dtype=np.float64) for m in minutes]),
+        np.concatenate([np.asarray(v, dtype=np.float64) for v in values]),
+    )
+
+
+def _load_array_curves(conn, match_ids, max_minute, stoppage):
+    ids, counts, minutes, values = _fetch_curve_arrays(conn, match_ids)
+    df_points = pd.DataFrame({'match_id': np.repeat(ids, counts), 'minute': minutes, 'value': values})
+    return _curves_from_points(df_points, max_minute, stoppage)
+
+
+def load_momentum_curves(source='json', match_ids=None, max_minute=REGULAR_MINUTES, stoppage=False, conn=None):
+    """
+    Curve del momentum di tutti i match (o di ``match_ids``) come MomentumCurves:
+
+    - ``match_ids``: array (n,) ordinato;
+    - ``minutes``: array dei minuti delle colonne (1..max_minute, oltre se ``stoppage``);
+    - ``values``: matrice float32 (n × minuti), 0 dove il minuto manca (e,
+      con ``source='json'``, dove il punto non ha valore, come in passato);
+    - ``mask``: matrice booleana, True dove il minuto è presente.
+
+    Con ``stoppage=True`` le colonne si estendono fino all'ultimo minuto di
+    recupero osservato (con ``source='json'`` o ``'curve'``).
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Sorgente delle curve sconosciuta: {source} (valori ammessi: {', '.join(SOURCES)})")
+    with session(conn) as conn:
+        if source == 'column':
+            return _load_column_curves(conn, match_ids, max_minute)
+        if source == 'curve':
+            return _load_array_curves(conn, match_ids, max_minute, stoppage)
+        return _load_json_curves(conn, match_ids, max_minute, stoppage)
+
+
+_JSON_ALL_POINTS_QUERY = """
+SELECT g.match_id, (p.point->>'minute')::FLOAT AS minute, COALESCE((p.point->>'value')::FLOAT, 0) AS value
+FROM match_graphics_json g
+CROSS JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(g.graphics->'graphPoints') = 'array'
+         THEN g.graphics->'graphPoints' ELSE '[]'::jsonb END
+) WITH ORDINALITY AS p(point, ord)
+"""
+
+
+def load_momentum_points(source='json', match_ids=None, conn=None):
+    """
+    Tutti i punti del momentum di ogni match come MomentumPoints (match_ids
+    ordinati, offsets di lunghezza n + 1, minutes/values concatenati in
+    ordine di graphPoints), senza raggruppare per minuto.
+
+    Con ``source='json'`` un valore mancante vale 0 (come il vecchio
+    ``p.get('value', 0)``); ``source='curve'`` legge match_graphics_curve,
+    che contiene solo i punti con minuto e valore.
+    """
+    if source not in ('json', 'curve'):
+        raise ValueError(f"Sorgente dei punti sconosciuta: {source} (valori ammessi: json, curve)")
+    if source == 'curve':
+        with session(conn) as conn:
+            ids, counts, minutes, values = _fetch_curve_arrays(conn, match_ids)
+        return MomentumPoints(ids, np.concatenate(([0], np.cumsum(counts))).astype(np.int64), minutes, values)
+
+    query = _JSON_ALL_POINTS_QUERY
+    params = None
+    if match_ids is not None:
+        query += " WHERE g.match_id = ANY(%s)"
+        params = [list(match_ids)]
+    query += " ORDER BY g.match_id, p.ord"
+    with session(conn) as conn:
+        df_points = pd.read_sql(query, conn, params=params)
+
+    point_ids = df_points['match_id'].to_numpy(dtype=np.int64)
+    match_ids, starts = np.unique(point_ids, return_index=True)
+    return MomentumPoints(
+        match_ids,
+        np.append(starts, len(point_ids)).astype(np.int64),
+        df_points['minute'].to_numpy(dtype=np.float64),
+        df_points['value'].to_numpy(dtype=np.float64),
+    )
+
+
+def _points_summary(points):
+    """Statistiche per match su tutti i punti (np.*.reduceat sui segmenti di ogni match)."""
+    counts = np.diff(points.offsets)
+    if len(counts) == 0:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS, index=pd.Index([], name='match_id'), dtype=np.float64)
+    starts = points.offsets[:-1]
+    values = points.values
+    mean = np.add.reduceat(values, starts) / counts
+    deviations = values - np.repeat(mean, counts)
+    return pd.DataFrame({
+        'momentum_avg': mean,
+        'momentum_abs_avg': np.add.reduceat(np.abs(values), starts) / counts,
+        'momentum_std': np.sqrt(np.add.reduceat(deviations ** 2, starts) / counts),
+        'momentum_max': np.maximum.reduceat(values, starts),
+        'momentum_min': np.minimum.reduceat(values, starts),
+    }, index=pd.Index(points.match_ids, name='match_id'))
+
+
+def load_momentum_candles(bucket_minutes=5, match_ids=None, conn=None):
+    """
+    Candele OHLC precalcolate del momentum, una riga per match e bucket:
+    match_id, minute_start, open, high, low, close (ordinate per match e minuto).
+    """
+    if bucket_minutes not in CANDLE_BUCKETS:
+        raise ValueError(f"Ampiezza delle candele non precalcolata: {bucket_minutes} (valori ammessi: {CANDLE_BUCKETS})")
+    query = """
+        SELECT g.match_id, c.minute_start, c.open, c.high, c.low, c.close
+        FROM match_graphics_candles g
+        CROSS JOIN LATERAL unnest(g.minute_start, g.open, g.high, g.low, g.close) AS c(minute_start, open, high, low, close)
+        WHERE g.bucket_minutes = %s
+    """
+    params = [bucket_minutes]
+    if match_ids is not None:
+        query += " AND g.match_id = ANY(%s)"
+        params.append(list(match_ids))
+    query += " ORDER BY g.match_id, c.minute_start"
+    with session(conn) as conn:
+        return pd.read_sql(query, conn, params=params)
+
+
+def load_momentum_lines(match_ids=None, conn=None):
+    """Linee del momentum ridotte con LTTB: match_id, minute, value (ordinate per match e minuto)."""
+    query = """
+        SELECT l.match_id, p.minute, p.value
+        FROM match_graphics_lttb l
+        CROSS JOIN LATERAL unnest(l.minutes, l.momentum) WITH ORDINALITY AS p(minute, value, ord)
+    """
+    params = None
+    if match_ids is not None:
+        query += " WHERE l.match_id = ANY(%s)"
+        params = [list(match_ids)]
+    query += " ORDER BY l.match_id, p.ord"
+    with session(conn) as conn:
+        return pd.read_sql(query, conn, params=params)
+
+
+def momentum_summary(curves):
+    """
+    Statistiche del momentum per match (media, media del valore assoluto,
+    deviazione standard, massimo, minimo). I match senza alcun punto vengono
+    esclusi.
+
+    Con ``MomentumPoints`` (``load_momentum_points``) sono calcolate su tutti
+    i punti; con ``MomentumCurves`` sui soli minuti presenti della matrice.
+    """
+    if isinstance(curves, MomentumPoints):
+        return _points_summary(curves)
+    has_points = curves.mask.any(axis=1)
+    values = np.where(curves.mask, curves.values, np.nan)[has_points]
+    return pd.DataFrame({
+        'momentum_avg': np.nanmean(values, axis=1),
+        'momentum_abs_avg': np.nanmean(np.abs(values), axis=1),
+        'momentum_std': np.nanstd(values, axis=1),
+        'momentum_max': np.nanmax(values, axis=1),
+        'momentum_min': np.nanmin(values, axis=1),
+    }, index=pd.Index(curves.match_ids[has_points], name='match_id'))
@@ -0,0 +1,229 @@
+"""
+Snapshot locale in Parquet del database delle partite.
+
+Esporta ``matches``, le statistiche normalizzate, gli incidenti e le curve
+del momentum (graphPoints) in file Parquet partizionati per mese di
+``start_timestamp`` (UTC), in stile hive:
+
+    <SNAPSHOT_DIR>/matches/month=2025-01/part-0.parquet
+    <SNAPSHOT_DIR>/statistics/month=2025-01/part-0.parquet
+    ...
+
+L'export è incrementale: vengono riscritti solo i mesi che contengono match
+con ``start_timestamp`` successivo all'ultimo export (meno ``RESYNC_WINDOW``,
+per raccogliere dettagli e risultati arrivati in ritardo). Il watermark è
+limitato all'istante dell'export, così i match in programma vengono
+riesportati finché non sono stati giocati. Ogni tabella
+include ``start_timestamp``, così i loader di ``analysis.py`` possono
+filtrare per data sia sui file (partizione) sia sulle righe.
+
+Richiede pyarrow (opzionale: serve solo per lo snapshot).
+
+Uso (dalla cartella scripts/analyze_score_frequency):
+
+    python -m modules.snapshot            # incrementale
+    python -m modules.snapshot --full     # riesporta tutto
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from .db_pool import session
+
+SNAPSHOT_DIR = os.environ.get(
+    'PYSOFA_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snapshot')
+)
+STATE_FILE = '_state.json'
+RESYNC_WINDOW = 7 * 86400  # secondi riesportati prima dell'ultimo export
+
+# Una query per tabella, eseguita mese per mese (parametri: inizio, fine del mese)
+SNAPSHOT_QUERIES = {
+    'matches': """
+        SELECT id AS match_id, tournament, season, home_team, away_team, home_score, away_score,
+               home_score_ht, away_score_ht, status, start_timestamp, home_country, away_country
+        FROM matches
+        WHERE start_timestamp >= %s AND start_timestamp < %s
+    """,
+    'statistics': """
+        SELECT s.match_id, m.start_timestamp, s.period, s.groupName AS group_name, s.name, s.key,
+               s.home, s.away, s.homeValue AS home_value, s.awayValue AS away_value,
+               s.homeSecondary AS home_secondary, s.awaySecondary AS away_secondary
+        FROM match_statistics_column s
+        JOIN matches m ON m.id = s.match_id
+        WHERE m.start_timestamp >= %s AND m.start_timestamp < %s
+    """,
+    'incidents': """
+        SELECT i.match_id, m.start_timestamp, i.time, i.added_time, i.incident_type, i.team_side,
+               i.player_name, i.home_score, i.away_score
+        FROM match_incidents_column i
+        JOIN matches m ON m.id = i.match_id
+        WHERE m.start_timestamp >= %s AND m.start_timestamp < %s
+    """,
+    'graphics': """
+        SELECT g.match_id, m.start_timestamp,
+               (p->>'minute')::FLOAT AS minute, (p->>'value')::FLOAT AS value
+        FROM match_graphics_json g
+        JOIN matches m ON m.id = g.match_id
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(g.graphics->'graphPoints') = 'array'
+                 THEN g.graphics->'graphPoints' ELSE '[]'::jsonb END
+        ) AS p
+        WHERE m.start_timestamp >= %s AND m.start_timestamp < %s
+    """,
+}
+SNAPSHOT_TABLES = tuple(SNAPSHOT_QUERIES)
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise ImportError("Lo snapshot Parquet richiede pyarrow (pip install pyarrow).") from e
+
+
+def month_key(timestamp):
+    """'YYYY-MM' (UTC) di uno unix timestamp."""
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m')
+
+
+def month_bounds(month):
+    """Timestamp di inizio (incluso) e fine (escluso) di un mese 'YYYY-MM' in UTC."""
+    start = datetime.strptime(month, '%Y-%m').replace(tzinfo=timezone.utc)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def _partition_path(snapshot_dir, table, month):
+    return os.path.join(snapshot_dir, table, f"month={month}", 'part-0.parquet')
+
+
+def read_state(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_state(snapshot_dir, state):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _write_partition(df, path):
+    """Scrive (o rimuove, se vuota) una partizione in modo atomico."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if df.empty:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _months_to_export(conn, since):
+    query = "SELECT DISTINCT start_timestamp FROM matches WHERE start_timestamp >= %s"
+    with conn.cursor() as cursor:
+        cursor.execute(query, (since,))
+        return sorted({month_key(row[0]) for row in cursor.fetchall() if row[0] is not None})
+
+
+def export_snapshot(snapshot_dir=SNAPSHOT_DIR, full=False, tables=SNAPSHOT_TABLES):
+    """Esporta (o aggiorna) lo snapshot Parquet. Ritorna la lista dei mesi riscritti."""
+    _require_pyarrow()
+    state = read_state(snapshot_dir)
+    # Il watermark non supera mai l'istante dell'export: i match futuri (in
+    # programma) cambieranno ancora e vanno riesportati quando saranno giocati.
+    # Il limite vale anche per uno stato salvato con un watermark nel futuro.
+    started_at = int(time.time())
+    previous_until = min(state.get('exported_until', 0), started_at)
+    since = 0 if full or 'exported_until' not in state else max(0, previous_until - RESYNC_WINDOW)
+
+    if full:
+        for table in tables:
+            shutil.rmtree(os.path.join(snapshot_dir, table), ignore_errors=True)
+
+    with session() as conn:
+        months = _months_to_export(conn, since)
+        exported_until = 0 if full else previous_until
+        for month in months:
+            start_ts, end_ts = month_bounds(month)
+            for table in tables:
+                df = pd.read_sql(SNAPSHOT_QUERIES[table], conn, params=[start_ts, end_ts])
+                _write_partition(df, _partition_path(snapshot_dir, table, month))
+                if table == 'matches' and not df.empty:
+                    exported_until = max(exported_until, min(int(df['start_timestamp'].max()), started_at))
+            logging.info(f"Snapshot: mese {month} esportato.")
+
+    _write_state(snapshot_dir, {'exported_until': exported_until, 'exported_at': time.time()})
+    return months
+
+
+def read_snapshot(table, columns=None, filters=None, start_date=None, end_date=None, snapshot_dir=SNAPSHOT_DIR):
+    """Legge una tabella dello snapshot con proiezione delle colonne e filtri spinti sui file.
+
+    ``filters`` usa la sintassi di ``pyarrow.parquet.read_table``
+    (es. ``[('period', '=', 'ALL'), ('name', 'in', ['Expected goals'])]``).
+    ``start_date``/``end_date`` (YYYY-MM-DD, fine esclusa) selezionano prima
+    le partizioni mensili e poi le righe per ``start_timestamp``.
+    """
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    if table not in SNAPSHOT_TABLES:
+        raise ValueError(f"Tabella di snapshot sconosciuta: {table}")
+    path = os.path.join(snapshot_dir, table)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"Snapshot '{table}' non trovato in {snapshot_dir}: esegui python -m modules.snapshot")
+
+    filters = list(filters or [])
+    if start_date:
+        start_ts = int(pd.Timestamp(start_date, tz='UTC').timestamp())
+        filters += [('month', '>=', month_key(start_ts)), ('start_timestamp', '>=', start_ts)]
+    if end_date:
+        end_ts = int(pd.Timestamp(end_date, tz='UTC').timestamp())
+        filters += [('month', '<=', month_key(end_ts - 1)), ('start_timestamp', '<', end_ts)]
+
+    arrow_table = pq.read_table(path, columns=columns, filters=filters or None, partitioning='hive')
+    df = arrow_table.to_pandas()
+    if 'month' in df.columns and (columns is None or 'month' not in columns):
+        df = df.drop(columns='month')
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Esporta il database delle partite in uno snapshot Parquet.")
+    parser.add_argument('--dir', default=SNAPSHOT_DIR, help="Cartella dello snapshot")
+    parser.add_argument('--full', action='store_true', help="Riesporta tutti i mesi invece dei soli nuovi")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    months = export_snapshot(args.dir, full=args.full)
+    logging.info(f"Snapshot aggiornato: {len(months)} mesi riscritti in {args.dir}.")
+
+
+if __name__ == "__main__":
+    main()
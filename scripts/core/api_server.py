@@ -0,0 +1,339 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analyze_score_frequency', 'modules')))
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import db_pool
+
+# Server HTTP locale (asyncio, sola lettura) per la pagina del grafico dei match.
+#
+# Espone gli stessi payload delle API SofaScore usate da +page.svelte, letti dalle
+# nostre tabelle invece che dal sito:
+#
+#     GET /api/v1/event/{id}            -> {"event": {...}}     (matches)
+#     GET /api/v1/event/{id}/graph      -> payload del grafico  (match_graphics_json)
+#     GET /api/v1/event/{id}/incidents  -> payload incidenti    (match_incidents_json)
+#     GET /api/v1/event/{id}/candles?bucket=5    -> candele OHLC e linea LTTB precalcolate
+#     GET /api/v1/candles?ids=1,2,3&bucket=5     -> le stesse per più match (griglie)
+#
+# Le query girano su connessioni del pool condiviso (db_pool) in un thread pool,
+# le risposte hanno ETag e Cache-Control (lunga durata per i match conclusi) e i
+# match più richiesti restano in una cache LRU in memoria.
+#
+# Uso: python api_server.py --port 8765
+
+# Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+LRU_SIZE = 512
+LIVE_TTL = 30  # secondi di validità per i match non conclusi
+FINAL_MAX_AGE = 86400
+# matches.status contiene la descrizione dello stato SofaScore
+FINAL_STATUSES = ('Ended', 'AET', 'AP', 'Canceled', 'Cancelled', 'Abandoned', 'Awarded')
+ALLOWED_ORIGIN = '*'
+
+ROUTE = re.compile(r'^/api/v1/event/(\d+)(?:/(graph|incidents|candles))?/?$')
+BULK_CANDLES_ROUTE = re.compile(r'^/api/v1/candles/?$')
+CANDLE_BUCKETS = (1, 5, 15)  # come candles.CANDLE_BUCKETS in fetch_data
+DEFAULT_BUCKET = 5
+MAX_BULK_IDS = 500
+
+EVENT_QUERY = """
+SELECT id, tournament, season, home_team, away_team, home_score, away_score,
+       home_score_ht, away_score_ht, status, start_timestamp, home_country, away_country,
+       home_team_id, away_team_id
+FROM matches WHERE id = %s
+"""
+DETAIL_QUERIES = {
+    'graph': "SELECT m.status, g.graphics FROM match_graphics_json g LEFT JOIN matches m ON m.id = g.match_id WHERE g.match_id = %s",
+    'incidents': "SELECT m.status, i.incidents FROM match_incidents_json i LEFT JOIN matches m ON m.id = i.match_id WHERE i.match_id = %s",
+}
+
+CANDLES_QUERY = """
+SELECT l.match_id, m.status, c.minute_start, c.open, c.high, c.low, c.close, l.minutes, l.momentum
+FROM match_graphics_lttb l
+LEFT JOIN matches m ON m.id = l.match_id
+LEFT JOIN match_graphics_candles c ON c.match_id = l.match_id AND c.bucket_minutes = %s
+WHERE l.match_id = ANY(%s)
+"""
+
+REASONS = {200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+           404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def _score(current, period1):
+    score = {}
+    if current is not None:
+        score['current'] = score['display'] = current
+    if period1 is not None:
+        score['period1'] = period1
+    return score
+
+
+def event_payload(row):
+    """Payload in formato SofaScore /event/{id} a partire da una riga di matches."""
+    (match_id, tournament, season, home_team, away_team, home_score, away_score,
+     home_score_ht, away_score_ht, status, start_timestamp, home_country, away_country,
+     home_team_id, away_team_id) = row
+    return {'event': {
+        'id': match_id,
+        'tournament': {'name': tournament},
+        'season': {'name': season},
+        # id usati dalla pagina per attribuire i gol senza teamSide
+        'homeTeam': {'id': home_team_id, 'name': home_team, 'country': {'name': home_country}},
+        'awayTeam': {'id': away_team_id, 'name': away_team, 'country': {'name': away_country}},
+        'homeScore': _score(home_score, home_score_ht),
+        'awayScore': _score(away_score, away_score_ht),
+        'status': {'description': status},
+        'startTimestamp': start_timestamp,
+    }}
+
+
+class LRUCache:
+    """Cache LRU thread-safe di risposte già serializzate, con scadenza opzionale."""
+
+    def __init__(self, size=LRU_SIZE):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at = item[-1]
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item
+
+    def put(self, key, body, etag, cache_control, ttl):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._items[key] = (body, etag, cache_control, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+def candles_payload(bucket, row):
+    """Payload delle candele di un match (stesse chiavi di Candle in +page.svelte)."""
+    _, _, starts, opens, highs, lows, closes, minutes, momentum = row
+    return {
+        'bucketMinutes': bucket,
+        'candles': [
+            {'minuteStart': start, 'open': o, 'high': h, 'low': l, 'close': c}
+            for start, o, h, l, c in zip(starts or (), opens or (), highs or (), lows or (), closes or ())
+        ],
+        'line': [{'minute': minute, 'value': value} for minute, value in zip(minutes, momentum)],
+    }
+
+
+def load_candles(match_ids, bucket):
+    """Candele e linee LTTB di più match in una query: {match_id: (payload, status)}."""
+    with db_pool.session() as conn, conn.cursor() as cursor:
+        cursor.execute(CANDLES_QUERY, (bucket, list(match_ids)))
+        return {row[0]: (candles_payload(bucket, row), row[1]) for row in cursor.fetchall()}
+
+
+def load_payload(match_id, part):
+    """Legge dal database il payload richiesto. Ritorna (payload, status) o (None, None)."""
+    with db_pool.session() as conn, conn.cursor() as cursor:
+        if part is None:
+            cursor.execute(EVENT_QUERY, (match_id,))
+            row = cursor.fetchone()
+            return (event_payload(row), row[9]) if row else (None, None)
+        cursor.execute(DETAIL_QUERIES[part], (match_id,))
+        row = cursor.fetchone()
+        return (row[1], row[0]) if row else (None, None)
+
+
+class MatchApiServer:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=db_pool.MAX_CONNECTIONS, lru_size=LRU_SIZE):
+        self.host = host
+        self.port = port
+        self.cache = LRUCache(lru_size)
+        # Un thread per connessione del pool: le query psycopg2 sono bloccanti
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-db')
+
+    def _cache_payload(self, key, payload, status):
+        body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if status in FINAL_STATUSES:
+            cache_control, ttl = f"public, max-age={FINAL_MAX_AGE}", None
+        else:
+            cache_control, ttl = f"public, max-age={LIVE_TTL}", LIVE_TTL
+        self.cache.put(key, body, etag, cache_control, ttl)
+        return body, etag, cache_control
+
+    async def _get_response(self, match_id, part, bucket=DEFAULT_BUCKET):
+        if part == 'candles':
+            return (await self._get_candles([match_id], bucket)).get(match_id)
+        key = (match_id, part)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[:3]
+
+        loop = asyncio.get_running_loop()
+        payload, status = await loop.run_in_executor(self.executor, load_payload, match_id, part)
+        if payload is None:
+            return None
+        return self._cache_payload(key, payload, status)
+
+    async def _get_candles(self, match_ids, bucket):
+        """Candele di più match: quelle in cache vengono riusate, le altre lette con una sola query."""
+        responses = {}
+        missing = []
+        for match_id in match_ids:
+            cached = self.cache.get((match_id, 'candles', bucket))
+            if cached is not None:
+                responses[match_id] = cached[:3]
+            else:
+                missing.append(match_id)
+        if missing:
+            loop = asyncio.get_running_loop()
+            loaded = await loop.run_in_executor(self.executor, load_candles, missing, bucket)
+            for match_id, (payload, status) in loaded.items():
+                responses[match_id] = self._cache_payload((match_id, 'candles', bucket), payload, status)
+        return responses
+
+    async def _get_bulk_candles(self, match_ids, bucket):
+        responses = await self._get_candles(match_ids, bucket)
+        # Il corpo si compone dai payload già serializzati dei singoli match
+        body = (f'{{"bucketMinutes":{bucket},"events":{{'.encode('utf-8')
+                + b','.join(f'"{m}":'.encode('utf-8') + responses[m][0] for m in match_ids if m in responses)
+                + b'}}')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        final = all(responses[m][2] == f"public, max-age={FINAL_MAX_AGE}" for m in responses)
+        return body, etag, f"public, max-age={FINAL_MAX_AGE if final else LIVE_TTL}"
+
+    def _write(self, writer, status, body=b'', headers=None, keep_alive=True, head_only=False):
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}",
+                 f"Access-Control-Allow-Origin: {ALLOWED_ORIGIN}",
+                 f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (b'' if head_only else body))
+
+    async def _handle_request(self, method, path, headers, writer, keep_alive):
+        if method == 'OPTIONS':
+            # Preflight CORS: la pagina invia header personalizzati
+            self._write(writer, 204, headers={
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': headers.get('access-control-request-headers', '*'),
+                'Access-Control-Max-Age': '86400',
+            }, keep_alive=keep_alive)
+            return
+        if method not in ('GET', 'HEAD'):
+            self._write(writer, 405, headers={'Allow': 'GET, HEAD, OPTIONS'}, keep_alive=keep_alive)
+            return
+
+        route, _, query_string = path.partition('?')
+        query = parse_qs(query_string)
+        try:
+            bucket = int(query.get('bucket', [DEFAULT_BUCKET])[0])
+            match_ids = [int(m) for m in ','.join(query.get('ids', [])).split(',') if m.strip()]
+        except ValueError:
+            self._write(writer, 400, keep_alive=keep_alive)
+            return
+        match = ROUTE.match(route)
+        bulk = BULK_CANDLES_ROUTE.match(route)
+        if not (match or bulk):
+            self._write(writer, 404, keep_alive=keep_alive)
+            return
+        if bucket not in CANDLE_BUCKETS or (bulk and not 0 < len(match_ids) <= MAX_BULK_IDS):
+            self._write(writer, 400, keep_alive=keep_alive)
+            return
+
+        try:
+            if bulk:
+                response = await self._get_bulk_candles(list(dict.fromkeys(match_ids)), bucket)
+            else:
+                response = await self._get_response(int(match.group(1)), match.group(2), bucket)
+        except Exception as e:
+            logging.error(f"Errore nella lettura di {path}: {type(e).__name__}: {e}")
+            self._write(writer, 500, keep_alive=keep_alive)
+            return
+        if response is None:
+            self._write(writer, 404, keep_alive=keep_alive)
+            return
+
+        body, etag, cache_control = response
+        response_headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Origin'}
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            self._write(writer, 304, headers=response_headers, keep_alive=keep_alive)
+            return
+        response_headers['Content-Type'] = 'application/json; charset=utf-8'
+        self._write(writer, 200, body, response_headers, keep_alive, head_only=method == 'HEAD')
+
+    async def handle_client(self, reader, writer):
+        """Gestisce una connessione HTTP/1.1 (keep-alive) con richieste GET senza corpo."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, path, version = lines[0].split(' ', 2)
+                except ValueError:
+                    self._write(writer, 400, keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+                await self._handle_request(method.upper(), path, headers, writer, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        logging.info(f"API locale in ascolto su http://{self.host}:{self.port}/api/v1/event/{{id}}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API locale (sola lettura) dei match per la pagina del grafico.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--pool-size', type=int, default=db_pool.MAX_CONNECTIONS, help="Connessioni massime al database")
+    parser.add_argument('--lru-size', type=int, default=LRU_SIZE, help="Risposte tenute nella cache in memoria")
+    args = parser.parse_args()
+
+    db_pool.configure_pool(maxconn=args.pool_size)
+    server = MatchApiServer(args.host, args.port, workers=args.pool_size, lru_size=args.lru_size)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=False)
+        db_pool.close_pool()
+
+
+if __name__ == "__main__":
+    main()
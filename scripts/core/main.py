@@ -1,13 +1,17 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analyze_score_frequency', 'modules')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'fetch_data', 'modules')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'fetch_data')))
 import time
 import logging
 from datetime import datetime
 
 import get_matches_per_day
-import db_module
-from selenium import webdriver
+import driver_pool
+# Stesso percorso di scrittura del fetch (BulkWriter): COPY, curve, candele,
+# normalizzazione incrementale e match_features_wide
+from modules import db_module, schema
 
 # Configurazione logging
 logging.basicConfig(
@@ -41,65 +45,71 @@ def print_matches(page_json):
         print(f"Timestamp Inizio: {start_timestamp}")
         print("-" * 50)
 
+def fetch_with_pool(pool, fetch, *args):
+    """Esegue una sola richiesta con un driver del pool, restituito subito dopo"""
+    with pool.lease() as driver:
+        return fetch(*args, driver)
+
 def main(date_str='2026-01-18'):
     start_time = time.time()
     logging.info(f"Avvio elaborazione per la data: {date_str}")
     
-    # Configurazione Selenium
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    
-    driver = webdriver.Chrome(options=options)
-    driver.set_page_load_timeout(10)
-
     # Inizializza connessione DB unica
     conn = db_module.create_connection()
     if not conn:
         logging.error("Impossibile stabilire una connessione al database.")
-        driver.quit()
         return
+    schema.ensure_schema(conn)
 
+    # Driver Selenium presi in prestito dal pool una richiesta alla volta:
+    # al rientro il pool li controlla e li ricicla (pagine/memoria)
+    pool = driver_pool.DriverPool(size=1, headless=True, page_load_timeout=10)
     try:
-        data = get_matches_per_day.get_matches_data(date_str, driver=driver)
+        data = fetch_with_pool(pool, get_matches_per_day.get_matches_data, date_str)
         if not data:
             logging.error("Dati non trovati per la data specificata.")
             return
 
-        # Salva i match base
-        db_module.save_matches_to_db(data, conn=conn)
-        
         events = data.get('events', [])
+
+        # Salva i match base
+        writer = db_module.BulkWriter(conn)
+        writer.add_matches(events)
+        if not writer.flush():
+            logging.error("Scrittura della lista match fallita.")
+            return
+
         total_events = len(events)
-        
+    
         for i, event in enumerate(events):
             match_id = event['id']
             logging.info(f"Processando match {match_id} ({i+1}/{total_events})")
-            
+        
             # Grafici
-            graphics = get_matches_per_day.get_graphics_per_match(match_id, driver)
-            if graphics:
-                db_module.save_graphics_to_db(match_id, graphics, conn=conn)
+            graphics = fetch_with_pool(pool, get_matches_per_day.get_graphics_per_match, match_id)
+            if graphics and 'error' not in graphics:
+                writer.add_graphics(match_id, graphics)
             else:
                 logging.warning(f"Nessun grafico trovato per match {match_id}")
-            
+        
             # Statistiche
-            statistics = get_matches_per_day.get_statistics_per_match(match_id, driver)
-            if statistics:
-                db_module.save_statistics_to_db(match_id, statistics, conn=conn)
+            statistics = fetch_with_pool(pool, get_matches_per_day.get_statistics_per_match, match_id)
+            if statistics and 'error' not in statistics:
+                writer.add_statistics(match_id, statistics)
             else:
                 logging.warning(f"Nessuna statistica trovata per match {match_id}")
-        
-        # Popola la tabella statistics_column dopo aver inserito tutti i JSON
-        db_module.populate_statistics_column_db(conn=conn)
     
+        if not writer.flush():
+            logging.error("Scrittura finale dei dettagli fallita.")
+            return
+
+        # Normalizza solo i JSON nuovi o cambiati (e aggiorna match_features_wide)
+        db_module.populate_statistics_column_db(conn=conn)
+
     except Exception as e:
         logging.exception(f"Errore durante l'esecuzione: {e}")
     finally:
-        if driver:
-            driver.quit()
+        pool.close()
         if conn:
             conn.close()
             logging.info("Connessione al database chiusa.")
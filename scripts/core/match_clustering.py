@@ -1,135 +1,156 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analyze_score_frequency', 'modules')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'fetch_data', 'modules')))
+import argparse
 import pandas as pd
 import numpy as np
-import json
 import logging
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-import db_module
+import psycopg2
+import db_pool
+import features
+import momentum
+import clustering
+import schema
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def fetch_data_from_db():
-    conn = db_module.create_connection()
-    if not conn:
-        logging.error("Connessione al database fallita.")
-        return None, None
-
     try:
-        # 1. Recupero statistiche (solo periodo "ALL")
-        stats_query = """
-            SELECT match_id, key, homevalue, awayvalue 
-            FROM match_statistics_column 
-            WHERE period = 'ALL';
-        """
-        df_stats_raw = pd.read_sql(stats_query, conn)
-
-        # 2. Recupero grafici per feature momentum
-        graphics_query = "SELECT match_id, graphics FROM match_graphics_json;"
-        df_graphics_raw = pd.read_sql(graphics_query, conn)
-
-        # 3. Recupero info base match (per nomi squadre e risultati)
-        matches_query = "SELECT id, home_team, away_team, home_score, away_score FROM matches;"
-        df_matches = pd.read_sql(matches_query, conn)
-
-        return df_stats_raw, df_graphics_raw, df_matches
-    finally:
-        conn.close()
-
-def process_features(df_stats, df_graphics):
+        with db_pool.session() as conn:
+            # 1. Recupero statistiche (solo periodo "ALL"), già una riga per match
+            df_stats_raw = features.get_match_features(period='ALL', conn=conn)
+
+            # 2. Punti del momentum (tutti i graphPoints) per le feature momentum
+            points = momentum.load_momentum_points(conn=conn)
+
+            # 3. Recupero info base match (per nomi squadre e risultati)
+            matches_query = "SELECT id, home_team, away_team, home_score, away_score FROM matches;"
+            df_matches = pd.read_sql(matches_query, conn)
+
+            return df_stats_raw, points, df_matches
+    except psycopg2.OperationalError as e:
+        logging.error(f"Connessione al database fallita: {e}")
+        return None, None, None
+
+def process_features(df_stats, points):
     logging.info("Elaborazione features per il clustering...")
-    
-    # Rimuovi duplicati: alcune statistiche (es. "Total Shots") compaiono in più gruppi (Match Overview, Shots, ecc.)
-    # Teniamo solo la prima occorrenza per ogni match_id e key
-    df_stats = df_stats.drop_duplicates(subset=['match_id', 'key'])
-    
-    # Pivot delle statistiche: vogliamo una riga per match_id
-    # Prepariamo i dati delle statistiche
-    df_pivot_home = df_stats.pivot(index='match_id', columns='key', values='homevalue').add_prefix('home_')
-    df_pivot_away = df_stats.pivot(index='match_id', columns='key', values='awayvalue').add_prefix('away_')
-    df_features = pd.concat([df_pivot_home, df_pivot_away], axis=1)
-
-    # Elaborazione Momentum dai grafici JSON
-    momentum_features = []
-    for index, row in df_graphics.iterrows():
-        m_id = row['match_id']
-        try:
-            data = row['graphics'] # Già caricato come dict/list da pandas se JSONB, o stringa
-            if isinstance(data, str):
-                data = json.loads(data)
-            
-            points = data.get('graphPoints', [])
-            if points:
-                values = [p.get('value', 0) for p in points]
-                momentum_features.append({
-                    'match_id': m_id,
-                    'momentum_avg': np.mean(values),
-                    'momentum_abs_avg': np.mean(np.abs(values)),
-                    'momentum_std': np.std(values),
-                    'momentum_max': np.max(values),
-                    'momentum_min': np.min(values)
-                })
-        except Exception as e:
-            logging.warning(f"Errore nel processare grafica per match {m_id}: {e}")
-
-    if momentum_features:
-        df_momentum = pd.DataFrame(momentum_features).set_index('match_id')
-        df_features = df_features.join(df_momentum, how='left')
-
-    # Pulizia: riempiamo i valori mancanti con la media (o 0)
-    df_features = df_features.fillna(0)
-    
-    return df_features
+    return clustering.build_features(df_stats, points)
 
 def run_clustering(df_features, n_clusters=4):
-    logging.info(f"Esecuzione KMeans con {n_clusters} cluster...")
-    
-    # Scaling dei dati (fondamentale per KMeans)
-    scaler = StandardScaler()
-    scaled_features = scaler.fit_transform(df_features)
-    
-    # Algoritmo KMeans
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    df_features['cluster'] = kmeans.fit_predict(scaled_features)
+    # Scaler e centroidi restano nel modello, che può essere salvato e aggiornato
+    model, labels = clustering.ClusterModel.fit(df_features, n_clusters=n_clusters)
+    df_features['cluster'] = labels
+    return df_features, model
+
+def save_assignments(model, df_assigned):
+    """Scrive le assegnazioni in match_clusters (lo schema è gestito da schema.py)."""
+    with db_pool.session() as conn:
+        schema.ensure_schema(conn)
+        written = clustering.write_assignments(model, df_assigned, conn=conn)
+    logging.info(f"Scritte {written} assegnazioni in match_clusters (modello {model.version}).")
+
+def run_incremental(model_file=None):
+    """Assegna ai cluster del modello salvato i soli match nuovi. Ritorna (modello, assegnazioni)."""
+    model = clustering.ClusterModel.load(model_file)
+    if model is None:
+        logging.info("Nessun modello salvato: eseguo un refit completo.")
+        return None, None
+    version = model.version
+    try:
+        df_assigned = clustering.update_model(model)
+    except clustering.FeatureSchemaError as e:
+        logging.warning(f"{e} Eseguo un refit completo.")
+        return None, None
+    model.save(model_file)
+    if model.version != version:
+        # Centroidi aggiornati: artefatto e manifest della nuova versione, con
+        # le assegnazioni di tutti i match (non solo dei nuovi) sotto la nuova versione
+        logging.info(f"Nuova versione del modello salvata in {model.save_version()}")
+        save_assignments(model, clustering.reassign_all(model))
+    elif not df_assigned.empty:
+        save_assignments(model, df_assigned)
+    logging.info(f"Assegnati {len(df_assigned)} nuovi match ({len(model.assigned)} in totale).")
+    return model, df_assigned
+
+def print_clusters(df_results, n_clusters):
+    print("\n" + "="*50)
+    print("RISULTATI CLUSTERING MATCH")
+    print("="*50)
     
-    return df_features, kmeans
+    for cluster_id in range(n_clusters):
+        print(f"\nCLUSTER {cluster_id}:")
+        members = df_results[df_results['cluster'] == cluster_id]
+        for idx, row in members.head(10).iterrows():
+            print(f" - {row['home_team']} {row['home_score']} - {row['away_score']} {row['away_team']}")
+        if len(members) > 10:
+            print(f"   ... e altri {len(members) - 10} match")
 
 def main():
+    parser = argparse.ArgumentParser(description="Clustering dei match su statistiche e momentum.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Assegna solo i match nuovi ai cluster del modello salvato (refit completo se manca)")
+    parser.add_argument('--model-file', default=None, help="File del modello (default: models/match_clusters.joblib)")
+    parser.add_argument('--n-clusters', type=int, default=clustering.DEFAULT_CLUSTERS, help="Numero di cluster del refit")
+    parser.add_argument('--sweep', type=int, nargs=2, metavar=('K_MIN', 'K_MAX'),
+                        help="Confronta i valori di k da K_MIN a K_MAX (inclusi) in parallelo e salva ogni modello")
+    parser.add_argument('--workers', type=int, default=None, help="Processi dello sweep (default: numero di CPU)")
+    parser.add_argument('--silhouette-sample', type=int, default=clustering.SILHOUETTE_SAMPLE,
+                        help="Match campionati per la silhouette dello sweep")
+    args = parser.parse_args()
+    n_clusters = args.n_clusters
+
+    if args.incremental:
+        model, df_assigned = run_incremental(args.model_file)
+        if model is not None:
+            if df_assigned.empty:
+                return
+            with db_pool.session() as conn:
+                df_matches = pd.read_sql(
+                    "SELECT id, home_team, away_team, home_score, away_score FROM matches WHERE id = ANY(%s);",
+                    conn, params=[df_assigned.index.tolist()]
+                )
+            print_clusters(df_matches.set_index('id').join(df_assigned[['cluster']], how='inner'), model.n_clusters)
+            return
+
     # 1. Caricamento dati
-    df_stats, df_graphics, df_matches = fetch_data_from_db()
+    df_stats, points, df_matches = fetch_data_from_db()
     if df_stats is None or df_stats.empty:
         logging.error("Nessun dato trovato per il clustering.")
         return
 
     # 2. Trasformazione dati
-    df_final = process_features(df_stats, df_graphics)
+    df_final = process_features(df_stats, points)
+
+    if args.sweep:
+        k_min, k_max = args.sweep
+        df_sweep = clustering.sweep_k(df_final, range(k_min, k_max + 1), workers=args.workers,
+                                      silhouette_sample=args.silhouette_sample)
+        print("\n" + "="*50)
+        print("SWEEP DEL NUMERO DI CLUSTER")
+        print("="*50)
+        print(df_sweep.drop(columns='model_file').round(3).to_string())
+        print(f"\nModelli salvati in {os.path.dirname(df_sweep['model_file'].iloc[0])}")
+        return
     
-    # 3. Clustering
-    n_clusters = 4
+    # 3. Clustering (refit completo) e salvataggio del modello per le esecuzioni incrementali
     df_clustered, model = run_clustering(df_final, n_clusters=n_clusters)
+    model.save(args.model_file)
+    path = model.save_version()
+    logging.info(f"Modello {model.version} salvato in {path}")
+    _, distances = model.predict(df_clustered.drop(columns='cluster'))
+    save_assignments(model, df_clustered[['cluster']].assign(distance=distances))
     
     # 4. Merge con informazioni leggibili (nomi squadre)
     df_results = df_matches.set_index('id').join(df_clustered[['cluster']], how='inner')
     
     # 5. Output risultati
-    print("\n" + "="*50)
-    print("RISULTATI CLUSTERING MATCH")
-    print("="*50)
-    
-    for cluster_id in range(n_clusters):
-        print(f"\nCLUSTER {cluster_id}:")
-        members = df_results[df_results['cluster'] == cluster_id]
-        for idx, row in members.head(10).iterrows():
-            print(f" - {row['home_team']} {row['home_score']} - {row['away_score']} {row['away_team']}")
-        if len(members) > 10:
-            print(f"   ... e altri {len(members) - 10} match")
+    print_clusters(df_results, n_clusters)
 
     # Analisi dei centroidi per capire cosa rappresentano i cluster (opzionale)
     print("\nInformazione: I cluster dividono i match in base a statistiche e inerzia (momentum).")
-    print("Puoi regolare 'n_clusters' nel codice per cambiare il numero di gruppi.")
+    print("Puoi regolare il numero di gruppi con --n-clusters (o confrontarne diversi con --sweep).")
 
 if __name__ == "__main__":
     main()
@@ -1,35 +1,41 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analyze_score_frequency', 'modules')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'fetch_data', 'modules')))
 
+import argparse
+import logging
 import psycopg2
 from config import DB_CONFIG
+import schema
+import candles
 
-def add_columns():
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    # Add home_score_ht if not exists
-    try:
-        cur.execute("ALTER TABLE matches ADD COLUMN IF NOT EXISTS home_score_ht INT;")
-    except Exception as e:
-        print(f"Error adding home_score_ht: {e}")
-        conn.rollback()
-    else:
-        conn.commit()
-        print("Added home_score_ht column.")
+def add_columns(build_candles=False):
+    """Porta il database all'ultima versione dello schema.
 
-    # Add away_score_ht if not exists
+    Le colonne home_score_ht/away_score_ht sono ora la migrazione v2 di
+    schema.py: lo script resta come comando manuale per applicare tutte le
+    migrazioni mancanti. Con ``build_candles`` precalcola candele e linee
+    LTTB dei match che non le hanno.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
     try:
-        cur.execute("ALTER TABLE matches ADD COLUMN IF NOT EXISTS away_score_ht INT;")
-    except Exception as e:
-        print(f"Error adding away_score_ht: {e}")
-        conn.rollback()
-    else:
-        conn.commit()
-        print("Added away_score_ht column.")
-
-    conn.close()
+        before = schema.get_schema_version(conn)
+        after = schema.apply_migrations(conn)
+        if after > before:
+            print(f"Schema aggiornato dalla versione {before} alla {after}.")
+        else:
+            print(f"Schema già aggiornato (versione {after}).")
+        if build_candles:
+            processed = candles.refresh_candles(conn, missing_only=True)
+            print(f"Candele del momentum calcolate per {processed} match.")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    add_columns()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Applica le migrazioni mancanti dello schema.")
+    parser.add_argument('--build-candles', action='store_true',
+                        help="Precalcola candele OHLC e linee LTTB del momentum per i match che non le hanno")
+    args = parser.parse_args()
+    add_columns(build_candles=args.build_candles)
@@ -1,66 +1,65 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analyze_score_frequency', 'modules')))
+import argparse
 import pandas as pd
 import numpy as np
-import json
 import logging
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
-import db_module
+import psycopg2
+import db_pool
+import features
+import momentum
+import clustering
 
 # Configurazione logging ed estetica grafici
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 sns.set_theme(style="whitegrid")
 
 def fetch_data():
-    conn = db_module.create_connection()
-    if not conn: return None, None, None
-    
     try:
-        # Statistiche (ALL)
-        df_stats = pd.read_sql('SELECT match_id, key, homevalue, awayvalue FROM match_statistics_column WHERE period = \'ALL\'', conn)
-        # Grafici (Momentum)
-        df_graphics = pd.read_sql('SELECT match_id, graphics FROM match_graphics_json', conn)
-        # Info Match
-        df_matches = pd.read_sql('SELECT id, home_team, away_team FROM matches', conn)
-        return df_stats, df_graphics, df_matches
-    finally:
-        conn.close()
+        with db_pool.session() as conn:
+            # Statistiche (ALL)
+            df_stats = features.get_match_features(period='ALL', conn=conn)
+            # Curve del momentum (matrice match × minuti)
+            curves = momentum.load_momentum_curves(conn=conn)
+            # Info Match
+            df_matches = pd.read_sql('SELECT id, home_team, away_team FROM matches', conn)
+            return df_stats, curves, df_matches
+    except psycopg2.OperationalError:
+        return None, None, None
 
-def extract_momentum_series(df_graphics):
-    """Estrae la serie temporale del momentum (valori al minuto)"""
-    series_data = []
-    for _, row in df_graphics.iterrows():
-        try:
-            data = row['graphics']
-            if isinstance(data, str): data = json.loads(data)
-            points = data.get('graphPoints', [])
-            # Creiamo un array di 90 minuti (riempiendo i buchi)
-            curve = np.zeros(90)
-            for p in points:
-                m = int(float(p.get('minute', 0)))
-                if 1 <= m <= 90:
-                    curve[m-1] = p.get('value', 0)
-            series_data.append({'match_id': row['match_id'], 'curve': curve})
-        except: continue
-    return pd.DataFrame(series_data)
+def extract_momentum_series(curves):
+    """Serie temporale del momentum (valori al minuto, 0 dove manca) per match"""
+    return pd.DataFrame({'match_id': curves.match_ids, 'curve': list(curves.values)})
 
 def main():
-    df_stats_raw, df_graphics_raw, df_matches = fetch_data()
+    parser = argparse.ArgumentParser(description="Grafici dei cluster dei match.")
+    parser.add_argument('--saved-model', action='store_true',
+                        help="Usa il modello salvato da match_clustering.py invece di rifare il fit")
+    parser.add_argument('--model-file', default=None, help="File del modello (default: models/match_clusters.joblib)")
+    parser.add_argument('--n-clusters', type=int, default=clustering.DEFAULT_CLUSTERS, help="Numero di cluster (senza --saved-model)")
+    args = parser.parse_args()
+
+    model = None
+    if args.saved_model:
+        model = clustering.ClusterModel.load(args.model_file)
+        if model is None:
+            logging.error("Nessun modello salvato: esegui prima match_clustering.py.")
+            return
+
+    df_stats_raw, curves, df_matches = fetch_data()
     if df_stats_raw is None: return
 
     # 1. Preparazione Features (Statistiche + Momentum Summary)
-    df_stats = df_stats_raw.drop_duplicates(subset=['match_id', 'key'])
-    pivot_home = df_stats.pivot(index='match_id', columns='key', values='homevalue').add_prefix('h_')
-    pivot_away = df_stats.pivot(index='match_id', columns='key', values='awayvalue').add_prefix('a_')
-    df_feat = pd.concat([pivot_home, pivot_away], axis=1).fillna(0)
+    df_feat = df_stats_raw.set_index('match_id').fillna(0)
     
     # 2. Preparazione Curves (Trend temporale)
-    df_curves = extract_momentum_series(df_graphics_raw)
+    df_curves = extract_momentum_series(curves)
     if df_curves.empty:
         logging.error("Nessun dato momentum trovato.")
         return
@@ -69,19 +68,32 @@ def main():
     df_combined = df_feat.join(df_curves.set_index('match_id'), how='inner')
     
     # 3. Clustering su features statistiche
-    X = df_combined.drop(columns=['curve'])
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-    
-    n_clusters = 4
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    df_combined['cluster'] = kmeans.fit_predict(X_scaled)
+    if model is not None:
+        # Stesse feature del modello (statistiche + riassunto momentum), nessun fit
+        points = momentum.load_momentum_points(match_ids=df_combined.index.tolist())
+        X = clustering.build_features(df_stats_raw, points).loc[df_combined.index]
+        try:
+            model.check_schema(X.columns)
+        except clustering.FeatureSchemaError as e:
+            logging.error(f"{e} Esegui match_clustering.py.")
+            return
+        X_scaled = model.transform(X)
+        n_clusters = model.n_clusters
+        df_combined['cluster'], _ = model.predict(X)
+    else:
+        X = df_combined.drop(columns=['curve'])
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+
+        n_clusters = args.n_clusters
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+        df_combined['cluster'] = kmeans.fit_predict(X_scaled)
     
     logging.info("Generazione grafici...")
     
     # --- GRAFICO 1: ANDAMENTO MOMENTUM MEDIO PER CLUSTER ---
     plt.figure(figsize=(12, 6))
-    time_bins = np.arange(1, 91)
+    time_bins = curves.minutes
     
     for c in range(n_clusters):
         cluster_curves = np.stack(df_combined[df_combined['cluster'] == c]['curve'].values)
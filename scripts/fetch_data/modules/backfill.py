@@ -0,0 +1,144 @@
+"""
+Backfill parallelo di un intervallo di date, con checkpoint ripristinabili.
+
+Le date vengono distribuite su un pool di processi; ogni worker chiama
+``fetching.process_date`` con il proprio trasporto e la propria connessione.
+L'avanzamento è salvato nel database:
+
+- ``backfill_dates``: stato di ogni data ('running', 'done', 'partial', 'failed');
+- ``backfill_matches``: match i cui dettagli sono già stati salvati.
+
+Rilanciando lo stesso comando dopo un crash vengono saltate le date 'done' e,
+dentro le date da riprendere, i match già completati.
+
+Uso (dalla cartella scripts/fetch_data):
+
+    python -m modules.backfill 2025-01-01 2025-06-30 --workers 4
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+from datetime import datetime, timedelta
+
+from . import db_module
+from . import fetching
+from . import rate_limiter
+from . import schema
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def date_range(start_date, end_date):
+    """Lista delle date (YYYY-MM-DD) da start_date a end_date inclusi."""
+    start_dt = datetime.strptime(start_date, '%Y-%m-%d')
+    end_dt = datetime.strptime(end_date, '%Y-%m-%d')
+    days = (end_dt - start_dt).days
+    return [(start_dt + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days + 1)]
+
+
+def _init_worker(rate, log_level):
+    """Inizializzazione dei processi worker: logging e quota del rate limiter."""
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+    rate_limiter.configure(rate=rate)
+
+
+def _backfill_date(date_str, headless_mode):
+    """Elabora una data nel worker aggiornando il checkpoint. Ritorna (data, esito)."""
+    conn = db_module.create_connection()
+    if conn:
+        try:
+            schema.ensure_schema(conn)
+            db_module.mark_date_started(conn, date_str)
+        finally:
+            conn.close()
+
+    # La ricostruzione di match_statistics_column avviene una sola volta alla fine
+    success = fetching.process_date(date_str, headless_mode=headless_mode, checkpoint=True, rebuild_statistics=False)
+
+    if not success:
+        conn = db_module.create_connection()
+        if conn:
+            try:
+                db_module.mark_date_finished(conn, date_str, 'failed')
+            finally:
+                conn.close()
+    return date_str, success
+
+
+def pending_dates(start_date, end_date):
+    """Date del range non ancora completate secondo il checkpoint."""
+    dates = date_range(start_date, end_date)
+    conn = db_module.create_connection()
+    if not conn:
+        return dates
+    try:
+        schema.ensure_schema(conn)
+        completed = db_module.get_completed_dates(conn, start_date, end_date)
+    finally:
+        conn.close()
+    return [d for d in dates if d not in completed]
+
+
+def run_backfill(start_date, end_date, workers=DEFAULT_WORKERS, headless_mode=True, rate=rate_limiter.DEFAULT_RATE):
+    """Esegue il backfill del range distribuendo le date su ``workers`` processi.
+
+    ``rate`` è il budget complessivo di richieste/secondo, suddiviso in parti
+    uguali fra i worker (ogni processo ha il proprio rate limiter).
+    Ritorna la lista delle date fallite.
+    """
+    from tqdm.auto import tqdm
+
+    dates = pending_dates(start_date, end_date)
+    if not dates:
+        logging.info(f"Nessuna data da elaborare tra {start_date} e {end_date}.")
+        return []
+
+    workers = max(1, min(workers, len(dates)))
+    logging.info(f"Backfill di {len(dates)} date con {workers} worker ({rate / workers:.2f} req/s ciascuno).")
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(rate / workers, logging.getLogger().getEffectiveLevel()),
+    ) as executor:
+        futures = [executor.submit(_backfill_date, d, headless_mode) for d in dates]
+        pbar = tqdm(total=len(futures), desc="Backfill", unit="data")
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                date_str, success = future.result()
+            except Exception as e:
+                logging.error(f"Worker terminato con errore: {type(e).__name__}: {e}")
+                continue
+            if not success:
+                failed.append(date_str)
+            pbar.set_postfix_str(f"Ultima: {date_str}")
+            pbar.update(1)
+        pbar.close()
+
+    logging.info("Rielaborazione colonne statistiche...")
+    db_module.populate_statistics_column_db()
+
+    if failed:
+        logging.warning(f"Date fallite ({len(failed)}): {', '.join(sorted(failed))}. Rilancia il backfill per riprenderle.")
+    return sorted(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill parallelo delle partite SofaScore su un range di date.")
+    parser.add_argument('start_date', help="Data iniziale (YYYY-MM-DD)")
+    parser.add_argument('end_date', help="Data finale inclusa (YYYY-MM-DD)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Numero di processi worker")
+    parser.add_argument('--rate', type=float, default=rate_limiter.DEFAULT_RATE, help="Budget complessivo di richieste/secondo")
+    parser.add_argument('--no-headless', action='store_true', help="Mostra Chrome quando serve il fallback Selenium")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    failed = run_backfill(args.start_date, args.end_date, args.workers, not args.no_headless, args.rate)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Candele OHLC e linee sottocampionate (LTTB) delle curve del momentum.
+
+Sono gli stessi calcoli che +page.svelte fa ad ogni render
+(``buildCandlesFromPoints`` e la linea del grafico), eseguiti una volta sola:
+all'ingest da ``BulkWriter``/``insert_graphics`` e, per i match già salvati,
+con ``refresh_candles`` (``python migrate_ht_scores.py --build-candles``).
+I risultati finiscono in due tabelle compatte ad array paralleli:
+
+- ``match_graphics_candles``: una riga per match e ampiezza del bucket
+  (``CANDLE_BUCKETS`` minuti) con minute_start/open/high/low/close;
+- ``match_graphics_lttb``: la curva ridotta a ``LTTB_POINTS`` punti con
+  Largest-Triangle-Three-Buckets, che conserva picchi e cambi di segno.
+
+Il modulo non ha import relativi, così può essere usato sia dal package
+``fetch_data/modules`` sia dagli script in ``core/``.
+"""
+
+import logging
+
+from psycopg2 import extras
+
+CANDLE_BUCKETS = (1, 5, 15)
+LTTB_POINTS = 48
+REFRESH_BATCH = 1000
+
+CANDLE_COLUMNS = ('match_id', 'bucket_minutes', 'minute_start', 'open', 'high', 'low', 'close')
+LTTB_COLUMNS = ('match_id', 'minutes', 'momentum')
+
+
+def build_candles(minutes, values, bucket_minutes):
+    """Candele (minute_start, open, high, low, close) come buildCandlesFromPoints di +page.svelte.
+
+    ``minutes``/``values`` devono essere ordinati per minuto (come in
+    match_graphics_curve): open è il primo punto del bucket, close l'ultimo.
+    """
+    bucket = max(1, int(bucket_minutes))
+    candles = []
+    for minute, value in zip(minutes, values):
+        start = (int(minute // bucket)) * bucket
+        if candles and candles[-1][0] == start:
+            _, open_, high, low, _ = candles[-1]
+            candles[-1] = (start, open_, max(high, value), min(low, value), value)
+        else:
+            candles.append((start, value, value, value, value))
+    return candles
+
+
+def lttb(minutes, values, threshold=LTTB_POINTS):
+    """Downsampling Largest-Triangle-Three-Buckets: ritorna (minuti, valori) con al più ``threshold`` punti."""
+    n = len(minutes)
+    if threshold < 3 or n <= threshold:
+        return tuple(minutes), tuple(values)
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Media del bucket successivo (terzo vertice del triangolo)
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        count = avg_end - avg_start
+        avg_x = sum(minutes[avg_start:avg_end]) / count
+        avg_y = sum(values[avg_start:avg_end]) / count
+
+        # Nel bucket corrente si sceglie il punto col triangolo di area massima
+        best, best_area = None, -1.0
+        ax, ay = minutes[a], values[a]
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (values[j] - ay) - (ax - minutes[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return tuple(minutes[i] for i in selected), tuple(values[i] for i in selected)
+
+
+def candle_rows(match_id, minutes, values):
+    """Righe di match_graphics_candles (ordine di CANDLE_COLUMNS), una per ampiezza di bucket."""
+    if not minutes:
+        return []
+    rows = []
+    for bucket in CANDLE_BUCKETS:
+        starts, opens, highs, lows, closes = zip(*build_candles(minutes, values, bucket))
+        rows.append((match_id, bucket, starts, opens, highs, lows, closes))
+    return rows
+
+
+def lttb_row(match_id, minutes, values):
+    """Riga di match_graphics_lttb (None se la curva è vuota)."""
+    if not minutes:
+        return None
+    return (match_id, *lttb(minutes, values))
+
+
+def write_candles(cursor, curves):
+    """Sostituisce candele e linea LTTB dei match in ``curves`` ({match_id: (minuti, valori)})."""
+    if not curves:
+        return
+    match_ids = list(curves)
+    cursor.execute("DELETE FROM match_graphics_candles WHERE match_id = ANY(%s);", (match_ids,))
+    cursor.execute("DELETE FROM match_graphics_lttb WHERE match_id = ANY(%s);", (match_ids,))
+    candles = [row for m, (minutes, values) in curves.items() for row in candle_rows(m, minutes, values)]
+    lines = [row for row in (lttb_row(m, *curve) for m, curve in curves.items()) if row]
+    # Tuple → array PostgreSQL
+    if candles:
+        extras.execute_values(
+            cursor,
+            f"INSERT INTO match_graphics_candles ({', '.join(CANDLE_COLUMNS)}) VALUES %s",
+            [(m, b, list(s), list(o), list(h), list(l), list(c)) for m, b, s, o, h, l, c in candles],
+        )
+    if lines:
+        extras.execute_values(
+            cursor,
+            f"INSERT INTO match_graphics_lttb ({', '.join(LTTB_COLUMNS)}) VALUES %s",
+            [(m, list(minutes), list(values)) for m, minutes, values in lines],
+        )
+
+
+def refresh_candles(conn, match_ids=None, missing_only=False, batch_size=REFRESH_BATCH):
+    """Ricalcola candele e linee LTTB da match_graphics_curve.
+
+    Senza ``match_ids`` elabora tutti i match (o, con ``missing_only``, solo
+    quelli senza linea LTTB). Ritorna il numero di match elaborati.
+    """
+    query = "SELECT c.match_id, c.minutes, c.momentum FROM match_graphics_curve c"
+    params = None
+    if match_ids is not None:
+        query += " WHERE c.match_id = ANY(%s)"
+        params = (list(match_ids),)
+    elif missing_only:
+        query += " WHERE NOT EXISTS (SELECT 1 FROM match_graphics_lttb l WHERE l.match_id = c.match_id)"
+
+    processed = 0
+    try:
+        # Cursore lato server: le curve vengono lette a blocchi, non tutte in memoria
+        with conn.cursor(name='refresh_candles') as read_cursor:
+            read_cursor.itersize = batch_size
+            read_cursor.execute(query, params)
+            while True:
+                rows = read_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                with conn.cursor() as write_cursor:
+                    write_candles(write_cursor, {m: (minutes, values) for m, minutes, values in rows})
+                processed += len(rows)
+        conn.commit()
+        logging.info(f"Candele del momentum aggiornate per {processed} match.")
+    except Exception:
+        conn.rollback()
+        raise
+    return processed
@@ -1,4 +1,9 @@
 from .config import DB_CONFIG
+from . import schema
+from . import candles
+import io
+import re
+import json
 import psycopg2
 from psycopg2 import sql, extras
 
@@ -11,55 +16,45 @@ def create_connection(config=DB_CONFIG):
         return None
 
 def create_table(conn):
-    create_table_query = sql.SQL("""
-    CREATE TABLE IF NOT EXISTS matches (
-        id BIGINT PRIMARY KEY,
-        tournament TEXT,
-        season TEXT,
-        home_team TEXT,
-        away_team TEXT,
-        home_score TEXT,
-        away_score TEXT,
-        status TEXT,
-        start_timestamp BIGINT,
-        home_country TEXT,
-        away_country TEXT,
-        home_score_ht INT,
-        away_score_ht INT
-    );
-    """)
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(create_table_query)
-        conn.commit()
-    except Exception as e:
-        print(f"Errore nella creazione della tabella matches: {e}")
+    """Garantisce che esista la tabella matches (lo schema è gestito da schema.py)."""
+    schema.ensure_schema(conn)
+
+MATCH_COLUMNS = (
+    'id', 'tournament', 'season', 'home_team', 'away_team', 'home_score', 'away_score', 'status',
+    'start_timestamp', 'home_country', 'away_country', 'home_score_ht', 'away_score_ht',
+    'home_team_id', 'away_team_id'
+)
+
+def _match_row(event):
+    """Riga della tabella matches (ordine di MATCH_COLUMNS) a partire da un evento."""
+    return (
+        event['id'],
+        event['tournament']['name'],
+        event['season']['name'],
+        event['homeTeam']['name'],
+        event['awayTeam']['name'],
+        event.get('homeScore', {}).get('current'),
+        event.get('awayScore', {}).get('current'),
+        event['status']['description'],
+        event.get('startTimestamp'),
+        event['homeTeam'].get('country', {}).get('name', 'N/A'),
+        event['awayTeam'].get('country', {}).get('name', 'N/A'),
+        event.get('homeScore', {}).get('period1'),
+        event.get('awayScore', {}).get('period1'),
+        event['homeTeam'].get('id'),
+        event['awayTeam'].get('id')
+    )
 
 def insert_matches(conn, events):
     insert_query = """
-    INSERT INTO matches (id, tournament, season, home_team, away_team, home_score, away_score, status, start_timestamp, home_country, away_country, home_score_ht, away_score_ht)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    INSERT INTO matches (id, tournament, season, home_team, away_team, home_score, away_score, status, start_timestamp, home_country, away_country, home_score_ht, away_score_ht, home_team_id, away_team_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     ON CONFLICT (id) DO NOTHING;
     """
     try:
         with conn.cursor() as cursor:
             for event in events:
-                data = (
-                    event['id'],
-                    event['tournament']['name'],
-                    event['season']['name'],
-                    event['homeTeam']['name'],
-                    event['awayTeam']['name'],
-                    str(event.get('homeScore', {}).get('current', 'N/A')),
-                    str(event.get('awayScore', {}).get('current', 'N/A')),
-                    event['status']['description'],
-                    event.get('startTimestamp'),
-                    event['homeTeam'].get('country', {}).get('name', 'N/A'),
-                    event['awayTeam'].get('country', {}).get('name', 'N/A'),
-                    event.get('homeScore', {}).get('period1'),
-                    event.get('awayScore', {}).get('period1')
-                )
-                cursor.execute(insert_query, data)
+                cursor.execute(insert_query, _match_row(event))
     except Exception as e:
         print(f"Errore nell'inserimento dei dati base: {e}")
 
@@ -70,7 +65,7 @@ def save_matches_to_db(events, conn=None):
         should_close = True
     
     if conn:
-        create_table(conn)
+        schema.ensure_schema(conn)
         insert_matches(conn, events)
         if should_close:
             conn.close()
@@ -78,29 +73,34 @@ def save_matches_to_db(events, conn=None):
         print("Impossibile connettersi al database.")
 
 def create_graphics_table(conn):
-    # JSON table
-    create_json_query = """
-    CREATE TABLE IF NOT EXISTS match_graphics_json (
-        match_id BIGINT PRIMARY KEY,
-        graphics JSONB
-    );
-    """
-    # Column table
-    columns = ", ".join([f"possession_{i} FLOAT" for i in range(1, 91)])
-    create_column_query = f"""
-    CREATE TABLE IF NOT EXISTS match_graphics_column (
-        match_id BIGINT PRIMARY KEY,
-        {columns}
-    );
-    """
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(create_json_query)
-            cursor.execute(create_column_query)
-        conn.commit()
-        # print("Tabelle 'match_graphics_json' e 'match_graphics_column' create o già esistenti.")
-    except Exception as e:
-        print(f"Errore nella creazione delle tabelle graphics: {e}")
+    """Garantisce che esistano le tabelle dei grafici (lo schema è gestito da schema.py)."""
+    schema.ensure_schema(conn)
+
+def _graphics_column_values(graphics):
+    """Valori possession_1..possession_90 (None dove il minuto manca)."""
+    possession_values = {}
+    if 'graphPoints' in graphics:
+        for point in graphics['graphPoints']:
+            minute = int(point.get('minute', 0))
+            value = point.get('value', 0)
+            if 1 <= minute <= 90:
+                possession_values[minute] = value
+    return [possession_values.get(i) for i in range(1, 91)]
+
+# match_graphics_curve (curva completa in array) sostituisce match_graphics_column
+# (possession_1..90); con False si torna a scrivere solo la tabella a colonne.
+GRAPHICS_CURVE_TABLE = True
+GRAPHICS_CURVE_COLUMNS = ('match_id', 'minutes', 'momentum')
+
+def _graphics_curve(graphics):
+    """Curva completa (minuti, valori) ordinata per minuto, inclusi mezzi minuti e recupero."""
+    points = [
+        (float(point['minute']), float(point['value']))
+        for point in graphics.get('graphPoints', [])
+        if point.get('minute') is not None and point.get('value') is not None
+    ]
+    points.sort(key=lambda point: point[0])
+    return tuple(minute for minute, _ in points), tuple(value for _, value in points)
 
 def insert_graphics(conn, match_id, graphics):
     # Insert into JSON
@@ -110,18 +110,11 @@ def insert_graphics(conn, match_id, graphics):
     ON CONFLICT (match_id) DO UPDATE SET graphics = EXCLUDED.graphics;
     """
     # Extract values for columns
-    possession_values = {}
-    if 'graphPoints' in graphics:
-        for point in graphics['graphPoints']:
-            minute = int(point.get('minute', 0))
-            value = point.get('value', 0)
-            if 1 <= minute <= 90:
-                possession_values[f"possession_{minute}"] = value
+    values = _graphics_column_values(graphics)
     
     # Insert into columns
     columns = ", ".join([f"possession_{i}" for i in range(1, 91)])
     placeholders = ", ".join(["%s"] * 90)
-    values = [possession_values.get(f"possession_{i}", None) for i in range(1, 91)]
     
     insert_column_query = f"""
     INSERT INTO match_graphics_column (match_id, {columns})
@@ -129,10 +122,21 @@ def insert_graphics(conn, match_id, graphics):
     ON CONFLICT (match_id) DO UPDATE SET
     """ + ", ".join([f"possession_{i} = EXCLUDED.possession_{i}" for i in range(1, 91)])
     
+    insert_curve_query = """
+    INSERT INTO match_graphics_curve (match_id, minutes, momentum)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (match_id) DO UPDATE SET minutes = EXCLUDED.minutes, momentum = EXCLUDED.momentum;
+    """
+    minutes, momentum = _graphics_curve(graphics)
+    
     try:
         with conn.cursor() as cursor:
             cursor.execute(insert_json_query, (match_id, extras.Json(graphics)))
-            cursor.execute(insert_column_query, [match_id] + values)
+            if GRAPHICS_CURVE_TABLE:
+                cursor.execute(insert_curve_query, (match_id, list(minutes), list(momentum)))
+            else:
+                cursor.execute(insert_column_query, [match_id] + values)
+            candles.write_candles(cursor, {match_id: (minutes, momentum)})
         conn.commit()
         # print(f"Grafici inseriti per match {match_id}.")
     except Exception as e:
@@ -145,7 +149,7 @@ def save_graphics_to_db(match_id, graphics, conn=None):
         should_close = True
         
     if conn:
-        create_graphics_table(conn)
+        schema.ensure_schema(conn)
         insert_graphics(conn, match_id, graphics)
         if should_close:
             conn.close()
@@ -153,46 +157,16 @@ def save_graphics_to_db(match_id, graphics, conn=None):
         print("Impossibile connettersi al database per i grafici.")
 
 def create_statistics_table(conn):
-    # JSON table
-    create_json_query = """
-    CREATE TABLE IF NOT EXISTS match_statistics_json (
-        match_id BIGINT PRIMARY KEY,
-        statistics JSONB
-    );
-    """
-    # Column table - normalized statistics
-    create_column_query = """
-    CREATE TABLE IF NOT EXISTS match_statistics_column (
-        match_id BIGINT,
-        period TEXT,
-        groupName TEXT,
-        name TEXT,
-        home TEXT,
-        away TEXT,
-        compareCode INT,
-        statisticsType TEXT,
-        valueType TEXT,
-        homeValue FLOAT,
-        awayValue FLOAT,
-        renderType INT,
-        key TEXT
-    );
-    """
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(create_json_query)
-            cursor.execute(create_column_query)
-        conn.commit()
-        # print("Tabelle 'match_statistics_json' e 'match_statistics_column' create o già esistenti.")
-    except Exception as e:
-        print(f"Errore nella creazione delle tabelle statistics: {e}")
+    """Garantisce che esistano le tabelle delle statistiche (lo schema è gestito da schema.py)."""
+    schema.ensure_schema(conn)
 
 def insert_statistics(conn, match_id, statistics):
     # Insert into JSON
     insert_json_query = """
     INSERT INTO match_statistics_json (match_id, statistics)
     VALUES (%s, %s)
-    ON CONFLICT (match_id) DO UPDATE SET statistics = EXCLUDED.statistics;
+    ON CONFLICT (match_id) DO UPDATE SET statistics = EXCLUDED.statistics, normalized_at = NULL
+    WHERE match_statistics_json.statistics IS DISTINCT FROM EXCLUDED.statistics;
     """
     
     try:
@@ -210,117 +184,351 @@ def save_statistics_to_db(match_id, statistics, conn=None):
         should_close = True
         
     if conn:
-        create_statistics_table(conn)
+        schema.ensure_schema(conn)
         insert_statistics(conn, match_id, statistics)
         if should_close:
             conn.close()
     else:
         print("Impossibile connettersi al database per le statistiche.")
 
-def populate_statistics_column(conn):
-    # Drop and recreate the column table
-    drop_column_query = "DROP TABLE IF EXISTS match_statistics_column;"
-    create_column_query = """
-    CREATE TABLE match_statistics_column (
-        match_id BIGINT,
-        period TEXT,
-        groupName TEXT,
-        name TEXT,
-        home TEXT,
-        away TEXT,
-        compareCode INT,
-        statisticsType TEXT,
-        valueType TEXT,
-        homeValue FLOAT,
-        awayValue FLOAT,
-        renderType INT,
-        key TEXT
-    );
+STATISTICS_COLUMNS = (
+    'match_id', 'period', 'groupName', 'name', 'home', 'away', 'compareCode',
+    'statisticsType', 'valueType', 'homeValue', 'awayValue', 'renderType', 'key',
+    'homeSecondary', 'awaySecondary'
+)
+
+_SECONDARY_VALUE = re.compile(r'\(\s*(-?\d+(?:\.\d+)?)')
+
+def _secondary_value(text):
+    """Valore tra parentesi di una statistica testuale ("5 (2)" → 2.0, "400 (85%)" → 85.0)."""
+    if not isinstance(text, str):
+        return None
+    match = _SECONDARY_VALUE.search(text)
+    return float(match.group(1)) if match else None
+
+def _statistics_rows(match_id, stored_statistics):
+    """Appiattisce il JSON delle statistiche (periodi → gruppi → voci) in righe di STATISTICS_COLUMNS.
+
+    Le colonne della chiave primaria (period, groupName, name) non sono mai
+    NULL e ogni chiave compare una sola volta (vince la prima occorrenza).
+    """
+    rows = {}
+    statistics_list = stored_statistics.get('statistics', [])
+    for period_data in statistics_list:
+        period = period_data.get('period') or ''
+        groups = period_data.get('groups', [])
+        for group in groups:
+            groupName = group.get('groupName') or ''
+            statisticsItems = group.get('statisticsItems', [])
+            for stat in statisticsItems:
+                name = stat.get('name') or ''
+                rows.setdefault((period, groupName, name), (
+                    match_id, period, groupName, name, stat.get('home'), stat.get('away'),
+                    stat.get('compareCode'), stat.get('statisticsType'), stat.get('valueType'),
+                    stat.get('homeValue'), stat.get('awayValue'), stat.get('renderType'), stat.get('key'),
+                    _secondary_value(stat.get('home')), _secondary_value(stat.get('away'))
+                ))
+    return list(rows.values())
+
+STATISTICS_NORMALIZE_BATCH = 2000  # match appiattiti per transazione
+STATISTICS_SERVER_SIDE = True  # appiattimento dentro PostgreSQL (nessun JSON verso il client)
+
+def _jsonb_array(expression):
+    """Frammento SQL: l'espressione se è un array JSON, altrimenti un array vuoto."""
+    return f"CASE WHEN jsonb_typeof({expression}) = 'array' THEN {expression} ELSE '[]'::jsonb END"
+
+# Stesso output di _statistics_rows, ma calcolato interamente lato server
+# (niente JSON verso il client). DISTINCT ON con l'ordine dei JSON tiene la
+# prima occorrenza di ogni (period, groupName, name), come setdefault in Python.
+SERVER_SIDE_INSERT_QUERY = f"""
+INSERT INTO match_statistics_column (
+    match_id, period, groupName, name, home, away, compareCode, statisticsType, valueType, homeValue, awayValue, renderType, key,
+    homeSecondary, awaySecondary
+)
+SELECT DISTINCT ON (match_id, period, group_name, name)
+       match_id, period, group_name, name, home, away, compare_code, statistics_type, value_type,
+       home_value, away_value, render_type, key,
+       {schema.secondary_value_sql("home")}, {schema.secondary_value_sql("away")}
+FROM (
+    SELECT j.match_id, COALESCE(per.value->>'period', '') AS period, COALESCE(grp.value->>'groupName', '') AS group_name,
+           COALESCE(item.name, '') AS name, item.home, item.away, item."compareCode" AS compare_code,
+           item."statisticsType" AS statistics_type, item."valueType" AS value_type,
+           item."homeValue" AS home_value, item."awayValue" AS away_value, item."renderType" AS render_type, item.key,
+           per.ord AS period_ord, grp.ord AS group_ord, item.ord AS item_ord
+    FROM match_statistics_json j
+    CROSS JOIN LATERAL jsonb_array_elements({_jsonb_array("j.statistics->'statistics'")}) WITH ORDINALITY AS per(value, ord)
+    CROSS JOIN LATERAL jsonb_array_elements({_jsonb_array("per.value->'groups'")}) WITH ORDINALITY AS grp(value, ord)
+    CROSS JOIN LATERAL ROWS FROM (
+        jsonb_to_recordset({_jsonb_array("grp.value->'statisticsItems'")}) AS (
+            name TEXT, home TEXT, away TEXT, "compareCode" INT, "statisticsType" TEXT, "valueType" TEXT,
+            "homeValue" FLOAT, "awayValue" FLOAT, "renderType" INT, key TEXT
+        )
+    ) WITH ORDINALITY AS item(name, home, away, "compareCode", "statisticsType", "valueType",
+                              "homeValue", "awayValue", "renderType", key, ord)
+    WHERE j.match_id = ANY(%s)
+) flat
+ORDER BY match_id, period, group_name, name, period_ord, group_ord, item_ord
+"""
+
+def _normalize_statistics_client_side(conn, cursor):
+    """Un blocco di normalizzazione in Python (JSON → righe → COPY). Ritorna i match elaborati."""
+    # Solo i JSON da elaborare; SKIP LOCKED evita di lavorare due volte
+    # sugli stessi match se più processi girano in parallelo (backfill)
+    select_pending_query = """
+    SELECT match_id, statistics FROM match_statistics_json
+    WHERE normalized_at IS NULL
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED;
+    """
+    cursor.execute(select_pending_query, (STATISTICS_NORMALIZE_BATCH,))
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    match_ids = [match_id for match_id, _ in rows]
+    cursor.execute("DELETE FROM match_statistics_column WHERE match_id = ANY(%s);", (match_ids,))
+
+    # Inserimento via COPY a blocchi invece di una INSERT per statistica
+    column_rows = (row for match_id, stored_statistics in rows
+                   for row in _statistics_rows(match_id, stored_statistics))
+    batch = []
+    for row in column_rows:
+        batch.append(row)
+        if len(batch) >= BULK_COPY_ROWS:
+            _copy_rows(cursor, 'match_statistics_column', STATISTICS_COLUMNS, batch)
+            batch = []
+    if batch:
+        _copy_rows(cursor, 'match_statistics_column', STATISTICS_COLUMNS, batch)
+
+    cursor.execute("UPDATE match_statistics_json SET normalized_at = now() WHERE match_id = ANY(%s);", (match_ids,))
+    return match_ids
+
+def _normalize_statistics_server_side(conn, cursor):
+    """Un blocco di normalizzazione eseguito tutto in PostgreSQL. Ritorna i match elaborati.
+
+    Istruzioni separate nella stessa transazione (non CTE che modificano i
+    dati: vedrebbero tutte la stessa snapshot e l'INSERT non vedrebbe la
+    DELETE): selezione con lock, DELETE, INSERT e infine normalized_at.
+    """
+    cursor.execute("""
+    SELECT match_id FROM match_statistics_json
+    WHERE normalized_at IS NULL
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED;
+    """, (STATISTICS_NORMALIZE_BATCH,))
+    match_ids = [row[0] for row in cursor.fetchall()]
+    if not match_ids:
+        return []
+    cursor.execute("DELETE FROM match_statistics_column WHERE match_id = ANY(%s);", (match_ids,))
+    # Nessun ON CONFLICT: dopo la DELETE un conflitto è un errore da far emergere
+    cursor.execute(SERVER_SIDE_INSERT_QUERY, (match_ids,))
+    cursor.execute("UPDATE match_statistics_json SET normalized_at = now() WHERE match_id = ANY(%s);", (match_ids,))
+    return match_ids
+
+# --- Tabella wide delle feature (una riga per match e periodo) ---------------
+#
+# match_features_wide ha una colonna home_<suffisso> / away_<suffisso> per ogni
+# chiave di statistica; la corrispondenza chiave → suffisso è registrata in
+# match_features_columns, così i loader non devono ricalcolarla.
+
+FEATURE_SUFFIX_LENGTH = 50  # i nomi di colonna PostgreSQL sono limitati a 63 caratteri
+
+def _feature_suffix(key, used):
+    """Suffisso di colonna valido e univoco per una chiave di statistica."""
+    base = re.sub(r'[^a-z0-9]+', '_', key.lower()).strip('_')[:FEATURE_SUFFIX_LENGTH] or 'stat'
+    suffix, n = base, 2
+    while suffix in used:
+        suffix = f"{base}_{n}"
+        n += 1
+    return suffix
+
+MAX_TABLE_COLUMNS = 1600  # limite di PostgreSQL (contano anche le colonne eliminate)
+FEATURE_DDL_LOCK_TIMEOUT = '5s'  # attesa massima del lock per aggiungere colonne
+
+def _add_feature_columns(conn, keys):
+    """Registra le chiavi nuove e aggiunge le loro colonne a match_features_wide.
+
+    Gira in una transazione propria e breve (da chiamare senza transazioni
+    aperte): l'ALTER TABLE prende un lock ACCESS EXCLUSIVE sulla tabella wide,
+    che non deve restare aperto per tutto un blocco di normalizzazione.
+    Solleva RuntimeError se le colonne supererebbero MAX_TABLE_COLUMNS.
     """
     try:
         with conn.cursor() as cursor:
-            cursor.execute(drop_column_query)
-            cursor.execute(create_column_query)
-            
-            # Select all JSON statistics
-            select_all_json_query = "SELECT match_id, statistics FROM match_statistics_json;"
-            cursor.execute(select_all_json_query)
-            rows = cursor.fetchall()
-            
-            # Insert into columns for each match
-            insert_column_query = """
-            INSERT INTO match_statistics_column (
-                match_id, period, groupName, name, home, away, compareCode, statisticsType, valueType, homeValue, awayValue, renderType, key
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
-            
-            for match_id, stored_statistics in rows:
-                statistics_list = stored_statistics.get('statistics', [])
-                for period_data in statistics_list:
-                    period = period_data.get('period')
-                    groups = period_data.get('groups', [])
-                    for group in groups:
-                        groupName = group.get('groupName')
-                        statisticsItems = group.get('statisticsItems', [])
-                        for stat in statisticsItems:
-                            name = stat.get('name')
-                            home = stat.get('home')
-                            away = stat.get('away')
-                            compareCode = stat.get('compareCode')
-                            statisticsType = stat.get('statisticsType')
-                            valueType = stat.get('valueType')
-                            homeValue = stat.get('homeValue')
-                            awayValue = stat.get('awayValue')
-                            renderType = stat.get('renderType')
-                            key = stat.get('key')
-                            cursor.execute(insert_column_query, (
-                                match_id, period, groupName, name, home, away, compareCode, statisticsType, valueType, homeValue, awayValue, renderType, key
-                            ))
+            cursor.execute(f"SET LOCAL lock_timeout = '{FEATURE_DDL_LOCK_TIMEOUT}';")
+            # Un solo processo alla volta registra chiavi nuove
+            cursor.execute("LOCK TABLE match_features_columns IN EXCLUSIVE MODE;")
+            cursor.execute("SELECT key, column_suffix FROM match_features_columns;")
+            registry = dict(cursor.fetchall())
+            new_keys = sorted(set(keys) - registry.keys())
+            if new_keys:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_attribute WHERE attrelid = 'match_features_wide'::regclass AND attnum > 0;"
+                )
+                needed = cursor.fetchone()[0] + 2 * len(new_keys)
+                if needed > MAX_TABLE_COLUMNS:
+                    raise RuntimeError(
+                        f"match_features_wide: {len(new_keys)} chiavi nuove porterebbero la tabella a {needed} colonne, "
+                        f"oltre il limite di {MAX_TABLE_COLUMNS} di PostgreSQL (chiavi: {new_keys[:5]}...)"
+                    )
+                used = set(registry.values())
+                additions, rows = [], []
+                for key in new_keys:
+                    suffix = _feature_suffix(key, used)
+                    used.add(suffix)
+                    rows.append((key, suffix))
+                    for side in ('home', 'away'):
+                        additions.append(sql.SQL("ADD COLUMN IF NOT EXISTS {} FLOAT").format(sql.Identifier(f"{side}_{suffix}")))
+                cursor.execute(sql.SQL("ALTER TABLE match_features_wide {}").format(sql.SQL(', ').join(additions)))
+                extras.execute_values(cursor, "INSERT INTO match_features_columns (key, column_suffix) VALUES %s", rows)
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def _refresh_match_features(cursor, match_ids):
+    """Ricalcola le righe di match_features_wide dei match indicati con un'unica INSERT ... GROUP BY.
+
+    Non esegue DDL: se qualche chiave non ha ancora le sue colonne non scrive
+    nulla e ritorna l'insieme di quelle chiavi (vuoto se l'aggiornamento è fatto).
+    """
+    if not match_ids:
+        return set()
+    match_ids = list(match_ids)
+    cursor.execute(
+        "SELECT DISTINCT key FROM match_statistics_column WHERE match_id = ANY(%s) AND key IS NOT NULL;",
+        (match_ids,)
+    )
+    keys = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT key, column_suffix FROM match_features_columns WHERE key = ANY(%s);", (list(keys),))
+    columns = dict(cursor.fetchall())
+    missing = keys - columns.keys()
+    if missing:
+        return missing
+    cursor.execute("DELETE FROM match_features_wide WHERE match_id = ANY(%s);", (match_ids,))
+
+    targets = [sql.Identifier('match_id'), sql.Identifier('period')]
+    values = [sql.SQL('match_id'), sql.SQL('period')]
+    for key, suffix in sorted(columns.items()):
+        for side, value_column in (('home', 'homevalue'), ('away', 'awayvalue')):
+            targets.append(sql.Identifier(f"{side}_{suffix}"))
+            # La stessa chiave può comparire in più gruppi con lo stesso valore
+            values.append(sql.SQL("MAX({}) FILTER (WHERE key = {})").format(sql.Identifier(value_column), sql.Literal(key)))
+    cursor.execute(sql.SQL("""
+    INSERT INTO match_features_wide ({targets})
+    SELECT {values} FROM match_statistics_column
+    WHERE match_id = ANY(%s)
+    GROUP BY match_id, period
+    """).format(targets=sql.SQL(', ').join(targets), values=sql.SQL(', ').join(values)), (match_ids,))
+    return set()
+
+def populate_statistics_column(conn, full=False, server_side=None):
+    """Appiattisce in match_statistics_column solo i JSON nuovi o cambiati.
+
+    Vengono elaborati i match con ``normalized_at IS NULL``, a blocchi di
+    STATISTICS_NORMALIZE_BATCH: le loro vecchie righe vengono sostituite in
+    modo set-based. Con ``full=True`` tutti i match vengono rimarcati come da
+    elaborare (rebuild completo).
+
+    ``server_side`` (default STATISTICS_SERVER_SIDE) sceglie se appiattire il
+    JSON dentro PostgreSQL (jsonb_array_elements/jsonb_to_recordset, niente
+    JSON trasferito al client) o in Python con COPY. L'output è lo stesso.
+    Nella stessa transazione di ogni blocco viene aggiornata match_features_wide;
+    le colonne delle chiavi nuove vengono aggiunte prima, in una transazione a parte.
+    Ritorna la lista dei match_id rielaborati.
+    """
+    if server_side is None:
+        server_side = STATISTICS_SERVER_SIDE
+    normalize_batch = _normalize_statistics_server_side if server_side else _normalize_statistics_client_side
+
+    schema.ensure_schema(conn)
+    normalized_ids = []
+    try:
+        with conn.cursor() as cursor:
+            if full:
+                cursor.execute("TRUNCATE match_statistics_column, match_features_wide;")
+                cursor.execute("UPDATE match_statistics_json SET normalized_at = NULL;")
+                conn.commit()
+
+            while True:
+                match_ids = normalize_batch(conn, cursor)
+                if not match_ids:
+                    break
+                new_keys = _refresh_match_features(cursor, match_ids)
+                if new_keys:
+                    # Chiavi nuove: il blocco viene annullato, le colonne aggiunte
+                    # in una transazione breve a parte e il blocco rifatto
+                    conn.rollback()
+                    _add_feature_columns(conn, new_keys)
+                    continue
+                conn.commit()
+                normalized_ids.extend(match_ids)
         # print("Tabella match_statistics_column popolata con successo.")
     except Exception as e:
+        conn.rollback()
         print(f"Errore nel popolamento della tabella match_statistics_column: {e}")
+    return normalized_ids
 
-def populate_statistics_column_db(conn=None):
+def populate_statistics_column_db(conn=None, full=False, server_side=None):
     should_close = False
     if conn is None:
         conn = create_connection()
         should_close = True
         
     if conn:
-        populate_statistics_column(conn)
+        match_ids = populate_statistics_column(conn, full=full, server_side=server_side)
         if should_close:
             conn.close()
+        return match_ids
     else:
         print("Impossibile connettersi al database per popolare le statistiche colonne.")
 
 def create_incidents_table(conn):
-    """Crea le tabelle per gli incidenti (JSON e Colonne)."""
-    create_json_query = """
-    CREATE TABLE IF NOT EXISTS match_incidents_json (
-        match_id BIGINT PRIMARY KEY,
-        incidents JSONB
-    );
-    """
-    create_column_query = """
-    CREATE TABLE IF NOT EXISTS match_incidents_column (
-        match_id BIGINT,
-        time INT,
-        added_time INT,
-        incident_type TEXT,
-        team_side TEXT,
-        player_name TEXT,
-        home_score INT,
-        away_score INT
-    );
-    """
+    """Garantisce che esistano le tabelle degli incidenti (lo schema è gestito da schema.py)."""
+    schema.ensure_schema(conn)
+
+INCIDENT_COLUMNS = (
+    'match_id', 'time', 'added_time', 'incident_type', 'team_side', 'player_name', 'home_score', 'away_score'
+)
+
+def _incident_rows(match_id, incidents_data):
+    """Righe di match_incidents_column (ordine di INCIDENT_COLUMNS) per un match."""
+    return [
+        (
+            match_id,
+            inc.get('time'),
+            inc.get('addedTime', 0),
+            inc.get('incidentType', inc.get('type')),
+            inc.get('teamSide'),
+            inc.get('player', {}).get('name'),
+            inc.get('homeScore'),
+            inc.get('awayScore')
+        )
+        for inc in incidents_data.get('incidents', [])
+    ]
+
+SCORE_TIMELINE_IDS = "SELECT unnest(%s::bigint[]) AS match_id"
+
+def _refresh_score_timeline(cursor, match_ids):
+    """Ricalcola match_score_timeline per i match indicati (a partire da match_incidents_column)."""
+    if not match_ids:
+        return
+    cursor.execute("DELETE FROM match_score_timeline WHERE match_id = ANY(%s);", (list(match_ids),))
+    cursor.execute(schema.SCORE_TIMELINE_INSERT.format(match_ids=SCORE_TIMELINE_IDS), (list(match_ids),))
+
+def refresh_score_timeline(conn, match_ids=None):
+    """Ricostruisce la timeline dei punteggi per ``match_ids`` (tutti i match con incidenti se None)."""
+    schema.ensure_schema(conn)
     try:
         with conn.cursor() as cursor:
-            cursor.execute(create_json_query)
-            cursor.execute(create_column_query)
+            if match_ids is None:
+                cursor.execute("SELECT DISTINCT match_id FROM match_incidents_column;")
+                match_ids = [row[0] for row in cursor.fetchall()]
+                cursor.execute("TRUNCATE match_score_timeline;")
+            _refresh_score_timeline(cursor, match_ids)
         conn.commit()
     except Exception as e:
-        print(f"Errore nella creazione delle tabelle incidents: {e}")
+        conn.rollback()
+        print(f"Errore nell'aggiornamento di match_score_timeline: {e}")
 
 def insert_incidents(conn, match_id, incidents_data):
     """Inserisce gli incidenti sia in formato JSON che in colonne."""
@@ -332,19 +540,7 @@ def insert_incidents(conn, match_id, incidents_data):
     """
     
     # 2. Preparazione dati per Colonne
-    incidents_list = incidents_data.get('incidents', [])
-    column_data = []
-    for inc in incidents_list:
-        column_data.append((
-            match_id,
-            inc.get('time'),
-            inc.get('addedTime', 0),
-            inc.get('incidentType', inc.get('type')),
-            inc.get('teamSide'),
-            inc.get('player', {}).get('name'),
-            inc.get('homeScore'),
-            inc.get('awayScore')
-        ))
+    column_data = _incident_rows(match_id, incidents_data)
     
     insert_column_query = """
     INSERT INTO match_incidents_column (
@@ -361,6 +557,7 @@ def insert_incidents(conn, match_id, incidents_data):
             cursor.execute("DELETE FROM match_incidents_column WHERE match_id = %s", (match_id,))
             if column_data:
                 extras.execute_batch(cursor, insert_column_query, column_data)
+            _refresh_score_timeline(cursor, [match_id])
                 
         conn.commit()
         # print(f"Incidenti (JSON + Colonne) inseriti per match {match_id}.")
@@ -375,7 +572,7 @@ def save_incidents_to_db(match_id, incidents, conn=None):
         should_close = True
         
     if conn:
-        create_incidents_table(conn)
+        schema.ensure_schema(conn)
         insert_incidents(conn, match_id, incidents)
         if should_close:
             conn.close()
@@ -387,8 +584,307 @@ def check_match_exists(match_id, conn):
     try:
         with conn.cursor() as cursor:
             # Verifichiamo se esiste in grafici o incidenti (segno che Selenium ha già girato)
-            query = "SELECT 1 FROM match_graphics_json WHERE match_id = %s UNION SELECT 1 FROM match_incidents_json WHERE match_id = %s LIMIT 1"
-            cursor.execute(query, (match_id, match_id))
+            # oppure se il backfill lo ha già segnato come completato
+            query = """
+            SELECT 1 FROM match_graphics_json WHERE match_id = %s
+            UNION SELECT 1 FROM match_incidents_json WHERE match_id = %s
+            UNION SELECT 1 FROM backfill_matches WHERE match_id = %s
+            LIMIT 1
+            """
+            cursor.execute(query, (match_id, match_id, match_id))
             return cursor.fetchone() is not None
     except Exception:
+        conn.rollback()
+        return False
+
+def create_checkpoint_tables(conn):
+    """Garantisce che esistano le tabelle di checkpoint del backfill (lo schema è gestito da schema.py)."""
+    schema.ensure_schema(conn)
+
+def mark_date_started(conn, date_str):
+    """Segna una data come in elaborazione (incrementando i tentativi)."""
+    query = """
+    INSERT INTO backfill_dates (date, status, attempts, started_at)
+    VALUES (%s, 'running', 1, now())
+    ON CONFLICT (date) DO UPDATE SET
+        status = 'running', attempts = backfill_dates.attempts + 1,
+        started_at = now(), finished_at = NULL;
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, (date_str,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Errore nel checkpoint di inizio per {date_str}: {e}")
+
+def mark_date_finished(conn, date_str, status, n_events=None, n_new=None, n_skipped=None, n_failed=None):
+    """Registra l'esito ('done' o 'failed') dell'elaborazione di una data."""
+    query = """
+    INSERT INTO backfill_dates (date, status, n_events, n_new, n_skipped, n_failed, finished_at)
+    VALUES (%s, %s, %s, %s, %s, %s, now())
+    ON CONFLICT (date) DO UPDATE SET
+        status = EXCLUDED.status, n_events = EXCLUDED.n_events, n_new = EXCLUDED.n_new,
+        n_skipped = EXCLUDED.n_skipped, n_failed = EXCLUDED.n_failed, finished_at = now();
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, (date_str, status, n_events, n_new, n_skipped, n_failed))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Errore nel checkpoint di fine per {date_str}: {e}")
+
+def get_completed_dates(conn, start_date, end_date):
+    """Ritorna l'insieme delle date (YYYY-MM-DD) già completate nel range indicato."""
+    query = "SELECT date FROM backfill_dates WHERE status = 'done' AND date BETWEEN %s AND %s;"
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, (start_date, end_date))
+            return {row[0].isoformat() for row in cursor.fetchall()}
+    except Exception as e:
+        conn.rollback()
+        print(f"Errore nella lettura dei checkpoint: {e}")
+        return set()
+
+def mark_match_done(conn, match_id, date_str=None):
+    """Registra che i dettagli di un match sono stati scaricati e salvati."""
+    query = """
+    INSERT INTO backfill_matches (match_id, date) VALUES (%s, %s)
+    ON CONFLICT (match_id) DO UPDATE SET completed_at = now();
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, (match_id, date_str))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Errore nel checkpoint del match {match_id}: {e}")
+
+DETAIL_PARTS = ('graphics', 'statistics', 'incidents')
+
+def get_missing_details(conn, match_ids):
+    """Risolve in una sola query quali dettagli mancano per una lista di match.
+
+    Ritorna un dict ``{match_id: {'graphics', 'statistics', 'incidents'}}`` che
+    contiene solo i match a cui manca almeno una parte (insieme delle parti da
+    scaricare). I match in ``backfill_matches`` sono considerati completi:
+    sono già stati scaricati a match concluso e le parti assenti non esistono
+    su SofaScore.
+    """
+    if not match_ids:
+        return {}
+    query = """
+    SELECT ids.match_id,
+           g.match_id IS NULL AS missing_graphics,
+           s.match_id IS NULL AS missing_statistics,
+           i.match_id IS NULL AS missing_incidents
+    FROM unnest(%s::bigint[]) AS ids(match_id)
+    LEFT JOIN match_graphics_json g ON g.match_id = ids.match_id
+    LEFT JOIN match_statistics_json s ON s.match_id = ids.match_id
+    LEFT JOIN match_incidents_json i ON i.match_id = ids.match_id
+    WHERE NOT EXISTS (SELECT 1 FROM backfill_matches b WHERE b.match_id = ids.match_id)
+      AND (g.match_id IS NULL OR s.match_id IS NULL OR i.match_id IS NULL);
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, (list(match_ids),))
+            missing = {}
+            for match_id, *flags in cursor.fetchall():
+                missing[match_id] = {part for part, flag in zip(DETAIL_PARTS, flags) if flag}
+            return missing
+    except Exception as e:
+        conn.rollback()
+        print(f"Errore nel controllo dei dettagli mancanti: {e}")
+        # In caso di errore consideriamo tutto da scaricare
+        return {match_id: set(DETAIL_PARTS) for match_id in match_ids}
+
+# --- Scrittura bulk via COPY -------------------------------------------------
+
+BULK_COPY_ROWS = 50000  # righe per singolo stream COPY
+BULK_FLUSH_MATCHES = 50  # match accumulati prima di un flush automatico
+
+GRAPHICS_COLUMNS = ('match_id',) + tuple(f"possession_{i}" for i in range(1, 91))
+
+def _csv_field(value):
+    """Serializza un valore per COPY ... (FORMAT csv): campo vuoto non quotato = NULL."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, tuple):
+        # Tupla → array PostgreSQL ({1.0,2.5,...})
+        return '"{' + ','.join('NULL' if v is None else repr(v) for v in value) + '}"'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, separators=(',', ':'))
+    return '"' + str(value).replace('"', '""') + '"'
+
+def _copy_rows(cursor, table, columns, rows):
+    """Invia ``rows`` a ``table`` con un singolo stream COPY."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_csv_field(v) for v in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table), sql.SQL(', ').join(sql.Identifier(c.lower()) for c in columns)
+    )
+    cursor.copy_expert(copy_query.as_string(cursor), buffer)
+
+def _copy_upsert(cursor, table, columns, rows, conflict_columns, update_columns, changed_columns=()):
+    """COPY in una tabella temporanea e poi un'unica INSERT ... ON CONFLICT set-based.
+
+    Se ``update_columns`` è vuoto le righe già presenti vengono lasciate invariate.
+    Con ``changed_columns`` l'update avviene solo se almeno una di quelle
+    colonne è effettivamente cambiata. Le colonne di ``update_columns`` non
+    presenti in ``columns`` tornano al loro default (es. normalized_at = NULL).
+    """
+    if not rows:
+        return
+    temp_table = f"tmp_{table}"
+    cursor.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {}) ON COMMIT DROP").format(
+        sql.Identifier(temp_table), sql.Identifier(table)
+    ))
+    cursor.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(temp_table)))
+    _copy_rows(cursor, temp_table, columns, rows)
+
+    cols = sql.SQL(', ').join(sql.Identifier(c.lower()) for c in columns)
+    conflict = sql.SQL(', ').join(sql.Identifier(c.lower()) for c in conflict_columns)
+    if update_columns:
+        action = sql.SQL("DO UPDATE SET ") + sql.SQL(', ').join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c.lower())) for c in update_columns
+        )
+        if changed_columns:
+            action += sql.SQL(" WHERE ({}) IS DISTINCT FROM ({})").format(
+                sql.SQL(', ').join(sql.SQL("{}.{}").format(sql.Identifier(table), sql.Identifier(c.lower())) for c in changed_columns),
+                sql.SQL(', ').join(sql.SQL("EXCLUDED.{}").format(sql.Identifier(c.lower())) for c in changed_columns),
+            )
+    else:
+        action = sql.SQL("DO NOTHING")
+    # DISTINCT ON: se lo stesso match è stato accodato due volte vince l'ultima versione
+    # (ctid cresce con l'ordine di COPY)
+    cursor.execute(sql.SQL("""
+        INSERT INTO {table} ({cols})
+        SELECT DISTINCT ON ({conflict}) {cols} FROM {temp}
+        ORDER BY {conflict}, ctid DESC
+        ON CONFLICT ({conflict}) {action}
+    """).format(table=sql.Identifier(table), cols=cols, conflict=conflict,
+                temp=sql.Identifier(temp_table), action=action))
+
+class BulkWriter:
+    """Accumula in memoria match e dettagli e li scrive con pochi stream COPY.
+
+    Ogni ``flush`` è una singola transazione: COPY in tabelle temporanee e un
+    upsert set-based per tabella (matches, grafici, statistiche, incidenti,
+    checkpoint dei match). Se il flush fallisce viene fatto rollback di tutto
+    il blocco, checkpoint compresi, ma le righe restano in coda e ``failed``
+    diventa True: i flush automatici si fermano e il flush successivo (quello
+    finale di ``process_date``) riprova a scrivere tutto. Chi usa il writer
+    deve controllare il valore di ritorno del flush finale prima di
+    considerare salvati i match.
+
+        with BulkWriter(conn) as writer:
+            writer.add_matches(events)
+            writer.add_graphics(match_id, graphics)
+            ...
+    """
+
+    def __init__(self, conn, flush_every=BULK_FLUSH_MATCHES):
+        self.conn = conn
+        self.flush_every = flush_every
+        self.failed = False
+        self._reset()
+
+    def _reset(self):
+        self.matches = []
+        self.graphics = {}
+        self.statistics = {}
+        self.incidents = {}
+        self.done = []
+
+    @property
+    def pending_matches(self):
+        return len(set(self.graphics) | set(self.statistics) | set(self.incidents) | {m for m, _ in self.done})
+
+    def _maybe_flush(self):
+        # Dopo un flush fallito le righe restano in coda fino al flush esplicito
+        if self.flush_every and not self.failed and self.pending_matches >= self.flush_every:
+            self.flush()
+
+    def add_matches(self, events):
+        self.matches.extend(_match_row(event) for event in events)
+
+    def add_graphics(self, match_id, graphics):
+        self.graphics[match_id] = graphics
+        self._maybe_flush()
+
+    def add_statistics(self, match_id, statistics):
+        self.statistics[match_id] = statistics
+        self._maybe_flush()
+
+    def add_incidents(self, match_id, incidents):
+        self.incidents[match_id] = incidents
+        self._maybe_flush()
+
+    def add_match_done(self, match_id, date_str=None):
+        self.done.append((match_id, date_str))
+        self._maybe_flush()
+
+    def flush(self):
+        """Scrive tutto ciò che è in coda in un'unica transazione. Ritorna True se riuscito."""
+        if not (self.matches or self.graphics or self.statistics or self.incidents or self.done):
+            return True
+        try:
+            with self.conn.cursor() as cursor:
+                _copy_upsert(cursor, 'matches', MATCH_COLUMNS, self.matches, ('id',),
+                             ('home_score', 'away_score', 'status', 'home_score_ht', 'away_score_ht',
+                              'home_team_id', 'away_team_id'))
+
+                _copy_upsert(cursor, 'match_graphics_json', ('match_id', 'graphics'),
+                             list(self.graphics.items()), ('match_id',), ('graphics',))
+                curves = {m: _graphics_curve(g) for m, g in self.graphics.items()}
+                if GRAPHICS_CURVE_TABLE:
+                    _copy_upsert(cursor, 'match_graphics_curve', GRAPHICS_CURVE_COLUMNS,
+                                 [(m, *curve) for m, curve in curves.items()],
+                                 ('match_id',), GRAPHICS_CURVE_COLUMNS[1:])
+                else:
+                    _copy_upsert(cursor, 'match_graphics_column', GRAPHICS_COLUMNS,
+                                 [(m, *_graphics_column_values(g)) for m, g in self.graphics.items()],
+                                 ('match_id',), GRAPHICS_COLUMNS[1:])
+                candles.write_candles(cursor, curves)
+
+                # Un JSON cambiato torna "da normalizzare" (normalized_at = NULL)
+                _copy_upsert(cursor, 'match_statistics_json', ('match_id', 'statistics'),
+                             list(self.statistics.items()), ('match_id',), ('statistics', 'normalized_at'),
+                             changed_columns=('statistics',))
+
+                _copy_upsert(cursor, 'match_incidents_json', ('match_id', 'incidents'),
+                             list(self.incidents.items()), ('match_id',), ('incidents',))
+                if self.incidents:
+                    # Tabella figlia senza chiave: sostituiamo in blocco le righe dei match
+                    cursor.execute("DELETE FROM match_incidents_column WHERE match_id = ANY(%s)",
+                                   (list(self.incidents),))
+                    _copy_rows(cursor, 'match_incidents_column', INCIDENT_COLUMNS,
+                               [row for m, data in self.incidents.items() for row in _incident_rows(m, data)])
+                    _refresh_score_timeline(cursor, list(self.incidents))
+
+                _copy_upsert(cursor, 'backfill_matches', ('match_id', 'date'), self.done, ('match_id',), ())
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.failed = True
+            print(f"Errore nella scrittura bulk ({self.pending_matches} match, {len(self.matches)} eventi): {e}")
+            return False
+        self.failed = False
+        self._reset()
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
         return False
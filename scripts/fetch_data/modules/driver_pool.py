@@ -0,0 +1,275 @@
+"""
+Pool di istanze Chrome (Selenium) già avviate e riutilizzabili.
+
+Avviare Chrome costa secondi e centinaia di MB: invece di chiudere e
+ricreare il driver ad ogni errore, il pool mantiene fino a ``size`` driver
+"caldi" che vengono prestati (lease) e restituiti. Alla restituzione il
+driver viene:
+
+- controllato (health check) dopo un errore e ogni ``health_check_pages``
+  pagine: se non risponde viene chiuso e sostituito;
+- riciclato dopo ``max_pages`` pagine caricate;
+- riciclato se la memoria di Chrome supera ``max_memory_mb`` (controllata
+  insieme all'health check; richiede psutil, opzionale: senza psutil il
+  controllo viene saltato).
+
+Chi chiede un driver con il pool pieno attende al più ``ACQUIRE_TIMEOUT``
+secondi e viene svegliato sia quando un driver rientra sia quando uno viene
+scartato (e se ne può creare un altro).
+
+Il modulo non ha import relativi, così può essere usato sia dal package
+``fetch_data/modules`` sia dagli script in ``core/``.
+
+    pool = DriverPool(size=2)
+    with pool.lease() as driver:
+        driver.get(url)
+    pool.close()
+"""
+
+import atexit
+import contextlib
+import logging
+import threading
+import time
+
+from selenium import webdriver
+
+try:
+    import psutil
+except ImportError:  # opzionale: serve solo per il riciclo in base alla memoria
+    psutil = None
+
+DEFAULT_POOL_SIZE = 2
+MAX_PAGES_PER_DRIVER = 300
+MAX_MEMORY_MB = 1500
+PAGE_LOAD_TIMEOUT = 45
+ACQUIRE_TIMEOUT = 120  # secondi di attesa massima per un driver libero
+HEALTH_CHECK_PAGES = 25  # pagine tra un health check e l'altro al rientro
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+
+def create_driver(headless=True, page_load_timeout=PAGE_LOAD_TIMEOUT):
+    """Crea un Chrome configurato per leggere le API SofaScore."""
+    options = webdriver.ChromeOptions()
+    if headless:
+        # Usiamo il flag --headless=new che è più stabile
+        options.add_argument('--headless=new')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--window-size=1920,1080')
+
+    # Aggiungo un User-Agent normale per provare a mitigare il 403
+    options.add_argument(f'--user-agent={USER_AGENT}')
+
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(page_load_timeout)
+    return driver
+
+
+# Pool ancora aperti, chiusi all'uscita del processo da un unico handler atexit
+# (registrato una volta sola, non uno per pool); close() li toglie dal set
+_live_pools = set()
+_live_pools_lock = threading.Lock()
+
+
+def _close_live_pools():
+    with _live_pools_lock:
+        pools = list(_live_pools)
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(_close_live_pools)
+
+
+class _LeasedDriver:
+    """Proxy del WebDriver prestato: inoltra tutto e conta le pagine caricate."""
+
+    def __init__(self, driver):
+        self._driver = driver
+        self.pages = 0
+
+    def get(self, url):
+        self.pages += 1
+        return self._driver.get(url)
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+class DriverPool:
+    """Pool limitato di WebDriver con lease/return, health check e riciclo."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, headless=True, max_pages=MAX_PAGES_PER_DRIVER,
+                 max_memory_mb=MAX_MEMORY_MB, page_load_timeout=PAGE_LOAD_TIMEOUT, factory=None,
+                 health_check_pages=HEALTH_CHECK_PAGES):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.health_check_pages = health_check_pages
+        self._factory = factory or (lambda: create_driver(headless, page_load_timeout))
+        self._idle = []  # usata come pila (LIFO): riusiamo il driver più "caldo"
+        self._pages = {}  # id(driver) -> pagine caricate
+        self._unchecked = {}  # id(driver) -> pagine dall'ultimo health check
+        self._created = 0
+        self._closed = False
+        # Protegge _idle/_created/_pages; chi attende un driver viene svegliato
+        # sia quando un driver torna nel pool sia quando ne viene scartato uno
+        self._cond = threading.Condition()
+        with _live_pools_lock:
+            _live_pools.add(self)
+
+    # --- ciclo di vita dei driver -------------------------------------------
+
+    def _new_driver(self):
+        driver = self._factory()
+        with self._cond:
+            self._pages[id(driver)] = 0
+            self._unchecked[id(driver)] = 0
+        return driver
+
+    def _discard(self, driver):
+        with self._cond:
+            self._pages.pop(id(driver), None)
+            self._unchecked.pop(id(driver), None)
+            self._created -= 1
+            # Si è liberato un posto: un thread in attesa può creare un nuovo driver
+            self._cond.notify()
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def is_healthy(self, driver):
+        """Health check: il driver risponde ancora ai comandi?"""
+        try:
+            return driver.execute_script('return 1') == 1 and bool(driver.window_handles)
+        except Exception:
+            return False
+
+    def memory_mb(self, driver):
+        """Memoria (RSS) di chromedriver + processi Chrome figli, in MB (None senza psutil)."""
+        if psutil is None:
+            return None
+        try:
+            process = psutil.Process(driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+        except Exception:
+            return None
+
+    def _should_recycle(self, driver):
+        pages = self._pages.get(id(driver), 0)
+        if self.max_pages and pages >= self.max_pages:
+            logging.info(f"Driver riciclato dopo {pages} pagine.")
+            return True
+        return False
+
+    def _over_memory(self, driver):
+        if self.max_memory_mb:
+            memory = self.memory_mb(driver)
+            if memory is not None and memory > self.max_memory_mb:
+                logging.info(f"Driver riciclato: memoria {memory:.0f} MB > {self.max_memory_mb} MB.")
+                return True
+        return False
+
+    def _needs_check(self, driver):
+        """Health check (e controllo memoria) solo ogni ``health_check_pages`` pagine, non ad ogni rientro."""
+        with self._cond:
+            unchecked = self._unchecked.get(id(driver), 0)
+            if unchecked < self.health_check_pages:
+                return False
+            self._unchecked[id(driver)] = 0
+            return True
+
+    # --- lease / return -----------------------------------------------------
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        """Prende un driver dal pool: uno inattivo, altrimenti ne crea uno se c'è posto, altrimenti attende.
+
+        Solleva TimeoutError se entro ``timeout`` secondi (None = senza limite)
+        non si libera nessun driver.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("DriverPool chiuso")
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Nessun driver libero nel pool entro {timeout} s")
+                self._cond.wait(remaining)
+        # Avvio di Chrome fuori dal lock: può richiedere secondi
+        try:
+            return self._new_driver()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, driver, pages=0, broken=False):
+        """Restituisce un driver; viene chiuso se rotto, da riciclare o se il pool è chiuso."""
+        with self._cond:
+            self._pages[id(driver)] = self._pages.get(id(driver), 0) + pages
+            self._unchecked[id(driver)] = self._unchecked.get(id(driver), 0) + pages
+        discard = self._closed or broken or self._should_recycle(driver)
+        if not discard and self._needs_check(driver):
+            discard = not self.is_healthy(driver) or self._over_memory(driver)
+        if not discard:
+            with self._cond:
+                # Ricontrollato sotto lock: close() potrebbe essere arrivato nel frattempo
+                discard = self._closed
+                if not discard:
+                    self._idle.append(driver)
+                    self._cond.notify()
+        if discard:
+            self._discard(driver)
+
+    @contextlib.contextmanager
+    def lease(self, timeout=ACQUIRE_TIMEOUT):
+        """Context manager: presta un driver e lo restituisce all'uscita."""
+        driver = self.acquire(timeout)
+        leased = _LeasedDriver(driver)
+        broken = False
+        try:
+            yield leased
+        except Exception:
+            # Dopo un errore il driver viene tenuto solo se supera l'health check
+            broken = not self.is_healthy(driver)
+            raise
+        finally:
+            self.release(driver, pages=leased.pages, broken=broken)
+
+    def close(self):
+        """Chiude tutti i driver inattivi; quelli in prestito verranno chiusi al rientro."""
+        with _live_pools_lock:
+            _live_pools.discard(self)
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            # Chi è in attesa in acquire esce con RuntimeError
+            self._cond.notify_all()
+        for driver in idle:
+            self._discard(driver)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(headless=True, size=DEFAULT_POOL_SIZE):
+    """Pool condiviso del processo per la modalità headless indicata."""
+    with _pools_lock:
+        pool = _pools.get(headless)
+        if pool is None or pool._closed:
+            pool = DriverPool(size=size, headless=headless)
+            _pools[headless] = pool
+        return pool
@@ -1,57 +1,223 @@
+import asyncio
+import concurrent.futures
 import logging
 import time
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException, WebDriverException
 from . import db_module
+from . import driver_pool
 from . import get_matches_per_day
+from . import rate_limiter
+from . import response_cache
+from . import schema
+from . import transport as transport_module
 
 MAX_RETRIES = 3
-RETRY_WAIT = 5  # secondi di attesa tra i retry
+ASYNC_MODE = True  # scarica i dettagli di più match in parallelo
+CONCURRENCY = 8  # match in volo contemporaneamente in modalità async
 
 def setup_driver(headless=True):
-    options = webdriver.ChromeOptions()
-    if headless:
-        # Usiamo il flag --headless=new che è più stabile
-        options.add_argument('--headless=new')
-    options.add_argument('--disable-gpu')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    options.add_argument('--disable-extensions')
-    options.add_argument('--window-size=1920,1080')
+    return driver_pool.create_driver(headless)
+
+def create_transport(headless_mode=True, backend=None):
+    """Trasporto per le API: HTTP keep-alive, con Chrome solo come fallback.
+
+    Il fallback prende i driver dal pool condiviso del processo, così restano
+    caldi tra una data e l'altra invece di essere ricreati ad ogni errore.
+    """
+    return transport_module.create_transport(
+        backend=backend,
+        pool=driver_pool.get_pool(headless_mode)
+    )
+
+def _retry_wait(attempt):
+    """Attesa prima del tentativo successivo, dettata dal backoff del rate limiter."""
+    return rate_limiter.get_limiter().backoff_delay(attempt + 1)
+
+def _reset_transport(transport, attempt=0):
+    """Chiude connessioni/driver del trasporto prima di un nuovo tentativo."""
+    logging.warning(f"Reset del trasporto '{transport.name}'...")
+    transport.reset()
+    time.sleep(_retry_wait(attempt))
+    return transport
+
+def _event_status(event):
+    return event.get('status', {}).get('type')
+
+DETAIL_FETCHERS = {
+    'graphics': get_matches_per_day.get_graphics_per_match,
+    'statistics': get_matches_per_day.get_statistics_per_match,
+    'incidents': get_matches_per_day.get_incidents_per_match,
+}
+
+DETAIL_SAVERS = {
+    'graphics': db_module.BulkWriter.add_graphics,
+    'statistics': db_module.BulkWriter.add_statistics,
+    'incidents': db_module.BulkWriter.add_incidents,
+}
+
+def _download_match_details(match_id, transport, status=None, parts=db_module.DETAIL_PARTS):
+    """Scarica (in sequenza) le parti richieste di un match: {parte: payload}."""
+    return {part: DETAIL_FETCHERS[part](match_id, transport, status) for part in parts}
+
+# Codici di {"error": {"code": ...}} che confermano l'assenza della parte
+ABSENT_ERROR_CODES = (404,)
+
+def _is_absent(payload):
+    """True se SofaScore conferma che la parte non esiste (es. 404), non per errori transitori."""
+    error = payload.get('error') if isinstance(payload, dict) else None
+    return isinstance(error, dict) and error.get('code') in ABSENT_ERROR_CODES
+
+def _save_match_details(match_id, details, writer, date_str=None, status=None):
+    """Accoda i dettagli nel BulkWriter (scritti via COPY al prossimo flush)."""
+    complete = True
+    for part, payload in details.items():
+        # Le risposte {"error": ...} (es. statistiche non ancora disponibili)
+        # non vengono salvate, così la parte risulta ancora mancante
+        if payload and 'error' not in payload:
+            DETAIL_SAVERS[part](writer, match_id, payload)
+        elif not _is_absent(payload):
+            complete = False
+            logging.debug(f"Match {match_id}: parte '{part}' non disponibile ({payload}), nessun checkpoint.")
+    # Checkpoint per-match solo a match concluso (prima i dati possono ancora
+    # cambiare) e solo se ogni parte è salvata o assente su SofaScore: dopo un
+    # errore transitorio il match deve restare da riprovare
+    if complete and status in response_cache.FINAL_STATUSES:
+        writer.add_match_done(match_id, date_str)
+
+def _pending_events(events, conn):
+    """Eventi che hanno ancora dettagli da scaricare, con le parti mancanti (una sola query)."""
+    missing = db_module.get_missing_details(conn, [event['id'] for event in events])
+    return [(event, missing[event['id']]) for event in events if event['id'] in missing]
+
+def _process_events_sequential(date_str, events, transport, writer):
+    """Scarica i dettagli un match alla volta. Ritorna (nuovi, già presenti, falliti)."""
+    from tqdm.auto import tqdm
     
-    # Aggiungo un User-Agent normale per provare a mitigare il 403
-    options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+    # --- CONTROLLO ESISTENZA (bulk) ---
+    pending = _pending_events(events, writer.conn)
+    skipped_matches = len(events) - len(pending)
     
-    driver = webdriver.Chrome(options=options)
-    driver.set_page_load_timeout(45)
-    return driver
-
-def _restart_driver(driver, headless_mode):
-    """Chiude il driver corrente (se esiste) e ne crea uno nuovo."""
-    if driver:
-        try:
-            driver.quit()
-        except Exception:
-            pass
-    logging.warning("Ricreazione del driver Chrome...")
-    time.sleep(RETRY_WAIT)
-    return setup_driver(headless_mode)
-
-def process_date(date_str, headless_mode=True):
-    driver = None
+    new_matches_processed = 0
+    failed_matches = 0
+    pbar = tqdm(pending, desc=f"Partite {date_str}", unit="match", leave=False)
+    for event, parts in pbar:
+        match_id = event['id']
+        home_team = event['homeTeam']['name']
+        away_team = event['awayTeam']['name']
+        status = _event_status(event)
+        
+        pbar.set_description(f"Data: {date_str} | {home_team} vs {away_team}")
+        
+        # Scarica dettagli con retry in caso di timeout
+        match_success = False
+        for attempt in range(MAX_RETRIES):
+            try:
+                details = _download_match_details(match_id, transport, status, sorted(parts))
+                _save_match_details(match_id, details, writer, date_str, status)
+                match_success = True
+                break  # Successo, esci dal loop retry
+                
+            except Exception as e:
+                logging.warning(f"[{date_str}] Match {match_id} ({home_team} vs {away_team}) tentativo {attempt+1}/{MAX_RETRIES}: {type(e).__name__}: {e}")
+                if attempt < MAX_RETRIES - 1:
+                    transport = _reset_transport(transport, attempt)
+        
+        if match_success:
+            new_matches_processed += 1
+        else:
+            failed_matches += 1
+            logging.error(f"[{date_str}] Match {match_id} ({home_team} vs {away_team}) SALTATO dopo {MAX_RETRIES} tentativi.")
+    pbar.close()
+    return new_matches_processed, skipped_matches, failed_matches
+
+async def _fetch_match_async(date_str, event, parts, transport, writer, semaphore):
+    """Scarica in parallelo gli endpoint mancanti di un match, con gli stessi retry del loop sequenziale.
+
+    Il ritmo complessivo delle richieste è garantito dal rate limiter condiviso,
+    non dal numero di match in volo.
+    """
+    match_id = event['id']
+    home_team = event['homeTeam']['name']
+    away_team = event['awayTeam']['name']
+    status = _event_status(event)
+    parts = sorted(parts)
+    
+    async with semaphore:
+        for attempt in range(MAX_RETRIES):
+            try:
+                payloads = await asyncio.gather(*[
+                    asyncio.to_thread(DETAIL_FETCHERS[part], match_id, transport, status)
+                    for part in parts
+                ])
+                # Il salvataggio avviene nel thread dell'event loop: la connessione
+                # psycopg2 (usata dai flush del writer) resta su un solo thread
+                _save_match_details(match_id, dict(zip(parts, payloads)), writer, date_str, status)
+                return True
+            except Exception as e:
+                logging.warning(f"[{date_str}] Match {match_id} ({home_team} vs {away_team}) tentativo {attempt+1}/{MAX_RETRIES}: {type(e).__name__}: {e}")
+                if attempt < MAX_RETRIES - 1:
+                    # Niente reset del trasporto: è condiviso con le altre richieste in volo
+                    await asyncio.sleep(_retry_wait(attempt))
+    
+    logging.error(f"[{date_str}] Match {match_id} ({home_team} vs {away_team}) SALTATO dopo {MAX_RETRIES} tentativi.")
+    return False
+
+async def _process_events_async(date_str, events, transport, writer, concurrency):
+    """Scarica i dettagli di al massimo ``concurrency`` match alla volta. Ritorna (nuovi, già presenti, falliti)."""
+    from tqdm.auto import tqdm
+    
+    pending = _pending_events(events, writer.conn)
+    skipped_matches = len(events) - len(pending)
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.ensure_future(_fetch_match_async(date_str, event, parts, transport, writer, semaphore))
+        for event, parts in pending
+    ]
+    
+    new_matches_processed = 0
+    failed_matches = 0
+    pbar = tqdm(total=len(tasks), desc=f"Partite {date_str}", unit="match", leave=False)
+    for next_done in asyncio.as_completed(tasks):
+        if await next_done:
+            new_matches_processed += 1
+        else:
+            failed_matches += 1
+        pbar.update(1)
+    pbar.close()
+    return new_matches_processed, skipped_matches, failed_matches
+
+def _run_coroutine(coro):
+    """Esegue una coroutine anche se c'è già un event loop attivo (es. Jupyter)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+def process_date(date_str, headless_mode=True, backend=None, async_mode=ASYNC_MODE, concurrency=CONCURRENCY, checkpoint=False, rebuild_statistics=True):
+    """Scarica e salva match e dettagli di una data.
+
+    Con ``checkpoint=True`` l'esito (con i conteggi) viene registrato anche in
+    ``backfill_dates``; il completamento dei singoli match è sempre registrato
+    in ``backfill_matches``.
+    """
+    transport = None
     conn = None
     
     try:
         logging.debug(f"Inzio elaborazione per data: {date_str}")
         
-        # 1. Setup Driver
-        driver = setup_driver(headless_mode)
+        # 1. Setup Trasporto (Chrome viene avviato solo se serve il fallback)
+        transport = create_transport(headless_mode, backend)
         
         # 2. Connessione DB
         conn = db_module.create_connection()
         if not conn:
             logging.error("Impossibile connettersi al DB.")
             return False
+        # Migrazioni applicate una volta per processo: da qui in poi lo schema esiste
+        schema.ensure_schema(conn)
 
         # 3. Download Lista Match (con retry)
         logging.debug(f"Scaricamento lista partite per {date_str}...")
@@ -59,18 +225,18 @@ def process_date(date_str, headless_mode=True):
         last_error = None
         for attempt in range(MAX_RETRIES):
             try:
-                data = get_matches_per_day.get_matches_data(date_str, driver=driver)
+                data = get_matches_per_day.get_matches_data(date_str, driver=transport)
                 if data:
                     break
                 else:
                     logging.warning(f"[{date_str}] Tentativo {attempt+1}/{MAX_RETRIES}: get_matches_data ha ritornato None (nessun JSON estratto)")
                     if attempt < MAX_RETRIES - 1:
-                        driver = _restart_driver(driver, headless_mode)
+                        transport = _reset_transport(transport, attempt)
             except Exception as e:
                 last_error = e
                 logging.warning(f"[{date_str}] Tentativo {attempt+1}/{MAX_RETRIES} ECCEZIONE: {type(e).__name__}: {e}")
                 if attempt < MAX_RETRIES - 1:
-                    driver = _restart_driver(driver, headless_mode)
+                    transport = _reset_transport(transport, attempt)
         
         if not data:
             logging.error(f"[{date_str}] FALLITO: impossibile scaricare la lista match dopo {MAX_RETRIES} tentativi. Ultimo errore: {last_error}")
@@ -85,70 +251,38 @@ def process_date(date_str, headless_mode=True):
         total = len(events)
         logging.info(f"[{date_str}] Trovati {total} eventi.")
 
-        # 4. Salvataggio Match Base
-        db_module.save_matches_to_db(events, conn=conn)
-        
-        from tqdm.auto import tqdm
+        # 4. Salvataggio Match Base (COPY + upsert in un colpo solo)
+        writer = db_module.BulkWriter(conn)
+        writer.add_matches(events)
+        if not writer.flush():
+            logging.error(f"[{date_str}] Scrittura della lista match fallita.")
+            return False
         
-        # 5. Loop dettagli (Statistiche, Grafici e Incidenti)
-        new_matches_processed = 0
-        skipped_matches = 0
-        failed_matches = 0
-        pbar = tqdm(events, desc=f"Partite {date_str}", unit="match", leave=False)
-        for i, event in enumerate(pbar):
-            match_id = event['id']
-            home_team = event['homeTeam']['name']
-            away_team = event['awayTeam']['name']
-            
-            # --- CONTROLLO ESISTENZA ---
-            if db_module.check_match_exists(match_id, conn):
-                skipped_matches += 1
-                continue
-            
-            pbar.set_description(f"Data: {date_str} | {home_team} vs {away_team}")
-            
-            # Scarica dettagli con retry in caso di timeout
-            match_success = False
-            for attempt in range(MAX_RETRIES):
-                try:
-                    # Scarica e salva Grafici
-                    graphics = get_matches_per_day.get_graphics_per_match(match_id, driver)
-                    if graphics:
-                        db_module.save_graphics_to_db(match_id, graphics, conn=conn)
-                    
-                    # Scarica e salva Statistiche
-                    statistics = get_matches_per_day.get_statistics_per_match(match_id, driver)
-                    if statistics:
-                        db_module.save_statistics_to_db(match_id, statistics, conn=conn)
-                    
-                    # Scarica e salva Incidenti (Goal, cartellini, ecc.)
-                    incidents = get_matches_per_day.get_incidents_per_match(match_id, driver)
-                    if incidents:
-                        db_module.save_incidents_to_db(match_id, incidents, conn=conn)
-                    
-                    match_success = True
-                    break  # Successo, esci dal loop retry
-                    
-                except Exception as e:
-                    logging.warning(f"[{date_str}] Match {match_id} ({home_team} vs {away_team}) tentativo {attempt+1}/{MAX_RETRIES}: {type(e).__name__}: {e}")
-                    if attempt < MAX_RETRIES - 1:
-                        driver = _restart_driver(driver, headless_mode)
-            
-            if match_success:
-                new_matches_processed += 1
-            else:
-                failed_matches += 1
-                logging.error(f"[{date_str}] Match {match_id} ({home_team} vs {away_team}) SALTATO dopo {MAX_RETRIES} tentativi.")
-            
-            # Piccolo sleep per cortesia
-            time.sleep(0.5)
-        pbar.close()
+        # 5. Loop dettagli (Statistiche, Grafici e Incidenti), scritti a blocchi dal writer
+        if async_mode and concurrency > 1:
+            new_matches_processed, skipped_matches, failed_matches = _run_coroutine(
+                _process_events_async(date_str, events, transport, writer, concurrency)
+            )
+        else:
+            new_matches_processed, skipped_matches, failed_matches = _process_events_sequential(
+                date_str, events, transport, writer
+            )
+        # Il flush finale riprova anche i blocchi di un flush automatico fallito:
+        # se non riesce la data non viene conteggiata né segnata come completata
+        if not writer.flush():
+            logging.error(f"[{date_str}] Scrittura finale dei dettagli fallita: {new_matches_processed} match non salvati.")
+            return False
         
         # 6. Aggiorna colonne statistiche (SOLO SE ABBIAMO NUOVI DATI)
-        if new_matches_processed > 0:
+        if rebuild_statistics and new_matches_processed > 0:
             logging.info(f"[{date_str}] Rielaborazione colonne statistiche per {new_matches_processed} nuovi match...")
             db_module.populate_statistics_column_db(conn=conn)
         
+        if checkpoint:
+            # 'partial' se qualche match è fallito: il prossimo backfill riprenderà la data
+            status = 'done' if failed_matches == 0 else 'partial'
+            db_module.mark_date_finished(conn, date_str, status, total, new_matches_processed, skipped_matches, failed_matches)
+        
         logging.info(f"[{date_str}] COMPLETATA — Nuovi: {new_matches_processed}, Già presenti: {skipped_matches}, Falliti: {failed_matches}")
         return True
         
@@ -156,7 +290,7 @@ def process_date(date_str, headless_mode=True):
         logging.error(f"[{date_str}] ERRORE CRITICO: {type(e).__name__}: {e}", exc_info=True)
         return False
     finally:
-        if driver:
-            driver.quit()
+        if transport:
+            transport.close()
         if conn:
             conn.close()
@@ -1,96 +1,135 @@
-import json
-import re
-import time
 import logging
-from selenium import webdriver
+from . import rate_limiter
+from . import response_cache
+from . import transport as transport_module
+from .transport import extract_json_from_pre
 
-def extract_json_from_pre(page_source):
-    """Estrae e carica il JSON dal tag <pre> della pagina."""
-    json_match = re.search(r'<pre>(.*?)</pre>', page_source, re.DOTALL)
-    if json_match:
+BASE_URL = 'https://www.sofascore.com/api/v1'
+
+_default_transport = None
+
+def _get_default_transport():
+    """Trasporto condiviso usato quando il chiamante non ne passa uno (fallback dal pool Chrome)."""
+    global _default_transport
+    if _default_transport is None:
+        from . import driver_pool
+        _default_transport = transport_module.create_transport(pool=driver_pool.get_pool())
+    return _default_transport
+
+def _as_transport(source):
+    """Accetta un trasporto (con get_json) oppure un WebDriver Selenium già aperto."""
+    if source is None:
+        return _get_default_transport()
+    if hasattr(source, 'get_json'):
+        return source
+    # Compatibilità: driver Selenium passato direttamente
+    return transport_module.SeleniumTransport(driver=source)
+
+def fetch_json(url, source=None, limiter=None, ttl=response_cache.DEFAULT_TTL, use_cache=True):
+    """Scarica un endpoint e ritorna il JSON decodificato (None se assente).
+
+    Prima della rete viene consultata la cache su disco (``response_cache``);
+    ``ttl`` è la validità della risposta in secondi (None = per sempre) oppure
+    una funzione che la calcola dal payload.
+
+    Ogni chiamata in rete passa dal rate limiter condiviso, che viene informato
+    dell'esito per adattare il ritmo (403/429 e pagine vuote lo rallentano).
+    """
+    cache = response_cache.get_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(url)
+        if cached is not None:
+            logging.debug(f"GET {url} [cache]")
+            return cached
+        if cache.offline:
+            logging.debug(f"GET {url}: assente in cache (modalità offline)")
+            return None
+
+    limiter = limiter or rate_limiter.get_limiter()
+    endpoint = rate_limiter.endpoint_of(url)
+    limiter.acquire(endpoint)
+    transport = _as_transport(source)
+    try:
+        if isinstance(transport, transport_module.FallbackTransport):
+            # Il rifiuto HTTP rallenta il bucket anche se poi risponde Selenium
+            def on_refusal(status):
+                limiter.report_refusal(endpoint, status)
+                limiter.acquire(endpoint)
+            data = transport.get_json(url, on_refusal=on_refusal)
+        else:
+            data = transport.get_json(url)
+    except transport_module.TransportRefused as e:
+        limiter.report_refusal(endpoint, e.status)
+        raise
+    if data is None:
+        limiter.report_refusal(endpoint)
+        return None
+    limiter.report_success(endpoint)
+
+    # Le risposte di errore (es. 404 {"error": ...}) non vengono salvate
+    if cache is not None and not (isinstance(data, dict) and 'error' in data):
         try:
-            return json.loads(json_match.group(1))
-        except json.JSONDecodeError as e:
-            logging.error(f"Errore nella decodifica JSON: {e}")
-            logging.debug(f"Contenuto raw (primi 500 char): {json_match.group(1)[:500]}")
-    else:
-        # Log diagnostico: cosa c'è nella pagina se non troviamo <pre>?
-        snippet = page_source[:500] if page_source else "(pagina vuota)"
-        logging.warning(f"Tag <pre> non trovato nella risposta. Snippet pagina: {snippet}")
-    return None
+            cache.put(url, data, ttl(data) if callable(ttl) else ttl)
+        except OSError as e:
+            logging.warning(f"Impossibile salvare in cache {url}: {e}")
+    return data
+
+def _events_ttl(data):
+    return response_cache.ttl_for_events(data.get('events', [])) if isinstance(data, dict) else response_cache.DEFAULT_TTL
 
 def get_matches_data(date, driver=None):
     """Ottiene i dati dei match per una data specifica.
-    
-    NOTA: questa funzione NON cattura le eccezioni di Selenium internamente,
+
+    ``driver`` può essere un trasporto di ``transport.py`` o un WebDriver;
+    se None viene usato il trasporto HTTP condiviso.
+
+    NOTA: questa funzione NON cattura le eccezioni del trasporto internamente,
     così il chiamante può gestire i retry.
     """
-    url = f'https://www.sofascore.com/api/v1/sport/football/scheduled-events/{date}'
-    
-    close_driver = False
-    if driver is None:
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless')
-        driver = webdriver.Chrome(options=options)
-        close_driver = True
-    
+    url = f'{BASE_URL}/sport/football/scheduled-events/{date}'
+
     try:
-        logging.debug(f"GET {url}")
-        driver.get(url)
-        time.sleep(1)
-        
-        # Log diagnostico: stato della pagina
-        current_url = driver.current_url
-        page_len = len(driver.page_source) if driver.page_source else 0
-        logging.debug(f"Pagina caricata: URL={current_url}, dimensione={page_len} chars")
-        
-        data = extract_json_from_pre(driver.page_source)
-        
+        data = fetch_json(url, driver, ttl=_events_ttl)
+
         if data is None:
             logging.warning(f"Nessun JSON estratto per data {date}")
         elif 'events' not in data:
             logging.warning(f"JSON ricevuto per {date} ma senza 'events'. Chiavi: {list(data.keys())}")
         else:
             logging.debug(f"JSON OK per {date}: {len(data.get('events', []))} eventi trovati")
-        
+
         return data
     except Exception as e:
-        logging.error(f"Errore Selenium per data {date}: {type(e).__name__}: {e}")
+        logging.error(f"Errore di fetch per data {date}: {type(e).__name__}: {e}")
         # Ri-lanciamo l'eccezione per permettere al chiamante di gestire i retry
         raise
-    finally:
-        if close_driver:
-            driver.quit()
 
-def get_graphics_per_match(match_id, driver):
-    """Ottiene i grafici (possessione/pressione) per un match."""
-    url = f'https://www.sofascore.com/api/v1/event/{match_id}/graph'
+def get_graphics_per_match(match_id, driver=None, status=None):
+    """Ottiene i grafici (possessione/pressione) per un match.
+
+    ``status`` è lo status.type dell'evento e decide la scadenza in cache.
+    """
+    url = f'{BASE_URL}/event/{match_id}/graph'
     try:
-        driver.get(url)
-        time.sleep(0.5)
-        return extract_json_from_pre(driver.page_source)
+        return fetch_json(url, driver, ttl=response_cache.ttl_for_status(status))
     except Exception as e:
         logging.error(f"Errore nel recupero dei grafici per match {match_id}: {type(e).__name__}: {e}")
         raise
 
-def get_statistics_per_match(match_id, driver):
+def get_statistics_per_match(match_id, driver=None, status=None):
     """Ottiene le statistiche dettagliate per un match."""
-    url = f'https://www.sofascore.com/api/v1/event/{match_id}/statistics'
+    url = f'{BASE_URL}/event/{match_id}/statistics'
     try:
-        driver.get(url)
-        time.sleep(0.5)
-        return extract_json_from_pre(driver.page_source)
+        return fetch_json(url, driver, ttl=response_cache.ttl_for_status(status))
     except Exception as e:
         logging.error(f"Errore nel recupero delle statistiche per match {match_id}: {type(e).__name__}: {e}")
         raise
 
-def get_incidents_per_match(match_id, driver):
+def get_incidents_per_match(match_id, driver=None, status=None):
     """Ottiene gli incidenti (goal, cartellini, ecc.) per un match."""
-    url = f'https://www.sofascore.com/api/v1/event/{match_id}/incidents'
+    url = f'{BASE_URL}/event/{match_id}/incidents'
     try:
-        driver.get(url)
-        time.sleep(0.5)
-        return extract_json_from_pre(driver.page_source)
+        return fetch_json(url, driver, ttl=response_cache.ttl_for_status(status))
     except Exception as e:
         logging.error(f"Errore nel recupero degli incidenti per match {match_id}: {type(e).__name__}: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,145 @@
+"""
+Rate limiter centralizzato per le chiamate alle API SofaScore.
+
+Ogni richiesta passa da ``RateLimiter.acquire(endpoint)``, che rispetta un
+budget globale (token bucket: richieste/secondo + burst) e, opzionalmente,
+un budget per endpoint. Quando il server risponde con 403/429 o con pagine
+senza JSON il limiter rallenta (dimezza il rate effettivo e impone una pausa
+crescente a tutti i worker); con le risposte buone il rate risale gradualmente.
+
+Il limiter è thread-safe: un'unica istanza (``get_limiter()``) è condivisa da
+tutti i thread di fetch dello stesso processo.
+"""
+
+import logging
+import threading
+import time
+
+DEFAULT_RATE = 4.0  # richieste/secondo complessive
+DEFAULT_BURST = 8
+ENDPOINT_LIMITS = {
+    # endpoint: (richieste/secondo, burst)
+    'scheduled-events': (0.5, 1),
+    'graph': (2.0, 4),
+    'statistics': (2.0, 4),
+    'incidents': (2.0, 4),
+}
+
+MIN_FACTOR = 0.05  # il rate effettivo non scende sotto il 5% di quello nominale
+RECOVERY = 1.05  # moltiplicatore del rate ad ogni risposta buona
+BACKOFF_BASE = 5.0  # secondi (ex RETRY_WAIT)
+BACKOFF_MAX = 120.0
+
+
+def endpoint_of(url):
+    """Classifica un URL delle API nel nome dell'endpoint (graph, statistics, ...)."""
+    path = url.split('?', 1)[0].rstrip('/')
+    if '/scheduled-events/' in path:
+        return 'scheduled-events'
+    return path.rsplit('/', 1)[-1] if '/event/' in path else 'default'
+
+
+class TokenBucket:
+    """Token bucket classico: ``rate`` token al secondo, al massimo ``burst`` accumulati."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, factor=1.0):
+        """Prenota un token e ritorna quanti secondi attendere prima di usarlo."""
+        with self._lock:
+            now = time.monotonic()
+            rate = self.rate * factor
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= 1.0
+            if self._tokens >= 0:
+                return 0.0
+            # Token "in debito": va atteso il tempo necessario a ripagarlo
+            return -self._tokens / rate
+
+
+class RateLimiter:
+    """Budget condiviso di richieste con backoff adattivo su 403/429/risposte vuote."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, endpoint_limits=None):
+        self.rate = rate
+        self._global = TokenBucket(rate, burst)
+        limits = ENDPOINT_LIMITS if endpoint_limits is None else endpoint_limits
+        self._endpoints = {name: TokenBucket(r, b) for name, (r, b) in limits.items()}
+        self._factor = 1.0
+        self._consecutive_refusals = 0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def effective_rate(self):
+        return self.rate * self._factor
+
+    def acquire(self, endpoint='default'):
+        """Blocca finché la richiesta non rientra nel budget (globale + endpoint)."""
+        with self._lock:
+            factor = self._factor
+            cooldown = self._blocked_until - time.monotonic()
+        if cooldown > 0:
+            time.sleep(cooldown)
+
+        wait = self._global.reserve(factor)
+        bucket = self._endpoints.get(endpoint)
+        if bucket is not None:
+            wait = max(wait, bucket.reserve(factor))
+        if wait > 0:
+            time.sleep(wait)
+
+    def report_success(self, endpoint='default'):
+        with self._lock:
+            self._consecutive_refusals = 0
+            self._factor = min(1.0, self._factor * RECOVERY)
+
+    def report_refusal(self, endpoint='default', status=None):
+        """Segnala un 403/429 o una risposta senza JSON: riduce il rate e mette in pausa tutti."""
+        with self._lock:
+            self._consecutive_refusals += 1
+            self._factor = max(MIN_FACTOR, self._factor / 2)
+            delay = self._backoff_delay(self._consecutive_refusals)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            factor = self._factor
+        logging.warning(
+            f"Rate limiter: risposta rifiutata/vuota su '{endpoint}' (status={status}). "
+            f"Rate effettivo {self.rate * factor:.2f} req/s, pausa {delay:.1f}s"
+        )
+
+    @staticmethod
+    def _backoff_delay(attempt):
+        return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempt - 1)))
+
+    def backoff_delay(self, attempt=None):
+        """Attesa suggerita prima di un retry (esponenziale sui rifiuti consecutivi)."""
+        with self._lock:
+            attempt = self._consecutive_refusals if attempt is None else attempt
+        return self._backoff_delay(max(1, attempt))
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_limiter():
+    """Ritorna il limiter condiviso del processo (creato al primo uso)."""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
+
+
+def configure(rate=DEFAULT_RATE, burst=DEFAULT_BURST, endpoint_limits=None):
+    """Sostituisce il limiter condiviso con uno configurato diversamente."""
+    global _default_limiter
+    with _default_lock:
+        _default_limiter = RateLimiter(rate, burst, endpoint_limits)
+        return _default_limiter
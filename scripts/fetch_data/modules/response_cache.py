@@ -0,0 +1,141 @@
+"""
+Cache su disco delle risposte grezze delle API SofaScore.
+
+Ogni payload viene salvato compresso (gzip) in un file il cui nome è lo
+SHA-256 dell'URL, suddiviso in sottocartelle per i primi due caratteri:
+
+    <CACHE_DIR>/3f/3fa9...e1.json.gz
+
+Il file contiene l'URL, il momento del salvataggio, la scadenza (None = mai)
+e il JSON originale. Regole di scadenza:
+
+- match finiti (o cancellati/rinviati definitivamente): non scadono mai;
+- match in corso: scadono dopo pochi secondi/minuti;
+- match programmati o stato sconosciuto: scadenza breve.
+
+Con ``OFFLINE = True`` (o ``offline=True``) vengono restituite anche le voci
+scadute e nessuna richiesta va in rete: utile per ricostruire le tabelle
+senza riscaricare nulla.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+CACHE_DIR = os.environ.get(
+    'PYSOFA_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+)
+ENABLED = True
+OFFLINE = False
+
+# Scadenze in secondi per status.type di SofaScore (None = mai)
+FINAL_STATUSES = ('finished', 'canceled', 'cancelled', 'abandoned', 'awarded')
+TTL_BY_STATUS = {
+    'inprogress': 60,
+    'notstarted': 15 * 60,
+    'postponed': 6 * 3600,
+    'interrupted': 15 * 60,
+}
+DEFAULT_TTL = 15 * 60
+
+
+def ttl_for_status(status_type):
+    """Ritorna la durata di validità (secondi, o None = per sempre) per uno status."""
+    if status_type in FINAL_STATUSES:
+        return None
+    return TTL_BY_STATUS.get(status_type, DEFAULT_TTL)
+
+
+def ttl_for_events(events):
+    """TTL della lista eventi di una data: permanente solo se tutti i match sono conclusi."""
+    statuses = {event.get('status', {}).get('type') for event in events}
+    if statuses and all(status in FINAL_STATUSES for status in statuses):
+        return None
+    return min((ttl_for_status(s) or DEFAULT_TTL) for s in statuses) if statuses else DEFAULT_TTL
+
+
+def cache_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Cache content-addressed (chiave = SHA-256 dell'URL) di payload JSON compressi."""
+
+    def __init__(self, cache_dir=CACHE_DIR, offline=None):
+        self.cache_dir = cache_dir
+        self._offline = offline
+
+    @property
+    def offline(self):
+        return OFFLINE if self._offline is None else self._offline
+
+    def _path(self, url):
+        key = cache_key(url)
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def get(self, url, allow_expired=None):
+        """Ritorna il payload in cache per ``url`` oppure None (assente o scaduto)."""
+        path = self._path(url)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Voce di cache illeggibile per {url}: {e}")
+            return None
+
+        if allow_expired is None:
+            allow_expired = self.offline
+        expires_at = entry.get('expires_at')
+        if expires_at is not None and expires_at < time.time() and not allow_expired:
+            return None
+        return entry.get('data')
+
+    def put(self, url, data, ttl=DEFAULT_TTL):
+        """Salva ``data`` per ``url``. ``ttl=None`` significa che la voce non scade mai."""
+        path = self._path(url)
+        now = time.time()
+        entry = {
+            'url': url,
+            'stored_at': now,
+            'expires_at': None if ttl is None else now + ttl,
+            'data': data,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Scrittura atomica: file temporaneo nella stessa cartella + rename
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def invalidate(self, url):
+        try:
+            os.remove(self._path(url))
+        except FileNotFoundError:
+            pass
+
+
+_default_cache = None
+
+
+def get_cache():
+    """Cache condivisa del processo (None se la cache è disabilitata)."""
+    global _default_cache
+    if not ENABLED:
+        return None
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
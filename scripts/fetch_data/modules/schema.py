@@ -0,0 +1,442 @@
+"""
+Schema versionato del database e runner delle migrazioni.
+
+Le migrazioni sono applicate una sola volta (all'avvio, da ``ensure_schema``)
+e registrate in ``schema_version``; il percorso di scrittura può quindi dare
+per scontato che tabelle, colonne e indici esistano, senza ripetere
+``CREATE TABLE IF NOT EXISTS`` ad ogni match.
+
+Per aggiungere una modifica allo schema (nuova colonna, indice, tabella)
+basta accodare una voce a ``MIGRATIONS`` con il numero di versione successivo.
+Tutte le istruzioni sono idempotenti (IF NOT EXISTS), così lo schema può
+essere applicato anche a database creati dalle versioni precedenti.
+
+Il modulo non ha import relativi e può essere usato anche dagli script in
+``core/`` (es. ``migrate_ht_scores.py``).
+"""
+
+import logging
+
+# Lock consultivo per evitare che più processi (es. worker del backfill)
+# applichino le migrazioni contemporaneamente
+MIGRATION_LOCK_ID = 0x50794F6661  # "PySofa"
+
+_GRAPHICS_COLUMNS = ", ".join(f"possession_{i} FLOAT" for i in range(1, 91))
+
+def secondary_value_sql(expression):
+    """Frammento SQL: numero tra parentesi di una statistica testuale ("5 (2)" → 2), NULL se assente."""
+    return f"substring({expression} from '\\(\\s*(-?[0-9]+(?:\\.[0-9]+)?)')::FLOAT"
+
+
+def _integer_score_sql(column):
+    # Funziona sia sulla colonna TEXT originale sia se è già INT
+    return f"CASE WHEN {column}::TEXT ~ '^-?[0-9]+$' THEN {column}::TEXT::INT END"
+
+
+# Ricostruzione di match_score_timeline per i match restituiti dalla
+# sottoquery {match_ids}: un segmento iniziale 0-0 dal minuto 0 e uno per ogni
+# minuto in cui è stato segnato un gol. Con più gol nello stesso minuto vale
+# l'ultimo, con lo stesso ordinamento di get_matches_by_partial_score.
+# Usata sia dalla migrazione v7 (su tutti i match) sia dall'ingest (db_module).
+SCORE_TIMELINE_INSERT = """
+WITH ids AS (
+    {match_ids}
+), goals AS (
+    SELECT match_id, time AS from_minute, home_score, away_score,
+           ROW_NUMBER() OVER (PARTITION BY match_id, time ORDER BY added_time DESC) AS rn
+    FROM match_incidents_column
+    WHERE match_id IN (SELECT match_id FROM ids)
+      AND incident_type ILIKE '%%goal%%'
+      AND time IS NOT NULL AND home_score IS NOT NULL AND away_score IS NOT NULL
+), states AS (
+    SELECT DISTINCT ON (match_id, from_minute) match_id, from_minute, home_score, away_score
+    FROM (
+        SELECT match_id, 0 AS from_minute, 0 AS home_score, 0 AS away_score, 0 AS priority FROM ids
+        UNION ALL
+        SELECT match_id, from_minute, home_score, away_score, 1 AS priority FROM goals WHERE rn = 1
+    ) s
+    ORDER BY match_id, from_minute, priority DESC
+)
+INSERT INTO match_score_timeline (match_id, from_minute, to_minute, home_score, away_score)
+SELECT match_id, from_minute,
+       LEAD(from_minute) OVER (PARTITION BY match_id ORDER BY from_minute),
+       home_score, away_score
+FROM states;
+"""
+
+MIGRATIONS = [
+    (1, "Tabelle base: matches, grafici, statistiche, incidenti", [
+        """
+        CREATE TABLE IF NOT EXISTS matches (
+            id BIGINT PRIMARY KEY,
+            tournament TEXT,
+            season TEXT,
+            home_team TEXT,
+            away_team TEXT,
+            home_score TEXT,
+            away_score TEXT,
+            status TEXT,
+            start_timestamp BIGINT,
+            home_country TEXT,
+            away_country TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_graphics_json (
+            match_id BIGINT PRIMARY KEY,
+            graphics JSONB
+        );
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS match_graphics_column (
+            match_id BIGINT PRIMARY KEY,
+            {_GRAPHICS_COLUMNS}
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_statistics_json (
+            match_id BIGINT PRIMARY KEY,
+            statistics JSONB
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_statistics_column (
+            match_id BIGINT,
+            period TEXT,
+            groupName TEXT,
+            name TEXT,
+            home TEXT,
+            away TEXT,
+            compareCode INT,
+            statisticsType TEXT,
+            valueType TEXT,
+            homeValue FLOAT,
+            awayValue FLOAT,
+            renderType INT,
+            key TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_incidents_json (
+            match_id BIGINT PRIMARY KEY,
+            incidents JSONB
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_incidents_column (
+            match_id BIGINT,
+            time INT,
+            added_time INT,
+            incident_type TEXT,
+            team_side TEXT,
+            player_name TEXT,
+            home_score INT,
+            away_score INT
+        );
+        """,
+    ]),
+    (2, "Punteggi del primo tempo (ex migrate_ht_scores.py)", [
+        "ALTER TABLE matches ADD COLUMN IF NOT EXISTS home_score_ht INT;",
+        "ALTER TABLE matches ADD COLUMN IF NOT EXISTS away_score_ht INT;",
+    ]),
+    (3, "Normalizzazione incrementale delle statistiche", [
+        "ALTER TABLE match_statistics_json ADD COLUMN IF NOT EXISTS normalized_at TIMESTAMPTZ;",
+        """
+        CREATE INDEX IF NOT EXISTS match_statistics_json_pending_idx
+            ON match_statistics_json (match_id) WHERE normalized_at IS NULL;
+        """,
+    ]),
+    (4, "Checkpoint del backfill", [
+        """
+        CREATE TABLE IF NOT EXISTS backfill_dates (
+            date DATE PRIMARY KEY,
+            status TEXT NOT NULL,
+            attempts INT NOT NULL DEFAULT 0,
+            n_events INT,
+            n_new INT,
+            n_skipped INT,
+            n_failed INT,
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS backfill_matches (
+            match_id BIGINT PRIMARY KEY,
+            date DATE,
+            completed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+    ]),
+    (5, "Indici per le scritture per match sulle tabelle figlie", [
+        # Usati da DELETE ... WHERE match_id = ANY(...) nel BulkWriter e
+        # nella normalizzazione delle statistiche
+        "CREATE INDEX IF NOT EXISTS match_incidents_column_match_id_idx ON match_incidents_column (match_id);",
+        "CREATE INDEX IF NOT EXISTS match_statistics_column_match_id_idx ON match_statistics_column (match_id);",
+    ]),
+    (6, "Chiave primaria delle statistiche e indici per le query di analisi", [
+        # La chiave primaria richiede colonne NOT NULL e righe univoche:
+        # prima normalizziamo i NULL e togliamo i duplicati già presenti
+        """
+        UPDATE match_statistics_column
+        SET period = COALESCE(period, ''), groupName = COALESCE(groupName, ''), name = COALESCE(name, '')
+        WHERE period IS NULL OR groupName IS NULL OR name IS NULL;
+        """,
+        """
+        DELETE FROM match_statistics_column a
+        USING match_statistics_column b
+        WHERE a.match_id = b.match_id AND a.period = b.period
+          AND a.groupName = b.groupName AND a.name = b.name
+          AND a.ctid > b.ctid;
+        """,
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'match_statistics_column_pkey') THEN
+                ALTER TABLE match_statistics_column
+                    ADD CONSTRAINT match_statistics_column_pkey PRIMARY KEY (match_id, period, groupName, name);
+            END IF;
+        END $$;
+        """,
+        # Il prefisso della chiave primaria copre già le ricerche per match_id
+        "DROP INDEX IF EXISTS match_statistics_column_match_id_idx;",
+        # get_stats_by_period / get_stats_dataset / clustering: period + name, letti solo dall'indice
+        """
+        CREATE INDEX IF NOT EXISTS match_statistics_column_period_name_idx
+            ON match_statistics_column (period, name) INCLUDE (match_id, key, homeValue, awayValue);
+        """,
+        # get_matches_by_date e ordinamenti cronologici
+        "CREATE INDEX IF NOT EXISTS matches_start_timestamp_idx ON matches (start_timestamp);",
+        # get_matches_by_ht_score
+        "CREATE INDEX IF NOT EXISTS matches_ht_score_idx ON matches (home_score_ht, away_score_ht);",
+        # get_match_incidents: filtro per match già ordinato per minuto
+        """
+        CREATE INDEX IF NOT EXISTS match_incidents_column_match_time_idx
+            ON match_incidents_column (match_id, time, added_time);
+        """,
+        "DROP INDEX IF EXISTS match_incidents_column_match_id_idx;",
+        # get_matches_by_partial_score: solo i gol, nell'ordine dell'ultimo gol per match.
+        # Il predicato deve coincidere con quello delle query per essere usato.
+        """
+        CREATE INDEX IF NOT EXISTS match_incidents_column_goals_idx
+            ON match_incidents_column (match_id, time DESC, added_time DESC)
+            INCLUDE (home_score, away_score)
+            WHERE incident_type ILIKE '%goal%';
+        """,
+        "ANALYZE matches;",
+        "ANALYZE match_statistics_column;",
+        "ANALYZE match_incidents_column;",
+    ]),
+    (7, "Timeline dei punteggi per minuto (match_score_timeline)", [
+        # Un segmento per ogni punteggio assunto dal match: il punteggio vale
+        # da from_minute (incluso) a to_minute (escluso, NULL = fino alla fine)
+        """
+        CREATE TABLE IF NOT EXISTS match_score_timeline (
+            match_id BIGINT,
+            from_minute INT,
+            to_minute INT,
+            home_score INT,
+            away_score INT,
+            PRIMARY KEY (match_id, from_minute)
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS match_score_timeline_score_idx
+            ON match_score_timeline (home_score, away_score, from_minute)
+            INCLUDE (to_minute, match_id);
+        """,
+        "TRUNCATE match_score_timeline;",
+        SCORE_TIMELINE_INSERT.format(match_ids="SELECT DISTINCT match_id FROM match_incidents_column"),
+        "ANALYZE match_score_timeline;",
+    ]),
+    (8, "Valori numerici tipizzati: punteggi INT e valori secondari delle statistiche", [
+        f"""
+        ALTER TABLE matches
+            ALTER COLUMN home_score TYPE INT USING ({_integer_score_sql('home_score')}),
+            ALTER COLUMN away_score TYPE INT USING ({_integer_score_sql('away_score')});
+        """,
+        """
+        ALTER TABLE match_statistics_column
+            ADD COLUMN IF NOT EXISTS homeSecondary FLOAT,
+            ADD COLUMN IF NOT EXISTS awaySecondary FLOAT;
+        """,
+        f"""
+        UPDATE match_statistics_column
+        SET homeSecondary = {secondary_value_sql('home')}, awaySecondary = {secondary_value_sql('away')}
+        WHERE home LIKE '%(%' OR away LIKE '%(%';
+        """,
+    ]),
+    (9, "Tabella wide delle feature per match e periodo", [
+        # Le colonne home_<chiave>/away_<chiave> vengono aggiunte dall'ingest
+        # (db_module._add_feature_columns) quando compare una chiave nuova
+        """
+        CREATE TABLE IF NOT EXISTS match_features_wide (
+            match_id BIGINT,
+            period TEXT,
+            PRIMARY KEY (match_id, period)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_features_columns (
+            key TEXT PRIMARY KEY,
+            column_suffix TEXT NOT NULL UNIQUE
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS match_features_wide_period_idx ON match_features_wide (period);",
+        # Le statistiche esistenti tornano "da normalizzare": il prossimo
+        # populate_statistics_column riempie la tabella wide
+        "UPDATE match_statistics_json SET normalized_at = NULL;",
+    ]),
+    (10, "Curve del momentum a piena risoluzione (match_graphics_curve)", [
+        # Minuti (anche 45.5 e recupero oltre il 90') e valori come array
+        # paralleli, ordinati per minuto
+        """
+        CREATE TABLE IF NOT EXISTS match_graphics_curve (
+            match_id BIGINT PRIMARY KEY,
+            minutes REAL[] NOT NULL,
+            momentum REAL[] NOT NULL
+        );
+        """,
+        """
+        INSERT INTO match_graphics_curve (match_id, minutes, momentum)
+        SELECT g.match_id,
+               array_agg((p.point->>'minute')::REAL ORDER BY (p.point->>'minute')::REAL, p.ord),
+               array_agg((p.point->>'value')::REAL ORDER BY (p.point->>'minute')::REAL, p.ord)
+        FROM match_graphics_json g
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(g.graphics->'graphPoints') = 'array'
+                 THEN g.graphics->'graphPoints' ELSE '[]'::jsonb END
+        ) WITH ORDINALITY AS p(point, ord)
+        WHERE p.point->>'minute' IS NOT NULL AND p.point->>'value' IS NOT NULL
+        GROUP BY g.match_id
+        ON CONFLICT (match_id) DO NOTHING;
+        """,
+    ]),
+    (11, "Candele OHLC e linee LTTB precalcolate del momentum", [
+        # Una riga per match e ampiezza del bucket (1, 5, 15 minuti), array paralleli
+        """
+        CREATE TABLE IF NOT EXISTS match_graphics_candles (
+            match_id BIGINT NOT NULL,
+            bucket_minutes SMALLINT NOT NULL,
+            minute_start SMALLINT[] NOT NULL,
+            open REAL[] NOT NULL,
+            high REAL[] NOT NULL,
+            low REAL[] NOT NULL,
+            close REAL[] NOT NULL,
+            PRIMARY KEY (match_id, bucket_minutes)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_graphics_lttb (
+            match_id BIGINT PRIMARY KEY,
+            minutes REAL[] NOT NULL,
+            momentum REAL[] NOT NULL
+        );
+        """,
+        # Il riempimento dei match esistenti (LTTB richiede Python) è fatto da
+        # candles.refresh_candles: python migrate_ht_scores.py --build-candles
+    ]),
+    (12, "Modelli di clustering e assegnazioni dei match (match_clusters)", [
+        # Registro delle versioni dei modelli salvati da match_clustering.py
+        """
+        CREATE TABLE IF NOT EXISTS cluster_models (
+            version TEXT PRIMARY KEY,
+            n_clusters SMALLINT NOT NULL,
+            feature_hash TEXT NOT NULL,
+            features JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS match_clusters (
+            match_id BIGINT NOT NULL,
+            model_version TEXT NOT NULL REFERENCES cluster_models (version) ON DELETE CASCADE,
+            cluster SMALLINT NOT NULL,
+            distance REAL,
+            assigned_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (match_id, model_version)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS match_clusters_version_cluster_idx ON match_clusters (model_version, cluster) INCLUDE (match_id);",
+    ]),
+    (13, "Id SofaScore delle squadre (homeTeam.id / awayTeam.id)", [
+        # I match già salvati restano NULL finché non vengono riscaricati
+        # (l'upsert di BulkWriter aggiorna le due colonne)
+        "ALTER TABLE matches ADD COLUMN IF NOT EXISTS home_team_id BIGINT;",
+        "ALTER TABLE matches ADD COLUMN IF NOT EXISTS away_team_id BIGINT;",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_ready_dsns = set()
+
+
+def _create_version_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+
+
+def get_schema_version(conn):
+    """Versione dello schema applicata al database (0 se nessuna)."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+        if not cursor.fetchone()[0]:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+        return cursor.fetchone()[0]
+
+
+def apply_migrations(conn, target=None):
+    """Applica in ordine le migrazioni mancanti (fino a ``target``). Ritorna la versione finale.
+
+    Ogni migrazione gira nella propria transazione insieme alla registrazione
+    in ``schema_version``: se fallisce, nulla di quella migrazione resta applicato.
+    """
+    target = LATEST_VERSION if target is None else target
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+            try:
+                _create_version_table(cursor)
+                conn.commit()
+                cursor.execute("SELECT version FROM schema_version;")
+                applied = {row[0] for row in cursor.fetchall()}
+
+                for version, description, statements in MIGRATIONS:
+                    if version in applied or version > target:
+                        continue
+                    logging.info(f"Migrazione schema v{version}: {description}")
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                        (version, description)
+                    )
+                    conn.commit()
+            finally:
+                conn.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+                conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Errore nell'applicazione delle migrazioni: {type(e).__name__}: {e}")
+        raise
+    return get_schema_version(conn)
+
+
+def ensure_schema(conn):
+    """Garantisce che lo schema sia all'ultima versione; controlla il DB una sola volta per processo."""
+    key = conn.dsn
+    if key in _ready_dsns:
+        return
+    if get_schema_version(conn) < LATEST_VERSION:
+        apply_migrations(conn)
+    else:
+        conn.commit()
+    _ready_dsns.add(key)
@@ -0,0 +1,241 @@
+"""
+Backend di trasporto per le chiamate alle API SofaScore.
+
+Tutti i backend espongono lo stesso metodo ``get_json(url)`` che ritorna il
+JSON già decodificato (oppure None se la risposta non contiene JSON valido):
+
+- ``HttpTransport``: client HTTP con sessione keep-alive e pool di connessioni.
+- ``SeleniumTransport``: il vecchio percorso via Chrome headless + <pre>.
+- ``FallbackTransport``: usa HTTP e passa a Selenium solo se il client
+  semplice viene rifiutato (403/429, challenge, ecc.).
+"""
+
+import json
+import re
+import time
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Backend di default: 'auto' (HTTP con fallback Selenium), 'http' o 'selenium'
+FETCH_BACKEND = 'auto'
+
+HTTP_TIMEOUT = 20  # secondi
+HTTP_POOL_SIZE = 16
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'it-IT,it;q=0.9,en;q=0.8',
+    'Referer': 'https://www.sofascore.com/',
+    'Origin': 'https://www.sofascore.com',
+}
+
+# Status HTTP che indicano un rifiuto del client (non un errore del dato)
+REFUSED_STATUS = (401, 403, 429, 503)
+
+
+class TransportRefused(Exception):
+    """Il server ha rifiutato la richiesta (es. 403/429): conviene cambiare trasporto."""
+
+    def __init__(self, url, status=None, message=None):
+        self.url = url
+        self.status = status
+        super().__init__(message or f"Richiesta rifiutata (status={status}) per {url}")
+
+
+def extract_json_from_pre(page_source):
+    """Estrae e carica il JSON dal tag <pre> della pagina."""
+    json_match = re.search(r'<pre>(.*?)</pre>', page_source, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group(1))
+        except json.JSONDecodeError as e:
+            logging.error(f"Errore nella decodifica JSON: {e}")
+            logging.debug(f"Contenuto raw (primi 500 char): {json_match.group(1)[:500]}")
+    else:
+        # Log diagnostico: cosa c'è nella pagina se non troviamo <pre>?
+        snippet = page_source[:500] if page_source else "(pagina vuota)"
+        logging.warning(f"Tag <pre> non trovato nella risposta. Snippet pagina: {snippet}")
+    return None
+
+
+class HttpTransport:
+    """Client HTTP con sessione condivisa (keep-alive) che ritorna JSON già parsato."""
+
+    name = 'http'
+
+    def __init__(self, timeout=HTTP_TIMEOUT, pool_size=HTTP_POOL_SIZE, headers=None):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        # Nessun retry automatico: i retry sono gestiti dal chiamante (fetching.py)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_json(self, url):
+        logging.debug(f"GET {url} [http]")
+        response = self.session.get(url, timeout=self.timeout)
+        if response.status_code in REFUSED_STATUS:
+            raise TransportRefused(url, response.status_code)
+        try:
+            data = response.json()
+        except ValueError:
+            # HTML al posto del JSON: tipicamente una pagina di challenge anti-bot
+            raise TransportRefused(url, response.status_code, f"Risposta non JSON (status={response.status_code}) per {url}")
+        if response.status_code >= 400:
+            # 404 & co: SofaScore risponde comunque con un JSON {"error": ...}
+            logging.debug(f"Status {response.status_code} per {url}: {data}")
+        return data
+
+    def reset(self):
+        """Chiude le connessioni del pool (verranno riaperte alla prossima richiesta)."""
+        self.session.close()
+
+    def close(self):
+        self.session.close()
+
+
+class SeleniumTransport:
+    """Trasporto via Chrome: carica l'URL e legge il JSON dal tag <pre>.
+
+    Il driver può arrivare da tre fonti:
+
+    - ``pool``: un ``driver_pool.DriverPool``; ogni richiesta prende in
+      prestito un driver caldo (più richieste in parallelo fino alla
+      dimensione del pool) e i driver sopravvivono a ``close``;
+    - ``driver_factory``: crea il driver in modo lazy e lo ricrea dopo un errore;
+    - ``driver``: un driver già pronto (che NON verrà chiuso da ``close``).
+
+    Il ritmo delle richieste è gestito da ``rate_limiter``; ``page_wait``
+    resta solo come attesa extra opzionale dopo il caricamento.
+    """
+
+    name = 'selenium'
+
+    def __init__(self, driver_factory=None, driver=None, page_wait=0, pool=None):
+        if driver_factory is None and driver is None and pool is None:
+            raise ValueError("Serve un driver, una driver_factory o un pool")
+        self.driver_factory = driver_factory
+        self.driver = driver
+        self.pool = pool
+        self.page_wait = page_wait
+        self._owns_driver = driver is None
+        # Un WebDriver non è thread-safe: serializziamo le navigazioni
+        self._lock = threading.Lock()
+
+    def _ensure_driver(self):
+        if self.driver is None:
+            self.driver = self.driver_factory()
+            self._owns_driver = True
+        return self.driver
+
+    def _load(self, driver, url):
+        logging.debug(f"GET {url} [selenium]")
+        driver.get(url)
+        if self.page_wait:
+            time.sleep(self.page_wait)
+        return extract_json_from_pre(driver.page_source)
+
+    def get_json(self, url):
+        if self.pool is not None:
+            with self.pool.lease() as driver:
+                return self._load(driver, url)
+        with self._lock:
+            return self._load(self._ensure_driver(), url)
+
+    def reset(self):
+        """Chiude il driver corrente: il prossimo get_json ne creerà uno nuovo.
+
+        Con un pool non serve: i driver rotti vengono scartati al rientro.
+        """
+        with self._lock:
+            if self.driver is not None and self.driver_factory is not None:
+                try:
+                    self.driver.quit()
+                except Exception:
+                    pass
+                self.driver = None
+
+    def close(self):
+        with self._lock:
+            if self.driver is not None and self._owns_driver:
+                try:
+                    self.driver.quit()
+                except Exception:
+                    pass
+            self.driver = None
+
+
+class FallbackTransport:
+    """HTTP come trasporto principale, Selenium solo quando HTTP viene rifiutato.
+
+    Dopo ``max_refusals`` rifiuti consecutivi il client HTTP viene messo da
+    parte e tutte le richieste successive passano direttamente da Selenium.
+
+    ``on_refusal(status)``, se indicato in ``get_json``, viene chiamato ad ogni
+    rifiuto HTTP prima di passare al fallback: ``fetch_json`` lo usa per
+    segnalare il 403/429 al rate limiter e rispettarne la pausa.
+    """
+
+    name = 'auto'
+
+    def __init__(self, primary, fallback, max_refusals=3):
+        self.primary = primary
+        self.fallback = fallback
+        self.max_refusals = max_refusals
+        self._refusals = 0
+        self._lock = threading.Lock()
+
+    @property
+    def using_fallback(self):
+        return self._refusals >= self.max_refusals
+
+    def get_json(self, url, on_refusal=None):
+        if not self.using_fallback:
+            try:
+                data = self.primary.get_json(url)
+                with self._lock:
+                    self._refusals = 0
+                return data
+            except TransportRefused as e:
+                with self._lock:
+                    self._refusals += 1
+                    refusals = self._refusals
+                logging.warning(f"{e} — uso il fallback {self.fallback.name} ({refusals}/{self.max_refusals})")
+                if refusals == self.max_refusals:
+                    logging.warning(f"Troppi rifiuti consecutivi: passo stabilmente a {self.fallback.name}.")
+                if on_refusal is not None:
+                    on_refusal(e.status)
+        return self.fallback.get_json(url)
+
+    def reset(self):
+        # Dopo un reset ridiamo una possibilità al client HTTP
+        with self._lock:
+            self._refusals = 0
+        self.primary.reset()
+        self.fallback.reset()
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+
+def create_transport(backend=None, driver_factory=None, pool=None):
+    """Crea il trasporto configurato (``FETCH_BACKEND`` se backend è None).
+
+    Per la parte Selenium si usa ``pool`` se fornito, altrimenti ``driver_factory``.
+    """
+    backend = backend or FETCH_BACKEND
+    if backend == 'http':
+        return HttpTransport()
+    if backend == 'selenium':
+        return SeleniumTransport(driver_factory=driver_factory, pool=pool)
+    if backend == 'auto':
+        if driver_factory is None and pool is None:
+            return HttpTransport()
+        return FallbackTransport(HttpTransport(), SeleniumTransport(driver_factory=driver_factory, pool=pool))
+    raise ValueError(f"Backend di fetch sconosciuto: {backend}")